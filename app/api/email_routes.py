@@ -1,34 +1,194 @@
+import base64
 import boto3
 import json
-from ..models import EmailRequest
-from ..core.config import SQS_QUEUE_URL
-from fastapi import APIRouter, HTTPException
+import threading
+from ..models import EmailRequest, TemplateRequest
+from ..services.templates import template_store
+from ..core.metrics import metrics, lambda_metrics
+from ..core.logging_config import configure_logging
+from ..core.claim_check import claim_check
+from ..core.exceptions import BatchTooLargeError
+from ..core.config import BULK_MAX_ITEMS, SQS_PRODUCER_MAX_LINGER_MS, SQS_PRODUCER_MAX_BATCH_SIZE, PRIORITY_LANES, BULK_PRIORITY_LANE
+from ..core.lanes import HIGH_PRIORITY_LANE, lane_queue_url
+from .sqs_producer import enqueue_batch, SQSBatchProducer
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
 
-# Inicializa el cliente de SQS
-sqs_client = boto3.client('sqs', region_name='us-east-2')
+configure_logging()
+
+# Cliente de SQS creado en el primer encolado para no pagarlo al importar (arranque en frío)
+sqs_client = None
+sqs_client_lock = threading.Lock()
+
+
+def get_sqs_client():
+    """
+    Devuelve el cliente de SQS del proceso, creándolo la primera vez.
+    """
+    global sqs_client
+    if sqs_client is None:
+        with sqs_client_lock:
+            if sqs_client is None:
+                sqs_client = boto3.client('sqs', region_name='us-east-2')
+    return sqs_client
+
+
+# Agrupa los encolados concurrentes de /send-email/ en llamadas SendMessageBatch, por carril
+producers = {
+    lane: SQSBatchProducer(
+        get_sqs_client,
+        lane_queue_url(lane),
+        max_linger=SQS_PRODUCER_MAX_LINGER_MS / 1000,
+        max_batch_size=SQS_PRODUCER_MAX_BATCH_SIZE
+    )
+    for lane in PRIORITY_LANES
+}
 
 router = APIRouter()
 
 @router.post("/send-email/")
 async def send_email(request: EmailRequest) -> dict:
     """
-    Endpoint para encolar un correo electrónico en SQS.
+    Endpoint para encolar un correo electrónico en SQS, en el carril de alta prioridad salvo
+    que indique otro.
     """
+    request.priority = request.priority or HIGH_PRIORITY_LANE
     try:
-        # Serializa el contenido del email para encolarlo en SQS
-        message_body = json.dumps(request.dict())
+        with metrics.timer("api_enqueue_seconds", route="send_email"):
+            # Serializa el contenido del email para encolarlo en SQS; subir un cuerpo grande
+            # al blob store es bloqueante, así que se hace fuera del event loop
+            if claim_check.offloads(request.body):
+                message_body = await run_in_threadpool(claim_check.dump, request)
+            else:
+                message_body = claim_check.dump(request)
 
-        # Enviar mensaje a la cola SQS
-        sqs_client.send_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MessageBody=message_body
-        )
+            # Enviar mensaje a la cola SQS sin bloquear el event loop
+            await producers[request.priority].send(message_body)
         return {"message": "Email queued successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al encolar el correo: {str(e)}")
 
+@router.post("/send-email/batch")
+async def send_email_batch(request: Request) -> dict:
+    """
+    Endpoint para encolar un lote de correos (arreglo JSON o NDJSON) con SendMessageBatch,
+    en el carril masivo salvo que cada correo indique otro.
+    """
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type:
+            raw_items = [line async for line in iter_ndjson_lines(request.stream(), BULK_MAX_ITEMS)]
+        else:
+            raw_items = parse_bulk_body(await request.body(), content_type)
+            if len(raw_items) > BULK_MAX_ITEMS:
+                raise BatchTooLargeError(f"El lote supera el máximo de {BULK_MAX_ITEMS} correos.")
+    except BatchTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Lote inválido: {str(e)}")
+
+    # El encolado es bloqueante (boto3), así que se ejecuta fuera del event loop
+    return await run_in_threadpool(enqueue_bulk, raw_items)
+
+@router.put("/templates/{template_id}")
+async def register_template(template_id: str, request: TemplateRequest) -> dict:
+    """
+    Endpoint para registrar o reemplazar una plantilla; los workers toman los cambios al
+    vencer su caché de plantillas.
+    """
+    try:
+        # El guardado en Redis es bloqueante, así que se hace fuera del event loop
+        await run_in_threadpool(template_store.register, template_id, request.subject, request.body, request.provider_templates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Plantilla inválida: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al guardar la plantilla: {str(e)}")
+    return {"message": "Template registered successfully", "template_id": template_id}
+
+
+async def iter_ndjson_lines(stream, max_items: int = BULK_MAX_ITEMS):
+    """
+    Recorre un cuerpo NDJSON recibido por partes y devuelve sus líneas no vacías. Cada parte
+    se separa al llegar y sólo se guarda la línea incompleta, así que cada byte se copia una
+    vez. Lanza BatchTooLargeError en cuanto hay más de max_items líneas, sin leer el resto.
+    """
+    pending = bytearray()
+    count = 0
+    async for chunk in stream:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                break
+            pending += chunk[start:end]
+            start = end + 1
+            if pending.strip():
+                count += 1
+                if count > max_items:
+                    raise BatchTooLargeError(f"El lote supera el máximo de {max_items} correos.")
+                yield bytes(pending)
+            pending.clear()
+        pending += chunk[start:]
+    if pending.strip():
+        if count + 1 > max_items:
+            raise BatchTooLargeError(f"El lote supera el máximo de {max_items} correos.")
+        yield bytes(pending)
+
+
+def parse_bulk_body(raw_body: bytes, content_type: str) -> list:
+    """
+    Separa el cuerpo de una solicitud de lote en sus elementos, sea un arreglo JSON o NDJSON.
+    """
+    text = raw_body.decode("utf-8")
+    if "ndjson" in content_type or not text.lstrip().startswith("["):
+        return [line for line in text.splitlines() if line.strip()]
+
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("Se esperaba un arreglo JSON o NDJSON.")
+    return items
+
+
+def validate_email_item(raw_item, default_priority: str = BULK_PRIORITY_LANE) -> tuple:
+    """
+    Valida un elemento del lote y devuelve (mensaje serializado para SQS, carril, error).
+    """
+    try:
+        data = json.loads(raw_item) if isinstance(raw_item, (str, bytes)) else raw_item
+        email_data = EmailRequest(**data)
+        email_data.priority = email_data.priority or default_priority
+        return claim_check.dump(email_data), email_data.priority, None
+    except Exception as e:
+        return None, None, f"Solicitud inválida: {str(e)}"
+
+
+def enqueue_bulk(raw_items: list) -> dict:
+    """
+    Valida los elementos del lote, encola los válidos y reporta el resultado de cada uno.
+    """
+    validated = [validate_email_item(raw_item) for raw_item in raw_items]
+    results = [{"index": index, "status": "invalid", "error": error} for index, (_, _, error) in enumerate(validated)]
+
+    # Un encolado por cola; los carriles que comparten cola van juntos
+    indexes_by_queue = {}
+    for index, (message_body, lane, _) in enumerate(validated):
+        if message_body is not None:
+            indexes_by_queue.setdefault(lane_queue_url(lane), []).append(index)
+
+    for queue_url, valid_indexes in indexes_by_queue.items():
+        enqueue_errors = enqueue_batch(get_sqs_client(), queue_url, [validated[index][0] for index in valid_indexes])
+        for index, error in zip(valid_indexes, enqueue_errors):
+            if error is None:
+                results[index] = {"index": index, "status": "queued"}
+            else:
+                results[index] = {"index": index, "status": "failed", "error": error}
+
+    queued = sum(1 for result in results if result["status"] == "queued")
+    return {"queued": queued, "failed": len(results) - queued, "results": results}
+
 
 # Aquí está el lambda_handler para AWS Lambda
+@lambda_metrics("send_email")
 def lambda_handler(event, context) -> dict:
     """
     Lambda handler que procesa las solicitudes HTTP de API Gateway.
@@ -39,13 +199,14 @@ def lambda_handler(event, context) -> dict:
         
         # Convertir el cuerpo de la solicitud en el modelo de EmailRequest
         email_data = EmailRequest(**body)
+        email_data.priority = email_data.priority or HIGH_PRIORITY_LANE
         
         # Serializa el contenido del email para encolarlo en SQS
-        message_body = json.dumps(email_data.dict())
+        message_body = claim_check.dump(email_data)
 
-        # Enviar mensaje a la cola SQS
-        sqs_client.send_message(
-            QueueUrl=SQS_QUEUE_URL,
+        # Enviar mensaje a la cola SQS del carril
+        get_sqs_client().send_message(
+            QueueUrl=lane_queue_url(email_data.priority),
             MessageBody=message_body
         )
 
@@ -61,3 +222,37 @@ def lambda_handler(event, context) -> dict:
             "statusCode": 500,
             "body": json.dumps({"message": f"Error al encolar el correo: {str(e)}"})
         }
+
+
+@lambda_metrics("send_email_batch")
+def batch_lambda_handler(event, context) -> dict:
+    """
+    Lambda handler que encola un lote de correos recibido desde API Gateway.
+    """
+    try:
+        raw_body = event.get('body') or ''
+        raw_body = base64.b64decode(raw_body) if event.get('isBase64Encoded') else raw_body.encode('utf-8')
+        headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+        raw_items = parse_bulk_body(raw_body, headers.get('content-type', ''))
+
+        if len(raw_items) > BULK_MAX_ITEMS:
+            return {
+                "statusCode": 413,
+                "body": json.dumps({"message": f"El lote supera el máximo de {BULK_MAX_ITEMS} correos."})
+            }
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps(enqueue_bulk(raw_items))
+        }
+
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"message": f"Lote inválido: {str(e)}"})
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"message": f"Error al encolar el lote: {str(e)}"})
+        }
@@ -0,0 +1,146 @@
+# api/sqs_producer.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from ..core.config import SQS_BATCH_MAX_PARALLEL
+
+# Límites de SendMessageBatch impuestos por SQS
+SQS_BATCH_MAX_ENTRIES = 10
+SQS_BATCH_MAX_BYTES = 256 * 1024
+
+# Pool compartido para enviar los lotes de 10 en paralelo
+executor = ThreadPoolExecutor(max_workers=SQS_BATCH_MAX_PARALLEL)
+
+
+def chunk_message_bodies(message_bodies: list) -> list:
+    """
+    Agrupa los mensajes en lotes que respetan el máximo de entradas y de bytes de SQS.
+    Devuelve listas de tuplas (índice original, cuerpo del mensaje).
+    """
+    chunks, current, current_bytes = [], [], 0
+    for index, message_body in enumerate(message_bodies):
+        size = len(message_body.encode("utf-8"))
+        if current and (len(current) == SQS_BATCH_MAX_ENTRIES or current_bytes + size > SQS_BATCH_MAX_BYTES):
+            chunks.append(current)
+            current, current_bytes = [], 0
+        current.append((index, message_body))
+        current_bytes += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def send_message_batch(sqs_client, queue_url: str, chunk: list) -> dict:
+    """
+    Envía un lote a SQS y devuelve {índice: error} con None para los mensajes encolados.
+    """
+    try:
+        response = sqs_client.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{"Id": str(index), "MessageBody": message_body} for index, message_body in chunk]
+        )
+    except Exception as e:
+        return {index: str(e) for index, _ in chunk}
+
+    results = {index: "Sin respuesta de SQS para el mensaje" for index, _ in chunk}
+    for entry in response.get("Successful", []):
+        results[int(entry["Id"])] = None
+    for entry in response.get("Failed", []):
+        results[int(entry["Id"])] = f"{entry.get('Code')}: {entry.get('Message', '')}"
+    return results
+
+
+def enqueue_batch(sqs_client, queue_url: str, message_bodies: list) -> list:
+    """
+    Encola los mensajes con SendMessageBatch en lotes paralelos.
+    Devuelve, en el orden de entrada, None para cada mensaje encolado o el error correspondiente.
+    """
+    futures = [
+        executor.submit(send_message_batch, sqs_client, queue_url, chunk)
+        for chunk in chunk_message_bodies(message_bodies)
+    ]
+    results: list[Optional[str]] = [None] * len(message_bodies)
+    for future in futures:
+        for index, error in future.result().items():
+            results[index] = error
+    return results
+
+
+class SQSBatchProducer:
+    """
+    Productor asíncrono que agrupa los encolados concurrentes en llamadas SendMessageBatch.
+
+    Cada llamada a send espera como máximo max_linger segundos a que lleguen otros mensajes;
+    el lote se envía al completarse max_batch_size mensajes o al vencer la espera. La llamada
+    a boto3 se ejecuta en el pool de hilos para no bloquear el event loop, y cada llamador
+    recibe el resultado de su propio mensaje.
+    """
+
+    def __init__(self, client_getter, queue_url: str, max_linger: float, max_batch_size: int = SQS_BATCH_MAX_ENTRIES) -> None:
+        self._get_client = client_getter
+        self._queue_url = queue_url
+        self._max_linger = max_linger
+        self._max_batch_size = min(max_batch_size, SQS_BATCH_MAX_ENTRIES)
+        self._loop = None
+        self._pending = []
+        self._pending_bytes = 0
+        self._flush_handle = None
+        # Referencias a los envíos en curso para que no los recolecte el GC
+        self._tasks = set()
+
+    async def send(self, message_body: str) -> None:
+        """
+        Encola un mensaje; lanza RuntimeError si SQS lo rechaza.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Los lotes pendientes pertenecen a un único event loop
+            self._loop, self._pending, self._pending_bytes, self._flush_handle = loop, [], 0, None
+
+        size = len(message_body.encode("utf-8"))
+        if self._pending and self._pending_bytes + size > SQS_BATCH_MAX_BYTES:
+            self._flush()
+
+        future = loop.create_future()
+        self._pending.append((message_body, future))
+        self._pending_bytes += size
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_linger, self._flush)
+
+        await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        if batch:
+            task = self._loop.create_task(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: list) -> None:
+        chunk = [(index, message_body) for index, (message_body, _) in enumerate(batch)]
+        try:
+            results = await self._loop.run_in_executor(executor, self._send_chunk, chunk)
+        except Exception as e:
+            # Sin cliente de SQS no se encoló ningún mensaje; cada llamador recibe el error
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Error al encolar en SQS: {e}"))
+            return
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            error = results[index]
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def _send_chunk(self, chunk: list) -> dict:
+        # Crear el cliente de boto3 la primera vez también es bloqueante
+        return send_message_batch(self._get_client(), self._queue_url, chunk)
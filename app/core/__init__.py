@@ -1,2 +1,4 @@
 from .redis_handler import RedisHandler
-from .circuit_breaker import get_circuit_breakers
\ No newline at end of file
+from .circuit_breaker import get_circuit_breakers
+from .routing_state import RoutingStateCache
+from .metrics import metrics, lambda_metrics
@@ -1,12 +1,274 @@
 # core/circuit_breaker.py
+import asyncio
+import logging as logger
 import pybreaker
+import redis
+import threading
+import time
+from datetime import datetime, timedelta
+from .config import CIRCUIT_BREAKER_FAIL_MAX, CIRCUIT_BREAKER_RESET_TIMEOUT, CIRCUIT_BREAKER_KEY, CIRCUIT_BREAKER_PROBE_TIMEOUT, CIRCUIT_BREAKER_STATE_TTL
+from .redis_handler import get_redis_client, get_async_redis_client
+from .exceptions import ProviderThrottledError
+from .metrics import metrics
 
-# Configuración de circuit breakers
-sendgrid_circuit_breaker = pybreaker.CircuitBreaker(fail_max=3, reset_timeout=60)
-ses_circuit_breaker = pybreaker.CircuitBreaker(fail_max=3, reset_timeout=60)
 
-def get_circuit_breakers():
-    return {
-        "SendGrid": sendgrid_circuit_breaker,
-        "Amazon SES": ses_circuit_breaker
-    }
+class LocalCircuitStorage(pybreaker.CircuitMemoryStorage):
+    """
+    Estado del breaker en memoria, con el lock de prueba half-open local al proceso.
+    """
+
+    def __init__(self, state: str = pybreaker.STATE_CLOSED) -> None:
+        super().__init__(state)
+        self._probe_lock = threading.Lock()
+
+    async def read_state_async(self) -> str:
+        return self.state
+
+    def acquire_probe(self, timeout: float) -> bool:
+        return self._probe_lock.acquire(blocking=False)
+
+    def release_probe(self) -> None:
+        if self._probe_lock.locked():
+            self._probe_lock.release()
+
+
+class RedisCircuitStorage(pybreaker.CircuitBreakerStorage):
+    """
+    Estado del breaker compartido en Redis por todas las instancias (contenedores Lambda y workers).
+
+    El estado, el contador de fallos y la hora de apertura viven en un hash por proveedor y
+    se leen en un solo HMGET al consultar el estado; el contador y opened_at devuelven lo leído
+    en esa consulta. Si Redis falla se asume el breaker cerrado, como hace pybreaker.
+
+    El caso habitual, cerrado y sin fallos, se reutiliza durante state_ttl segundos sin volver
+    a Redis, así un envío no paga un viaje extra por consultar el breaker. Cualquier otro
+    estado se relee en cada consulta para que las transiciones se coordinen entre instancias.
+    """
+
+    def __init__(self, provider_name: str, redis_object=None, key_prefix: str = CIRCUIT_BREAKER_KEY,
+                 state_ttl: float = CIRCUIT_BREAKER_STATE_TTL) -> None:
+        super().__init__("redis")
+        self._redis_object = redis_object
+        self._key = f"{key_prefix}:{provider_name}"
+        self._probe_key = f"{self._key}:probe"
+        self._state_ttl = state_ttl
+        self._state = None
+        self._loaded_at = 0.0
+        self._counter = 0
+        self._opened_at = None
+
+    @property
+    def _redis(self):
+        # Sin cliente explícito se usa el del proceso, creado en el primer uso
+        return self._redis_object if self._redis_object is not None else get_redis_client()
+
+    @property
+    def state(self) -> str:
+        if self._cached_state_is_fresh():
+            return self._state
+        try:
+            values = self._redis.hmget(self._key, "state", "fail_counter", "opened_at")
+        except redis.RedisError:
+            logger.exception("Error de Redis al leer el circuit breaker; se asume cerrado.")
+            return pybreaker.STATE_CLOSED
+        return self._remember(values)
+
+    async def read_state_async(self) -> str:
+        """
+        Versión asíncrona de state, con el cliente asíncrono de Redis. Con un cliente propio
+        (redis_object) se lee con ese cliente.
+        """
+        if self._redis_object is not None or self._cached_state_is_fresh():
+            return self.state
+        try:
+            values = await get_async_redis_client().hmget(self._key, "state", "fail_counter", "opened_at")
+        except redis.RedisError:
+            logger.exception("Error de Redis al leer el circuit breaker; se asume cerrado.")
+            return pybreaker.STATE_CLOSED
+        return self._remember(values)
+
+    @state.setter
+    def state(self, state: str) -> None:
+        self._state = state
+        try:
+            self._redis.hset(self._key, "state", state)
+        except redis.RedisError:
+            logger.exception("Error de Redis al guardar el estado del circuit breaker.")
+
+    def _cached_state_is_fresh(self) -> bool:
+        return (
+            self._state == pybreaker.STATE_CLOSED and self._counter == 0
+            and time.monotonic() - self._loaded_at < self._state_ttl
+        )
+
+    def _remember(self, values: list) -> str:
+        """
+        Guarda en el proceso el estado leído de Redis (state, fail_counter, opened_at).
+        """
+        state, counter, opened_at = values
+        self._counter = int(counter or 0)
+        self._opened_at = datetime.utcfromtimestamp(float(opened_at)) if opened_at else None
+        self._state = state or pybreaker.STATE_CLOSED
+        self._loaded_at = time.monotonic()
+        return self._state
+
+    def increment_counter(self) -> None:
+        try:
+            self._counter = self._redis.hincrby(self._key, "fail_counter", 1)
+        except redis.RedisError:
+            logger.exception("Error de Redis al incrementar los fallos del circuit breaker.")
+
+    def reset_counter(self) -> None:
+        # En el caso habitual no hay fallos acumulados y se evita la escritura por envío
+        if self._counter == 0:
+            return
+        try:
+            self._redis.hset(self._key, "fail_counter", 0)
+            self._counter = 0
+        except redis.RedisError:
+            logger.exception("Error de Redis al reiniciar los fallos del circuit breaker.")
+
+    @property
+    def counter(self) -> int:
+        return self._counter
+
+    @property
+    def opened_at(self):
+        return self._opened_at
+
+    @opened_at.setter
+    def opened_at(self, now: datetime) -> None:
+        self._opened_at = now
+        try:
+            self._redis.hset(self._key, "opened_at", time.time())
+        except redis.RedisError:
+            logger.exception("Error de Redis al guardar la apertura del circuit breaker.")
+
+    def acquire_probe(self, timeout: float) -> bool:
+        """
+        Sólo una instancia obtiene el permiso para la llamada de prueba en half-open; el TTL
+        lo libera si esa instancia muere a mitad de la prueba.
+        """
+        try:
+            return bool(self._redis.set(self._probe_key, 1, nx=True, ex=max(int(timeout), 1)))
+        except redis.RedisError:
+            logger.exception("Error de Redis al tomar el permiso de prueba del circuit breaker.")
+            return True
+
+    def release_probe(self) -> None:
+        try:
+            self._redis.delete(self._probe_key)
+        except redis.RedisError:
+            logger.exception("Error de Redis al liberar el permiso de prueba del circuit breaker.")
+
+
+class ConcurrentCircuitBreaker(pybreaker.CircuitBreaker):
+    """
+    CircuitBreaker que no mantiene el lock durante la llamada protegida.
+
+    pybreaker serializa todas las llamadas de un mismo breaker con su RLock, lo que
+    impide enviar en paralelo con un proveedor. Aquí el lock sólo protege las
+    transiciones de estado, no la llamada al proveedor. En half-open sólo pasa la
+    llamada que obtiene el permiso de prueba; el resto se rechaza como si estuviera abierto.
+    """
+
+    def __init__(self, *args, probe_timeout: float = CIRCUIT_BREAKER_PROBE_TIMEOUT, **kwargs) -> None:
+        kwargs.setdefault("state_storage", LocalCircuitStorage())
+        super().__init__(*args, **kwargs)
+        self.probe_timeout = probe_timeout
+
+    def call(self, func, *args, **kwargs):
+        state, probing = self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self._after_call_locked(probing, state._handle_error, e)
+        self._after_call_locked(probing, state._handle_success)
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """
+        Equivalente a call para corrutinas, sin depender de tornado como pybreaker. El estado
+        se lee con el cliente asíncrono de Redis; el permiso de prueba, los fallos y el cierre
+        tras una prueba escriben con el cliente síncrono, así que se registran en un hilo.
+        """
+        current_state = await self._state_storage.read_state_async()
+        if current_state == pybreaker.STATE_CLOSED:
+            state, probing = self._before_call(current_state)
+        else:
+            state, probing = await asyncio.to_thread(self._before_call, current_state)
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            await asyncio.to_thread(self._after_call_locked, probing, state._handle_error, e)
+        if probing:
+            await asyncio.to_thread(self._after_call_locked, probing, state._handle_success)
+        else:
+            self._after_call_locked(probing, state._handle_success)
+        return result
+
+    def _before_call(self, current_state: str = None):
+        """
+        Valida el estado del breaker y, si venció el reset_timeout, intenta ser la instancia
+        que prueba la recuperación. current_state es el estado ya leído del storage, si se
+        tiene. Devuelve (estado, si esta llamada es la prueba).
+        """
+        with metrics.timer("email_stage_seconds", stage="breaker_check"), self._lock:
+            state = self.state if current_state is None else self._state_from(current_state)
+            if state.name == pybreaker.STATE_CLOSED:
+                return state, False
+
+            if state.name == pybreaker.STATE_OPEN:
+                opened_at = self._state_storage.opened_at
+                if opened_at and datetime.utcnow() < opened_at + timedelta(seconds=self.reset_timeout):
+                    raise pybreaker.CircuitBreakerError("Timeout not elapsed yet, circuit breaker still open")
+
+            if not self._state_storage.acquire_probe(self.probe_timeout):
+                raise pybreaker.CircuitBreakerError("Another instance is probing the provider, circuit breaker still open")
+            if state.name == pybreaker.STATE_OPEN:
+                self.half_open()
+                state = self.state
+            return state, True
+
+    def _state_from(self, current_state: str):
+        """
+        Igual que la propiedad state de pybreaker, pero con el estado ya leído del storage.
+        """
+        if current_state != self._state.name:
+            self.state = current_state
+        return self._state
+
+    def _after_call_locked(self, probing, handler, *args):
+        with self._lock:
+            self._after_call(probing, handler, *args)
+
+    def _after_call(self, probing, handler, *args):
+        """
+        Aplica el resultado de la llamada y libera el permiso de prueba si se tenía.
+        """
+        try:
+            handler(*args)
+        finally:
+            if probing:
+                self._state_storage.release_probe()
+
+
+# Un circuit breaker por proveedor; su estado se comparte entre instancias a través de Redis
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(provider_name):
+    with circuit_breakers_lock:
+        if provider_name not in circuit_breakers:
+            circuit_breakers[provider_name] = ConcurrentCircuitBreaker(
+                fail_max=CIRCUIT_BREAKER_FAIL_MAX,
+                reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT,
+                state_storage=RedisCircuitStorage(provider_name),
+                # El throttling no indica que el proveedor esté caído
+                exclude=[ProviderThrottledError],
+                name=provider_name
+            )
+        return circuit_breakers[provider_name]
+
+def get_circuit_breakers(provider_names=("SendGrid", "Amazon SES")):
+    return {provider_name: get_circuit_breaker(provider_name) for provider_name in provider_names}
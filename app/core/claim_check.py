@@ -0,0 +1,171 @@
+# core/claim_check.py
+import boto3
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from functools import cached_property
+from .config import (
+    AWS_REGION, CLAIM_CHECK_THRESHOLD_BYTES, CLAIM_CHECK_BACKEND, CLAIM_CHECK_BUCKET,
+    CLAIM_CHECK_PREFIX, CLAIM_CHECK_LOCAL_PATH, CLAIM_CHECK_CACHE_SIZE
+)
+
+# Campo del mensaje de SQS que reemplaza a body cuando el cuerpo se guardó en el blob store
+BODY_REF_FIELD = "body_ref"
+BODY_REF_SCHEME = "sha256:"
+
+
+class S3BlobStore:
+    """
+    Blobs en un bucket de S3, con el cliente creado en el primer uso.
+    """
+
+    def __init__(self, bucket: str, prefix: str = CLAIM_CHECK_PREFIX) -> None:
+        self.bucket = bucket
+        self.prefix = prefix
+
+    @cached_property
+    def client(self):
+        return boto3.client('s3', region_name=os.getenv("AWS_REGION", AWS_REGION))
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+
+
+class LocalBlobStore:
+    """
+    Blobs en un directorio local, para pruebas y desarrollo.
+    """
+
+    def __init__(self, path: str = CLAIM_CHECK_LOCAL_PATH) -> None:
+        self.path = path
+
+    def put(self, key: str, data: bytes) -> None:
+        target = os.path.join(self.path, key)
+        if os.path.exists(target):
+            return
+        os.makedirs(self.path, exist_ok=True)
+        # Se escribe a un archivo temporal y se renombra para no dejar blobs a medias
+        temporary = f"{target}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, target)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.path, key), "rb") as f:
+            return f.read()
+
+
+def get_blob_store():
+    """
+    Crea el blob store configurado en CLAIM_CHECK_BACKEND.
+    """
+    if CLAIM_CHECK_BACKEND == "s3":
+        return S3BlobStore(os.getenv("CLAIM_CHECK_BUCKET", CLAIM_CHECK_BUCKET))
+    if CLAIM_CHECK_BACKEND == "local":
+        return LocalBlobStore()
+    raise ValueError(f"Backend de claim check desconocido: {CLAIM_CHECK_BACKEND}")
+
+
+class ClaimCheck:
+    """
+    Serializa los correos para SQS sacando del mensaje los cuerpos grandes.
+
+    Un cuerpo de más de threshold bytes se comprime con zlib y se guarda una sola vez en el
+    blob store con su sha256 como clave; el mensaje sólo lleva la referencia. Al leer, los
+    cuerpos se resuelven a través de una caché LRU, así que un cuerpo repetido en muchos
+    mensajes se descarga y descomprime una vez por contenedor.
+    """
+
+    def __init__(self, store=None, threshold: int = CLAIM_CHECK_THRESHOLD_BYTES, cache_size: int = CLAIM_CHECK_CACHE_SIZE) -> None:
+        self._store = store
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # Digests ya subidos por este proceso y cuerpos ya resueltos, del menos al más reciente
+        self._stored = OrderedDict()
+        self._bodies = OrderedDict()
+
+    @property
+    def store(self):
+        # El blob store se crea en el primer cuerpo grande (arranque en frío)
+        if self._store is None:
+            self._store = get_blob_store()
+        return self._store
+
+    def _remember(self, cache: OrderedDict, key: str, value) -> None:
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def offloads(self, body: str) -> bool:
+        """
+        Indica si el cuerpo se guardará en el blob store. En UTF-8 cada carácter ocupa entre 1 y
+        4 bytes, así que sólo se codifica el cuerpo cuando la longitud no basta para decidir.
+        """
+        if not body:
+            return False
+        if len(body) > self.threshold:
+            return True
+        if len(body) * 4 <= self.threshold:
+            return False
+        return len(body.encode("utf-8")) > self.threshold
+
+    def dump(self, email_data) -> str:
+        """
+        Serializa el EmailRequest para SQS, reemplazando el cuerpo por su referencia si es grande.
+        """
+        # Sin los campos con su valor por defecto (por ejemplo, los de plantilla en un correo sin ella)
+        data = email_data.dict(exclude_defaults=True)
+        if not self.offloads(data.get("body")):
+            return json.dumps(data)
+
+        raw_body = data.pop("body").encode("utf-8")
+        digest = hashlib.sha256(raw_body).hexdigest()
+        if digest not in self._stored:
+            self.store.put(digest, zlib.compress(raw_body))
+        self._remember(self._stored, digest, True)
+        data[BODY_REF_FIELD] = BODY_REF_SCHEME + digest
+        return json.dumps(data)
+
+    def load(self, message_body: str) -> dict:
+        """
+        Deserializa un mensaje de SQS y resuelve la referencia al cuerpo si la tiene.
+        """
+        data = json.loads(message_body)
+        body_ref = data.pop(BODY_REF_FIELD, None)
+        if body_ref is not None:
+            data["body"] = self.resolve(body_ref)
+        return data
+
+    def resolve(self, body_ref: str) -> str:
+        """
+        Devuelve el cuerpo de una referencia, desde la caché o desde el blob store.
+        """
+        with self._lock:
+            body = self._bodies.get(body_ref)
+            if body is not None:
+                self._bodies.move_to_end(body_ref)
+                return body
+
+        if not body_ref.startswith(BODY_REF_SCHEME):
+            raise ValueError(f"Referencia de cuerpo inválida: {body_ref}")
+        digest = body_ref[len(BODY_REF_SCHEME):]
+        raw_body = zlib.decompress(self.store.get(digest))
+        if hashlib.sha256(raw_body).hexdigest() != digest:
+            raise ValueError(f"El cuerpo guardado no coincide con su referencia: {body_ref}")
+
+        body = raw_body.decode("utf-8")
+        self._remember(self._bodies, body_ref, body)
+        return body
+
+
+# Instancia compartida por la API (al encolar) y el worker (al leer)
+claim_check = ClaimCheck()
@@ -11,4 +11,112 @@ SENDGRID_API_KEY =
 AWS_ACCESS_KEY_ID = 
 AWS_SECRET_ACCESS_KEY = 
 SES_EMAIL_FROM = 
-AWS_REGION = 
\ No newline at end of file
+AWS_REGION = 
+WORKER_MAX_CONCURRENCY = 10
+PROVIDER_MAX_CONCURRENCY = 5
+ROUTING_STATE_TTL = 1.0
+LATENCY_QUANTILE_STEP = 0.05
+ROUTING_LATENCY_PERCENTILE = "p95"
+SQS_BATCH_MAX_PARALLEL = 8
+BULK_MAX_ITEMS = 5000
+SQS_PRODUCER_MAX_LINGER_MS = 5
+SQS_PRODUCER_MAX_BATCH_SIZE = 10
+BULK_MIN_GROUP_SIZE = 2
+SENDGRID_API_HOST = "https://api.sendgrid.com"
+PROVIDER_HTTP_MAX_CONNECTIONS = 100
+PROVIDER_HTTP_MAX_KEEPALIVE = 20
+# Proveedores de correo en orden de preferencia; rate (envíos/s) y burst configuran su
+# cuota de envío y las claves adicionales van al constructor
+EMAIL_PROVIDERS = [
+    {"name": "SendGrid", "type": "sendgrid", "weight": 1, "rate": 100, "burst": 200},
+    {"name": "Amazon SES", "type": "ses", "weight": 1, "rate": 14, "burst": 14},
+]
+ROUTING_STRATEGY = "consecutive_use"
+CIRCUIT_BREAKER_FAIL_MAX = 3
+CIRCUIT_BREAKER_RESET_TIMEOUT = 60
+CIRCUIT_BREAKER_KEY = "circuit_breaker"
+CIRCUIT_BREAKER_PROBE_TIMEOUT = 30
+# Segundos que un proceso reutiliza el estado cerrado y sin fallos de un breaker sin releerlo de Redis
+CIRCUIT_BREAKER_STATE_TTL = 1.0
+RATE_LIMIT_KEY = "rate_limit"
+METRICS_NAMESPACE = "EmailService"
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "json"
+LOG_QUEUE_SIZE = 10000
+# Fracción de logs del camino de envío que se conserva por nivel (WARNING y superiores, siempre)
+LOG_SAMPLE_RATES = {"DEBUG": 0.01, "INFO": 0.1}
+IDEMPOTENCY_KEY = "idempotency"
+# Segundos que se recuerda un mensaje enviado y que dura la reserva de uno en proceso
+# (debe cubrir el visibility timeout de la cola)
+IDEMPOTENCY_TTL = 86400
+IDEMPOTENCY_PENDING_TTL = 300
+IDEMPOTENCY_LOCAL_SIZE = 10000
+# Los cuerpos de más de CLAIM_CHECK_THRESHOLD_BYTES se guardan comprimidos en el blob store
+# ("s3" o "local") y el mensaje de SQS sólo lleva su referencia
+CLAIM_CHECK_THRESHOLD_BYTES = 64 * 1024
+CLAIM_CHECK_BACKEND = "s3"
+CLAIM_CHECK_BUCKET = ""
+CLAIM_CHECK_PREFIX = "email-bodies/"
+CLAIM_CHECK_LOCAL_PATH = "/tmp/email-bodies"
+CLAIM_CHECK_CACHE_SIZE = 64
+TEMPLATE_KEY = "email_template"
+# Plantillas compiladas que se conservan en cada proceso y segundos antes de releerlas de Redis
+TEMPLATE_CACHE_SIZE = 256
+TEMPLATE_CACHE_TTL = 300
+# Plantillas de SES para envíos masivos que conserva cada proceso; al superar el máximo se
+# borra de SES la usada hace más tiempo
+SES_BULK_TEMPLATE_CACHE_SIZE = 100
+# Carriles de prioridad y su peso; el primero es el de alta prioridad y el que usan por defecto
+# los envíos individuales. El consumidor de SQS reparte con estos pesos su prefetch entre las
+# colas y los turnos de procesamiento. En Lambda sólo ordenan los envíos dentro de un lote: con
+# una cola por carril cada lote es de un solo carril, y el reparto entre carriles lo fija el
+# maximumConcurrency de cada cola en serverless.yml
+PRIORITY_LANES = {"transactional": 4, "bulk": 1}
+BULK_PRIORITY_LANE = "bulk"
+# Cola de SQS por carril; los carriles sin cola propia usan SQS_QUEUE_URL
+SQS_LANE_QUEUE_URLS = {}
+# Fracción del burst de cada proveedor que sólo puede usar el carril de alta prioridad
+HIGH_PRIORITY_RESERVED_CAPACITY = 0.2
+# Consumidor de SQS de larga duración (python -m app.workers.sqs_consumer)
+CONSUMER_PROCESSES = 2
+CONSUMER_WAIT_TIME_SECONDS = 20
+# Mensajes recibidos y aún no confirmados por proceso (búfer de prefetch más lotes en curso)
+CONSUMER_PREFETCH_MESSAGES = 100
+CONSUMER_BATCH_CONCURRENCY = 4
+CONSUMER_VISIBILITY_TIMEOUT = 60
+CONSUMER_HEARTBEAT_INTERVAL = 20
+CONSUMER_DRAIN_TIMEOUT = 30
+# Salud de los proveedores: una marca de no saludable vence tras un backoff que se duplica con
+# cada nueva marca (hasta HEALTH_BACKOFF_MAX); las marcas se olvidan HEALTH_STRIKE_TTL segundos
+# después de la última. Al vencer, una instancia toma el sondeo y envía un correo real.
+HEALTH_BACKOFF_BASE = 5
+HEALTH_BACKOFF_MAX = 300
+HEALTH_STRIKE_TTL = 900
+HEALTH_PROBE_LEASE_TTL = 10
+# Tiempo máximo por intento contra un proveedor (conexión y lectura, en segundos)
+PROVIDER_CONNECT_TIMEOUT = 3.0
+PROVIDER_READ_TIMEOUT = 10.0
+# Presupuesto de un envío cuando el llamador no fija un deadline, y el mínimo que debe quedar
+# para empezar un intento
+SEND_DEADLINE_SECONDS = 30.0
+MIN_ATTEMPT_TIMEOUT = 0.5
+# Tiempo de la invocación de Lambda que se reserva para confirmar el lote a SQS
+LAMBDA_DEADLINE_MARGIN = 2.0
+# Reintentos diferidos: un mensaje fallido se vuelve a encolar con DelaySeconds (backoff
+# exponencial con jitter, hasta el máximo de SQS de 900 s) y tras RETRY_MAX_ATTEMPTS intentos
+# va a la cola de mensajes muertos
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 900
+SQS_DEAD_LETTER_QUEUE_URL = ""
+# Cliente de Redis: timeouts cortos para que un Redis lento no frene los envíos. Tras un error
+# de conexión o timeout, Redis se da por caído REDIS_RETRY_INTERVAL segundos: el enrutamiento
+# usa el estado del proceso y las escrituras de métricas se guardan (hasta REDIS_WRITE_BUFFER_SIZE)
+# para reproducirlas, de a REDIS_REPLAY_BATCH_SIZE, cuando Redis vuelve
+REDIS_SOCKET_TIMEOUT = 0.25
+REDIS_CONNECT_TIMEOUT = 0.25
+REDIS_HEALTH_CHECK_INTERVAL = 15
+REDIS_MAX_CONNECTIONS = 50
+REDIS_RETRY_INTERVAL = 5.0
+REDIS_WRITE_BUFFER_SIZE = 10000
+REDIS_REPLAY_BATCH_SIZE = 100
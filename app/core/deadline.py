@@ -0,0 +1,52 @@
+# core/deadline.py
+import time
+from .config import PROVIDER_READ_TIMEOUT, MIN_ATTEMPT_TIMEOUT, LAMBDA_DEADLINE_MARGIN
+from .exceptions import DeadlineExceededError
+
+
+class Deadline:
+    """
+    Momento (en time.monotonic) en que un envío deja de tener sentido. El tiempo que queda
+    se reparte entre los intentos pendientes, cada uno con su propio timeout.
+    """
+
+    def __init__(self, expires_at: float) -> None:
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float, start: float = None) -> "Deadline":
+        """
+        Deadline a seconds segundos de start (por defecto, ahora).
+        """
+        return cls((time.monotonic() if start is None else start) + seconds)
+
+    @classmethod
+    def from_lambda_context(cls, context, margin: float = LAMBDA_DEADLINE_MARGIN):
+        """
+        Deadline del tiempo restante de la invocación, menos el margen para responder.
+        Devuelve None fuera de Lambda (sin context).
+        """
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            return None
+        return cls.after(context.get_remaining_time_in_millis() / 1000 - margin)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def earliest(self, other: "Deadline") -> "Deadline":
+        """
+        El más cercano de los dos deadlines; other puede ser None.
+        """
+        return self if other is None or self.expires_at <= other.expires_at else other
+
+    def attempt_timeout(self, attempts_left: int = 1, max_timeout: float = PROVIDER_READ_TIMEOUT) -> float:
+        """
+        Timeout del próximo intento: una parte igual del tiempo restante para cada intento
+        pendiente, entre MIN_ATTEMPT_TIMEOUT y max_timeout. Lanza DeadlineExceededError si
+        ya no quedan MIN_ATTEMPT_TIMEOUT segundos.
+        """
+        remaining = self.remaining()
+        if remaining < MIN_ATTEMPT_TIMEOUT:
+            raise DeadlineExceededError(f"No queda tiempo para otro intento de envío ({remaining:.3f} s).")
+        share = remaining / max(attempts_left, 1)
+        return min(max(share, MIN_ATTEMPT_TIMEOUT), remaining, max_timeout)
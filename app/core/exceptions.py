@@ -0,0 +1,41 @@
+# core/exceptions.py
+
+
+class ProviderThrottledError(RuntimeError):
+    """
+    El proveedor no tiene cuota de envío disponible: lo rechazó por throttling o el
+    limitador de tasa no tiene tokens. No indica que el proveedor esté caído.
+    """
+
+
+class TemplateNotFoundError(LookupError):
+    """
+    El correo usa una plantilla que no está registrada.
+    """
+
+
+class MessageInFlightError(RuntimeError):
+    """
+    Otra instancia está enviando un mensaje con la misma clave de idempotencia; el mensaje
+    vuelve a la cola para comprobar más tarde si ese envío terminó bien.
+    """
+
+
+class ProviderTimeoutError(TimeoutError):
+    """
+    El proveedor no respondió dentro del timeout del intento. El tiempo esperado cuenta
+    como una muestra de latencia del proveedor.
+    """
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Se agotó el presupuesto de tiempo del envío antes de completarlo; el mensaje vuelve
+    a la cola.
+    """
+
+
+class BatchTooLargeError(ValueError):
+    """
+    El lote tiene más correos que el máximo permitido; se rechaza sin terminar de leerlo.
+    """
@@ -0,0 +1,85 @@
+# core/idempotency.py
+import logging as logger
+import redis
+import threading
+import time
+from collections import OrderedDict
+from .config import IDEMPOTENCY_KEY, IDEMPOTENCY_TTL, IDEMPOTENCY_PENDING_TTL, IDEMPOTENCY_LOCAL_SIZE
+from .redis_handler import RedisHandler
+
+# Estados de una clave de idempotencia
+CLAIMED = "claimed"  # Reservada por esta instancia: hay que enviar el mensaje
+PENDING = "pending"  # Otra instancia la está enviando
+SENT = "sent"        # Ya se envió: el mensaje es un duplicado
+
+
+class IdempotencyGuard:
+    """
+    Descarta los mensajes repetidos (reentregas de SQS o reintentos del cliente) antes del
+    enrutamiento.
+
+    Un filtro local recuerda las claves enviadas recientemente por el proceso, de modo que un
+    duplicado visto aquí no hace viajes a Redis. El resto se reserva de forma atómica en Redis
+    (SET NX con TTL) en un solo viaje por lote. Si Redis falla se envía de todos modos, es decir,
+    se vuelve a la entrega al menos una vez.
+    """
+
+    def __init__(self, key_prefix: str = IDEMPOTENCY_KEY, ttl: float = IDEMPOTENCY_TTL,
+                 pending_ttl: float = IDEMPOTENCY_PENDING_TTL, local_size: int = IDEMPOTENCY_LOCAL_SIZE) -> None:
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.local_size = local_size
+        self._lock = threading.Lock()
+        # Claves enviadas -> vencimiento (monotonic), de la menos a la más reciente
+        self._recent = OrderedDict()
+
+    def _seen_locally(self, key: str, now: float) -> bool:
+        expires_at = self._recent.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < now:
+            del self._recent[key]
+            return False
+        self._recent.move_to_end(key)
+        return True
+
+    def _remember(self, keys: list) -> None:
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._recent[key] = expires_at
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.local_size:
+                self._recent.popitem(last=False)
+
+    def claim(self, keys: list) -> dict:
+        """
+        Reserva las claves para enviar sus mensajes. Devuelve {clave: CLAIMED, PENDING o SENT}.
+        """
+        now = time.monotonic()
+        with self._lock:
+            statuses = {key: SENT for key in keys if self._seen_locally(key, now)}
+        remaining = [key for key in dict.fromkeys(keys) if key not in statuses]
+        if not remaining:
+            return statuses
+
+        try:
+            claimed = RedisHandler.claim_idempotency_keys(remaining, self.key_prefix, self.pending_ttl)
+        except redis.RedisError:
+            logger.exception("Error de Redis al reservar las claves de idempotencia; se envían sin deduplicar.")
+            claimed = {key: CLAIMED for key in remaining}
+        self._remember([key for key, status in claimed.items() if status == SENT])
+        statuses.update(claimed)
+        return statuses
+
+    def complete(self, sent: list, failed: list) -> None:
+        """
+        Registra el resultado de los mensajes reservados: las claves enviadas se recuerdan
+        durante el TTL y las fallidas se liberan para que su reintento pueda enviarse.
+        """
+        self._remember(sent)
+        try:
+            RedisHandler.complete_idempotency_keys(sent, failed, self.key_prefix, self.ttl)
+        except redis.RedisError:
+            logger.exception("Error de Redis al registrar el resultado de las claves de idempotencia.")
@@ -0,0 +1,20 @@
+# core/lanes.py
+import os
+from .config import PRIORITY_LANES, SQS_LANE_QUEUE_URLS, SQS_QUEUE_URL
+
+# Carril de alta prioridad: el primero de PRIORITY_LANES
+HIGH_PRIORITY_LANE = next(iter(PRIORITY_LANES))
+
+
+def lane_of(priority) -> str:
+    """
+    Carril de un correo; los mensajes sin prioridad van al de alta prioridad.
+    """
+    return priority or HIGH_PRIORITY_LANE
+
+
+def lane_queue_url(lane: str) -> str:
+    """
+    Cola de SQS del carril: SQS_<CARRIL>_QUEUE_URL, SQS_LANE_QUEUE_URLS o la cola común.
+    """
+    return os.getenv(f"SQS_{lane.upper()}_QUEUE_URL") or SQS_LANE_QUEUE_URLS.get(lane) or SQS_QUEUE_URL
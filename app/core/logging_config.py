@@ -0,0 +1,147 @@
+# core/logging_config.py
+import atexit
+import contextvars
+import json
+import logging as logger
+import os
+import queue
+import random
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from .config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+
+# Loggers del camino de envío a los que se aplica el muestreo
+SAMPLED_LOGGERS = ("app.services", "app.workers")
+
+# Atributos propios de LogRecord; el resto se considera contexto estructurado (extra=...)
+RECORD_ATTRIBUTES = set(vars(logger.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "correlation_id"}
+
+# Identificador del mensaje en proceso (messageId de SQS o id de la solicitud)
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+listener = None
+
+
+@contextmanager
+def correlation_scope(value: str):
+    """
+    Asocia value a los logs emitidos dentro del bloque (en este hilo o tarea).
+    """
+    token = correlation_id.set(value)
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+class ContextFilter(logger.Filter):
+    """
+    Copia el correlation_id del contexto al registro en el hilo que emite el log.
+    """
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logger.Filter):
+    """
+    Conserva sólo una fracción de los logs del camino de envío por nivel. La decisión se toma
+    por correlation_id, así que se conservan o descartan todos los logs de un mismo mensaje.
+    Los niveles sin tasa configurada (WARNING y superiores) se conservan siempre.
+    """
+
+    def __init__(self, rates: dict, prefixes: tuple = SAMPLED_LOGGERS) -> None:
+        super().__init__()
+        self.rates = rates
+        self.prefixes = prefixes
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelname)
+        if rate is None or rate >= 1 or not record.name.startswith(self.prefixes):
+            return True
+        key = getattr(record, "correlation_id", None)
+        if key is None:
+            return random.random() < rate
+        return zlib.crc32(key.encode("utf-8")) % 10000 < rate * 10000
+
+
+class JSONFormatter(logger.Formatter):
+    """
+    Una línea JSON por registro con nivel, logger, mensaje, correlation_id y los campos extra.
+    """
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Encola el registro sin formatearlo y sin bloquear: el mensaje (formato perezoso con %)
+    se construye en el hilo del listener. Si la cola está llena el registro se descarta.
+    Los argumentos del log deben ser inmutables.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            from .metrics import metrics
+            metrics.increment("log_records_dropped_total")
+
+
+def configure_logging() -> None:
+    """
+    Configura el logging del proceso. Lo llaman sólo los puntos de entrada (app FastAPI y
+    handlers de Lambda). Los handlers existentes (por ejemplo, el del runtime de Lambda)
+    pasan a escribir desde un hilo propio, detrás de una cola.
+    """
+    global listener
+    root = logger.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", LOG_LEVEL))
+    if listener is not None:
+        return
+
+    handlers = root.handlers[:] or [logger.StreamHandler()]
+    for handler in handlers:
+        root.removeHandler(handler)
+        if LOG_FORMAT == "json":
+            handler.setFormatter(JSONFormatter())
+        elif handler.formatter is None:
+            handler.setFormatter(logger.Formatter('%(asctime)s - %(levelname)s - %(message)s', '%Y-%m-%d %H:%M:%S'))
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def flush_logs(timeout: float = 1.0) -> None:
+    """
+    Espera (como máximo timeout segundos) a que se escriban los logs encolados; los handlers
+    de Lambda la llaman antes de devolver, ya que el contenedor se congela al terminar.
+    """
+    deadline = time.monotonic() + timeout
+    while log_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
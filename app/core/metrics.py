@@ -0,0 +1,176 @@
+# core/metrics.py
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from .config import METRICS_NAMESPACE
+from .logging_config import flush_logs
+
+# Límites (en segundos) de los buckets de los histogramas, de 0.5 ms a 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Histograma de buckets fijos. Guarda los totales desde el arranque (para /metrics) y los
+    valores pendientes desde el último envío a CloudWatch (para EMF).
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.pending = [0] * (len(buckets) + 1)
+        self.pending_max = 0.0
+
+    def observe(self, value: float) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.pending[index] += 1
+        self.pending_max = max(self.pending_max, value)
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas en proceso con etiquetas, exportables en formato de texto de
+    Prometheus y en CloudWatch Embedded Metric Format (EMF).
+    """
+
+    def __init__(self, namespace: str = METRICS_NAMESPACE) -> None:
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._pending_counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._pending_counters[key] = self._pending_counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Mide con perf_counter la duración del bloque y la registra en el histograma name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters, self._pending_counters, self._histograms = {}, {}, {}
+
+    def render_prometheus(self) -> str:
+        """
+        Exporta los totales en el formato de texto de Prometheus.
+        """
+        lines, typed = [], set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.total}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def emf_documents(self) -> list:
+        """
+        Devuelve los documentos EMF con lo registrado desde el último envío y lo descarta.
+        Cada serie (métrica y etiquetas) va en su propio documento con sus etiquetas como dimensiones.
+        """
+        timestamp = int(time.time() * 1000)
+        documents = []
+        with self._lock:
+            for (name, labels), value in self._pending_counters.items():
+                documents.append(emf_document(self.namespace, timestamp, name, labels, "Count", value))
+            for (name, labels), histogram in self._histograms.items():
+                if not any(histogram.pending):
+                    continue
+                # Cada bucket se representa por su límite superior; el último, por el máximo observado
+                bounds = (*histogram.buckets, histogram.pending_max)
+                values = [bound for bound, count in zip(bounds, histogram.pending) if count]
+                counts = [count for count in histogram.pending if count]
+                documents.append(emf_document(self.namespace, timestamp, name, labels, "Seconds", {"Values": values, "Counts": counts}))
+                histogram.pending = [0] * len(histogram.pending)
+                histogram.pending_max = 0.0
+            self._pending_counters = {}
+        return documents
+
+    def flush_emf(self) -> None:
+        """
+        Escribe en stdout los documentos EMF pendientes; CloudWatch Logs los convierte en métricas.
+        """
+        for document in self.emf_documents():
+            print(json.dumps(document), flush=True)
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def emf_document(namespace: str, timestamp: int, name: str, labels: tuple, unit: str, value) -> dict:
+    return {
+        "_aws": {
+            "Timestamp": timestamp,
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [[label for label, _ in labels]],
+                "Metrics": [{"Name": name, "Unit": unit}],
+            }],
+        },
+        **{label: str(label_value) for label, label_value in labels},
+        name: value,
+    }
+
+
+# Registro compartido por todo el proceso
+metrics = MetricsRegistry()
+
+
+def lambda_metrics(handler_name: str):
+    """
+    Decorador para los handlers de Lambda: mide la invocación, envía las métricas en EMF y
+    vacía la cola de logs al terminar.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                with metrics.timer("lambda_handler_seconds", handler=handler_name):
+                    return handler(event, context)
+            finally:
+                metrics.flush_emf()
+                flush_logs()
+        return wrapper
+    return decorator
@@ -1,66 +1,763 @@
 # core/redis_handler.py
+import asyncio
+import functools
+import inspect
+import logging as logger
 import redis
-from statistics import median
-from ..core.config import REDIS_URL
+import redis.asyncio
+import threading
+import time
+from collections import deque
+from ..core.config import (
+    REDIS_URL, LATENCY_QUANTILE_STEP, HEALTH_BACKOFF_BASE, HEALTH_BACKOFF_MAX, HEALTH_STRIKE_TTL,
+    REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT, REDIS_HEALTH_CHECK_INTERVAL, REDIS_MAX_CONNECTIONS,
+    REDIS_RETRY_INTERVAL, REDIS_WRITE_BUFFER_SIZE, REDIS_REPLAY_BATCH_SIZE
+)
 import os
 
 # Asegúrate de que la URL tenga el esquema correcto
 redis_url = os.getenv("REDIS_URL", REDIS_URL)
 
-# Conectar a Redis utilizando la URL
-redis_client = redis.StrictRedis.from_url(redis_url, decode_responses=True)
+# Cliente de Redis creado en el primer uso para no pagarlo al importar (arranque en frío)
+redis_client = None
+redis_client_lock = threading.Lock()
+# Cliente asíncrono para los envíos con asyncio; sus conexiones quedan ligadas a un event loop
+async_redis_client = None
+async_redis_client_loop = None
+
+
+class RedisUnavailableError(redis.ConnectionError):
+    """
+    Redis está marcado como no disponible; la llamada no se intentó.
+    """
+
+
+class RedisAvailability:
+    """
+    Disponibilidad de Redis vista por el proceso.
+
+    Tras un error de conexión o un timeout, Redis se da por caído durante retry_interval
+    segundos y get_redis_client falla de inmediato en lugar de esperar otro timeout. Las
+    escrituras que se pueden diferir se guardan en orden en un búfer acotado (se descartan
+    las más antiguas). Tras una llamada exitosa, un hilo en segundo plano las reproduce de a
+    replay_batch_size, así el atraso no cae sobre el deadline del envío que vio volver a Redis.
+    """
+
+    def __init__(self, retry_interval: float = REDIS_RETRY_INTERVAL, buffer_size: int = REDIS_WRITE_BUFFER_SIZE,
+                 replay_batch_size: int = REDIS_REPLAY_BATCH_SIZE) -> None:
+        self.retry_interval = retry_interval
+        self.replay_batch_size = replay_batch_size
+        self._lock = threading.Lock()
+        self._down_until = None
+        self._pending = deque(maxlen=buffer_size)
+        self._replaying = False
+
+    @property
+    def degraded(self) -> bool:
+        return self._down_until is not None
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending)
+
+    def check(self) -> None:
+        down_until = self._down_until
+        if down_until is not None and time.monotonic() < down_until:
+            raise RedisUnavailableError("Redis no está disponible; se usa el estado local.")
+
+    def record_failure(self, error: Exception) -> None:
+        if isinstance(error, RedisUnavailableError) or not isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+            return
+        with self._lock:
+            if self._down_until is None:
+                logger.warning("Redis no responde (%s); modo degradado durante %.1f s.", error, self.retry_interval)
+            self._down_until = time.monotonic() + self.retry_interval
+
+    def record_success(self) -> None:
+        if self._down_until is not None:
+            with self._lock:
+                if self._down_until is not None:
+                    logger.info("Redis respondió de nuevo; se reproducen %d escrituras pendientes.", len(self._pending))
+                self._down_until = None
+        if self._pending:
+            self.replay_in_background()
+
+    def defer(self, function, args, kwargs) -> None:
+        with self._lock:
+            self._pending.append((function, args, kwargs))
+
+    def replay_in_background(self) -> None:
+        """
+        Inicia el hilo que reproduce las escrituras pendientes, si no está corriendo ya.
+        """
+        with self._lock:
+            if self._replaying:
+                return
+            self._replaying = True
+        threading.Thread(target=self._replay_pending, name="redis-replay", daemon=True).start()
+
+    def _replay_pending(self) -> None:
+        try:
+            while self._pending and self.replay():
+                pass
+        finally:
+            self._replaying = False
+
+    def replay(self) -> bool:
+        """
+        Reproduce en orden hasta replay_batch_size escrituras pendientes. Devuelve False si
+        Redis volvió a fallar.
+        """
+        for _ in range(self.replay_batch_size):
+            try:
+                function, args, kwargs = self._pending.popleft()
+            except IndexError:
+                return True
+            try:
+                function(*args, **kwargs)
+            except redis.RedisError as e:
+                self._pending.appendleft((function, args, kwargs))
+                self.record_failure(e)
+                return False
+        return True
+
+
+redis_availability = RedisAvailability()
+
+
+def guarded(deferrable: bool = False, replay=None):
+    """
+    Registra en redis_availability el resultado de una operación de RedisHandler. Si es
+    deferrable y Redis no está disponible, la guarda para reproducirla y relanza el error
+    para que el llamador aplique el resultado localmente.
+
+    Una corrutina no se puede reproducir desde el hilo de reproducción, así que con
+    deferrable=True se guarda replay: la versión síncrona de la misma escritura.
+    """
+    def decorator(function):
+        def record_failure(e, args, kwargs):
+            redis_availability.record_failure(e)
+            if deferrable and isinstance(e, (redis.ConnectionError, redis.TimeoutError)):
+                redis_availability.defer(replay or function, args, kwargs)
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    result = await function(*args, **kwargs)
+                except redis.RedisError as e:
+                    record_failure(e, args, kwargs)
+                    raise
+                redis_availability.record_success()
+                return result
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                result = function(*args, **kwargs)
+            except redis.RedisError as e:
+                record_failure(e, args, kwargs)
+                raise
+            redis_availability.record_success()
+            return result
+        return wrapper
+    return decorator
+
+
+def get_redis_client():
+    """
+    Devuelve el cliente de Redis del proceso, creándolo la primera vez. Si Redis está marcado
+    como no disponible, lanza RedisUnavailableError sin intentar la conexión.
+    """
+    global redis_client
+    redis_availability.check()
+    if redis_client is None:
+        with redis_client_lock:
+            if redis_client is None:
+                # El pool descarta las conexiones muertas (health_check_interval) y los timeouts
+                # cortos evitan que un Redis lento bloquee el envío
+                redis_client = redis.StrictRedis.from_url(
+                    redis_url,
+                    decode_responses=True,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                    socket_keepalive=True,
+                    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    retry_on_timeout=False
+                )
+    return redis_client
+
+
+def get_async_redis_client():
+    """
+    Devuelve el cliente asíncrono de Redis del event loop actual, creándolo la primera vez.
+    Como get_redis_client, falla de inmediato si Redis está marcado como no disponible.
+    """
+    global async_redis_client, async_redis_client_loop
+    redis_availability.check()
+    loop = asyncio.get_running_loop()
+    if async_redis_client_loop is not loop:
+        async_redis_client = redis.asyncio.StrictRedis.from_url(
+            redis_url,
+            decode_responses=True,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            retry_on_timeout=False
+        )
+        async_redis_client_loop = loop
+    return async_redis_client
+
+
+class LazyScript:
+    """
+    Script de Lua que se registra en el cliente de Redis en su primera ejecución.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self._script = None
+        self._async_script = None
+
+    def __call__(self, keys=(), args=()):
+        if self._script is None:
+            self._script = get_redis_client().register_script(self.source)
+        return self._script(keys=keys, args=args)
+
+    async def run_async(self, keys=(), args=()):
+        """
+        Ejecuta el script con el cliente asíncrono del event loop actual.
+        """
+        client = get_async_redis_client()
+        if self._async_script is None or self._async_script.registered_client is not client:
+            self._async_script = client.register_script(self.source)
+        return await self._async_script(keys=keys, args=args)
+
+# Actualiza en O(1) el estimador de latencia de un proveedor: EWMA, dispersión media y
+# cuantiles p50/p95/p99 por aproximación estocástica (cada cuantil sube step*p si la
+# muestra lo supera y baja step*(1-p) si no, y converge al percentil buscado).
+LATENCY_STATS_LUA = """
+local function update_latency_stats(key, x, alpha, gain)
+    local s = redis.call('HMGET', key, 'n', 'ewma', 'spread', 'p50', 'p95', 'p99')
+    local n = tonumber(s[1]) or 0
+    local ewma, spread, p50, p95, p99
+    if n == 0 then
+        ewma, spread, p50, p95, p99 = x, x / 2, x, x, x
+    else
+        ewma, spread = tonumber(s[2]), tonumber(s[3])
+        local step = gain * math.max(spread, 0.001)
+        local q = {tonumber(s[4]), tonumber(s[5]), tonumber(s[6])}
+        local p = {0.5, 0.95, 0.99}
+        for i = 1, 3 do
+            if x > q[i] then q[i] = q[i] + step * p[i] else q[i] = q[i] - step * (1 - p[i]) end
+        end
+        p50 = math.max(q[1], 0)
+        p95 = math.max(q[2], p50)
+        p99 = math.max(q[3], p95)
+        spread = spread + alpha * (math.abs(x - ewma) - spread)
+        ewma = ewma + alpha * (x - ewma)
+    end
+    n = n + 1
+    redis.call('HSET', key, 'n', n, 'ewma', tostring(ewma), 'spread', tostring(spread),
+        'p50', tostring(p50), 'p95', tostring(p95), 'p99', tostring(p99))
+    return {tostring(n), tostring(ewma), tostring(p50), tostring(p95), tostring(p99)}
+end
+"""
+
+# Salud de un proveedor en un hash con vencimiento: state, until (fin del backoff), strikes y
+# probe_until (fin del sondeo en curso). Volver a marcar un proveedor ya marcado no suma una
+# marca, así una ráfaga de errores cuenta como un solo incidente.
+HEALTH_LUA = """
+local function redis_now()
+    local now = redis.call('TIME')
+    return tonumber(now[1]) + tonumber(now[2]) / 1000000
+end
+
+local function mark_unhealthy(key, base, max_backoff, strike_ttl)
+    local now = redis_now()
+    local s = redis.call('HMGET', key, 'state', 'until', 'strikes')
+    if s[1] == 'unhealthy' and tonumber(s[2]) > now then
+        return tonumber(s[2]) - now
+    end
+    local strikes = (tonumber(s[3]) or 0) + 1
+    local backoff = math.min(base * 2 ^ (strikes - 1), max_backoff)
+    redis.call('HSET', key, 'state', 'unhealthy', 'until', string.format('%.6f', now + backoff), 'strikes', strikes)
+    redis.call('HDEL', key, 'probe_until')
+    redis.call('EXPIRE', key, math.ceil(backoff + strike_ttl))
+    return backoff
+end
+
+local function mark_healthy(key)
+    -- Conserva las marcas (y su vencimiento) para que una recaída alargue el backoff
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HSET', key, 'state', 'healthy')
+        redis.call('HDEL', key, 'probe_until')
+    end
+end
+"""
+
+# KEYS: estadísticas de latencia del proveedor
+# ARGV: latencia, alpha, paso de cuantiles
+CACHE_LATENCY_SCRIPT = LATENCY_STATS_LUA + """
+return update_latency_stats(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]))
+"""
+cache_latency_script = LazyScript(CACHE_LATENCY_SCRIPT)
+
+# Registra en un solo viaje el resultado de un envío: latencia, conteo, salud y uso consecutivo.
+# KEYS: estadísticas de latencia del proveedor, contador de correos, salud del proveedor, uso consecutivo
+# ARGV: proveedor, latencia, alpha, paso de cuantiles, correos enviados, estado de salud,
+#       backoff base, backoff máximo, TTL de las marcas, otros proveedores...
+# Devuelve {uso, n, ewma, p50, p95, p99}
+RECORD_SEND_OUTCOME_SCRIPT = LATENCY_STATS_LUA + HEALTH_LUA + """
+local stats = update_latency_stats(KEYS[1], tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]))
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[5])
+if ARGV[6] == 'healthy' then
+    mark_healthy(KEYS[3])
+else
+    mark_unhealthy(KEYS[3], tonumber(ARGV[7]), tonumber(ARGV[8]), tonumber(ARGV[9]))
+end
+local usage = redis.call('HINCRBY', KEYS[4], ARGV[1], ARGV[5])
+for i = 10, #ARGV do
+    redis.call('HSET', KEYS[4], ARGV[i], 0)
+end
+table.insert(stats, 1, usage)
+return stats
+"""
+record_send_outcome_script = LazyScript(RECORD_SEND_OUTCOME_SCRIPT)
+
+# Token bucket compartido por todas las instancias, con el reloj de Redis para evitar desfases.
+# Un envío masivo mayor que el burst se permite con el bucket lleno y deja saldo negativo.
+# Los tokens reservados no se pueden tomar (los guarda para el carril de alta prioridad).
+# KEYS: bucket del proveedor
+# ARGV: tasa (tokens/s), burst, tokens solicitados, tokens reservados
+# Devuelve {1 si se concedieron, tokens restantes}
+ACQUIRE_TOKENS_SCRIPT = """
+local rate, burst, requested = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local reserved = tonumber(ARGV[4]) or 0
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local s = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(s[1]) or burst
+local ts = tonumber(s[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local allowed = 0
+if tokens - reserved >= math.min(requested, burst - reserved) then
+    tokens = tokens - requested
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', string.format('%.6f', now))
+-- Expira cuando el bucket ya estaría lleno de nuevo (incluido el saldo negativo)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+acquire_tokens_script = LazyScript(ACQUIRE_TOKENS_SCRIPT)
+
+# KEYS: salud del proveedor
+# ARGV: backoff base, backoff máximo, TTL de las marcas
+# Devuelve los segundos que el proveedor queda excluido
+MARK_UNHEALTHY_SCRIPT = HEALTH_LUA + """
+return tostring(mark_unhealthy(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])))
+"""
+mark_unhealthy_script = LazyScript(MARK_UNHEALTHY_SCRIPT)
+
+# Toma el sondeo de un proveedor cuyo backoff venció, si nadie más lo tiene.
+# KEYS: salud del proveedor
+# ARGV: duración del sondeo en segundos
+# Devuelve 1 si esta instancia debe sondear el proveedor
+ACQUIRE_PROBE_SCRIPT = HEALTH_LUA + """
+local now = redis_now()
+local s = redis.call('HMGET', KEYS[1], 'state', 'until', 'probe_until')
+if s[1] ~= 'unhealthy' or tonumber(s[2]) > now or (tonumber(s[3]) or 0) > now then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'probe_until', string.format('%.6f', now + tonumber(ARGV[1])))
+return 1
+"""
+acquire_probe_script = LazyScript(ACQUIRE_PROBE_SCRIPT)
+
+# Reserva atómica de claves de idempotencia: devuelve el valor existente de cada clave
+# ('pending' o 'sent') o 'claimed' si era nueva y quedó reservada con TTL.
+# KEYS: claves de idempotencia
+# ARGV: TTL de la reserva en segundos
+CLAIM_IDEMPOTENCY_KEYS_SCRIPT = """
+local results = {}
+for i, key in ipairs(KEYS) do
+    local current = redis.call('GET', key)
+    if current then
+        results[i] = current
+    else
+        redis.call('SET', key, 'pending', 'EX', ARGV[1])
+        results[i] = 'claimed'
+    end
+end
+return results
+"""
+claim_idempotency_keys_script = LazyScript(CLAIM_IDEMPOTENCY_KEYS_SCRIPT)
+
+LATENCY_STATS_FIELDS = ("n", "ewma", "p50", "p95", "p99")
+
+
+def latency_stats_key(provider_name, key):
+    return f"{key}:stats:{provider_name}"
+
+
+def health_redis_key(provider_name, key):
+    return f"{key}:{provider_name}"
+
+
+def rate_limit_bucket_key(provider_name, key):
+    return f"{key}:{provider_name}"
+
+
+def idempotency_redis_key(idempotency_key, key):
+    return f"{key}:{idempotency_key}"
+
+
+def template_redis_key(template_id, key):
+    return f"{key}:{template_id}"
+
+
+def available_tokens(values, rate, burst, now):
+    """
+    Tokens disponibles en el bucket (tokens, ts) leído de Redis, recargados hasta now.
+    """
+    tokens, ts = values
+    if tokens is None or ts is None:
+        return float(burst)
+    return min(float(burst), float(tokens) + max(now - float(ts), 0) * rate)
+
+
+def parse_health(values, now):
+    """
+    Estado de salud del hash (state, until) leído de Redis: 'healthy', 'unhealthy' o 'probing'
+    (backoff vencido, a la espera de que un envío confirme la recuperación).
+    """
+    state, until = values
+    if state != "unhealthy":
+        return "healthy"
+    return "unhealthy" if until is not None and float(until) > now else "probing"
+
+
+def ewma_alpha(history_size):
+    """
+    Factor de suavizado equivalente a una media móvil de history_size muestras.
+    """
+    return 2 / (history_size + 1)
+
+
+def parse_latency_stats(values):
+    """
+    Convierte los campos (n, ewma, p50, p95, p99) leídos de Redis en un diccionario de floats.
+    """
+    if not values or not values[0] or int(values[0]) == 0:
+        return {field: (0 if field == "n" else float('inf')) for field in LATENCY_STATS_FIELDS}
+    stats = {field: float(value) for field, value in zip(LATENCY_STATS_FIELDS, values)}
+    stats["n"] = int(stats["n"])
+    return stats
+
+
+def send_outcome_script_input(provider_name, latency, healthy, other_providers, latency_key, history_size, count_key, health_key, use_tracker_key, sent_count):
+    """
+    Claves y argumentos de record_send_outcome_script para el resultado de un envío.
+    """
+    keys = [latency_stats_key(provider_name, latency_key), count_key, health_redis_key(provider_name, health_key), use_tracker_key]
+    args = [provider_name, latency, ewma_alpha(history_size), LATENCY_QUANTILE_STEP, sent_count,
+            "healthy" if healthy else "unhealthy", HEALTH_BACKOFF_BASE, HEALTH_BACKOFF_MAX, HEALTH_STRIKE_TTL,
+            *other_providers]
+    return keys, args
+
+
+def queue_routing_snapshot(pipe, provider_names, use_tracker_key, health_key, latency_key, rate_limits=None, rate_limit_key=None):
+    """
+    Encola en pipe las lecturas del estado de enrutamiento que interpreta parse_routing_snapshot.
+    """
+    rate_limits = rate_limits or {}
+    pipe.hmget(use_tracker_key, provider_names)
+    for provider_name in provider_names:
+        pipe.hmget(health_redis_key(provider_name, health_key), ("state", "until"))
+    for provider_name in provider_names:
+        pipe.hmget(latency_stats_key(provider_name, latency_key), LATENCY_STATS_FIELDS)
+    for provider_name in provider_names:
+        if provider_name in rate_limits:
+            pipe.hmget(rate_limit_bucket_key(provider_name, rate_limit_key), ("tokens", "ts"))
+
+
+def parse_routing_snapshot(results, provider_names, rate_limits=None) -> dict:
+    """
+    Convierte las respuestas del pipeline de queue_routing_snapshot en el estado por proveedor.
+    """
+    rate_limits = rate_limits or {}
+    limited = [provider_name for provider_name in provider_names if provider_name in rate_limits]
+    usage_counts, *rest = results
+    count = len(provider_names)
+    health_flags, latency_stats = rest[:count], rest[count:2 * count]
+    buckets = dict(zip(limited, rest[2 * count:]))
+
+    now, monotonic_now = time.time(), time.monotonic()
+    snapshot = {}
+    for provider_name, usage, health_values, stats in zip(provider_names, usage_counts, health_flags, latency_stats):
+        health = parse_health(health_values, now)
+        snapshot[provider_name] = {
+            "usage": int(usage or 0),
+            "healthy": health == "healthy",
+            "probe": health == "probing",
+            # Fin del backoff en el reloj del proceso, para el modo degradado sin Redis
+            "unhealthy_until": monotonic_now + float(health_values[1]) - now if health == "unhealthy" else 0.0,
+            "latency": parse_latency_stats(stats),
+            "tokens": available_tokens(buckets[provider_name], *rate_limits[provider_name], now) if provider_name in buckets else float('inf'),
+        }
+    return snapshot
 
 class RedisHandler:
     
     @staticmethod
+    @guarded(deferrable=True)
     def cache_latency(provider_name, latency, key, history_size):
         """
-        Almacena la latencia de un proveedor en Redis.
+        Actualiza el estimador de latencia de un proveedor en Redis.
         """
-        redis_client.lpush(f"{key}:{provider_name}", latency)
-        redis_client.ltrim(f"{key}:{provider_name}", 0, history_size - 1)
+        cache_latency_script(
+            keys=[latency_stats_key(provider_name, key)],
+            args=[latency, ewma_alpha(history_size), LATENCY_QUANTILE_STEP]
+        )
+
+    @staticmethod
+    @guarded(deferrable=True, replay=cache_latency.__func__.__wrapped__)
+    async def cache_latency_async(provider_name, latency, key, history_size):
+        """
+        Versión asíncrona de cache_latency.
+        """
+        await cache_latency_script.run_async(
+            keys=[latency_stats_key(provider_name, key)],
+            args=[latency, ewma_alpha(history_size), LATENCY_QUANTILE_STEP]
+        )
 
     @staticmethod
     def get_predicted_latency(provider_name, key):
         """
-        Recupera la latencia media de un proveedor.
+        Recupera la latencia mediana (p50) estimada de un proveedor. La lectura ya pasa por
+        el guard de get_latency_stats.
+        """
+        return RedisHandler.get_latency_stats(provider_name, key)["p50"]
+
+    @staticmethod
+    @guarded()
+    def get_latency_stats(provider_name, key):
+        """
+        Recupera el EWMA y los percentiles p50/p95/p99 estimados de un proveedor.
         """
-        latencies = redis_client.lrange(f"{key}:{provider_name}", 0, -1)
-        if not latencies:
-            return float('inf')
-        return median([float(latency) for latency in latencies])
+        return parse_latency_stats(get_redis_client().hmget(latency_stats_key(provider_name, key), LATENCY_STATS_FIELDS))
 
     @staticmethod
+    @guarded(deferrable=True)
     def increment_email_count(provider_name, count_key):
         """
         Incrementa el contador de correos enviados por proveedor.
         """
-        redis_client.hincrby(count_key, provider_name, 1)
+        get_redis_client().hincrby(count_key, provider_name, 1)
+
+    @staticmethod
+    @guarded(deferrable=True)
+    def track_provider_usage(provider_name, use_tracker_key, other_providers):
+        """
+        Aumenta el uso de un proveedor y resetea el de los demás.
+        """
+        pipe = get_redis_client().pipeline()
+        pipe.hincrby(use_tracker_key, provider_name, 1)
+        for other_provider in other_providers:
+            pipe.hset(use_tracker_key, other_provider, 0)
+        pipe.execute()
+
+    @staticmethod
+    @guarded(deferrable=True)
+    def record_send_outcome(provider_name, latency, healthy, other_providers, latency_key, history_size, count_key, health_key, use_tracker_key, sent_count=1):
+        """
+        Registra de forma atómica y en un solo viaje a Redis el resultado de un envío exitoso.
+        Devuelve el nuevo conteo de uso consecutivo y las estadísticas de latencia del proveedor.
+        """
+        usage, *stats = record_send_outcome_script(*send_outcome_script_input(
+            provider_name, latency, healthy, other_providers, latency_key, history_size, count_key, health_key, use_tracker_key, sent_count
+        ))
+        return int(usage), parse_latency_stats(stats)
+
+    @staticmethod
+    @guarded(deferrable=True, replay=record_send_outcome.__func__.__wrapped__)
+    async def record_send_outcome_async(provider_name, latency, healthy, other_providers, latency_key, history_size, count_key, health_key, use_tracker_key, sent_count=1):
+        """
+        Versión asíncrona de record_send_outcome.
+        """
+        usage, *stats = await record_send_outcome_script.run_async(*send_outcome_script_input(
+            provider_name, latency, healthy, other_providers, latency_key, history_size, count_key, health_key, use_tracker_key, sent_count
+        ))
+        return int(usage), parse_latency_stats(stats)
+
+    @staticmethod
+    @guarded()
+    def acquire_send_tokens(provider_name, rate, burst, key, count=1, reserved=0):
+        """
+        Toma count tokens del bucket del proveedor de forma atómica, sin tocar los reserved
+        últimos tokens. Devuelve (si se concedieron, tokens restantes).
+        """
+        allowed, tokens = acquire_tokens_script(
+            keys=[rate_limit_bucket_key(provider_name, key)],
+            args=[rate, burst, count, reserved]
+        )
+        return bool(int(allowed)), float(tokens)
+
+    @staticmethod
+    @guarded()
+    async def acquire_send_tokens_async(provider_name, rate, burst, key, count=1, reserved=0):
+        """
+        Versión asíncrona de acquire_send_tokens.
+        """
+        allowed, tokens = await acquire_tokens_script.run_async(
+            keys=[rate_limit_bucket_key(provider_name, key)],
+            args=[rate, burst, count, reserved]
+        )
+        return bool(int(allowed)), float(tokens)
+
+    @staticmethod
+    @guarded()
+    def claim_idempotency_keys(idempotency_keys, key, pending_ttl):
+        """
+        Reserva en un solo viaje las claves de idempotencia que no existían.
+        Devuelve {clave: 'claimed', 'pending' o 'sent'}.
+        """
+        if not idempotency_keys:
+            return {}
+        statuses = claim_idempotency_keys_script(
+            keys=[idempotency_redis_key(idempotency_key, key) for idempotency_key in idempotency_keys],
+            args=[max(int(pending_ttl), 1)]
+        )
+        return dict(zip(idempotency_keys, statuses))
+
+    @staticmethod
+    @guarded(deferrable=True)
+    def complete_idempotency_keys(sent, failed, key, ttl):
+        """
+        Marca como enviadas (durante ttl segundos) las claves de sent y libera las de failed
+        para que su reintento pueda enviarse, en un solo viaje.
+        """
+        if not sent and not failed:
+            return
+        pipe = get_redis_client().pipeline(transaction=False)
+        for idempotency_key in sent:
+            pipe.set(idempotency_redis_key(idempotency_key, key), "sent", ex=max(int(ttl), 1))
+        if failed:
+            pipe.delete(*[idempotency_redis_key(idempotency_key, key) for idempotency_key in failed])
+        pipe.execute()
+
+    @staticmethod
+    @guarded()
+    def save_template(template_id, fields, key):
+        """
+        Guarda los campos de una plantilla, reemplazando la versión anterior.
+        """
+        pipe = get_redis_client().pipeline()
+        pipe.delete(template_redis_key(template_id, key))
+        pipe.hset(template_redis_key(template_id, key), mapping=fields)
+        pipe.execute()
+
+    @staticmethod
+    @guarded()
+    def get_template(template_id, key):
+        """
+        Lee los campos de una plantilla ({} si no existe).
+        """
+        return get_redis_client().hgetall(template_redis_key(template_id, key))
 
     @staticmethod
-    def track_provider_usage(provider_name, use_tracker_key):
+    @guarded()
+    async def get_template_async(template_id, key):
         """
-        Aumenta el uso de un proveedor y resetea el otro.
+        Versión asíncrona de get_template.
         """
-        redis_client.hincrby(use_tracker_key, provider_name, 1)
-        other_provider = "Amazon SES" if provider_name == "SendGrid" else "SendGrid"
-        redis_client.hset(use_tracker_key, other_provider, 0)
+        return await get_async_redis_client().hgetall(template_redis_key(template_id, key))
 
     @staticmethod
+    @guarded()
     def get_usage_count(provider_name, use_tracker_key):
         """
         Obtiene el conteo de uso consecutivo del proveedor desde Redis.
         """
-        return redis_client.hget(use_tracker_key, provider_name) or 0
+        return get_redis_client().hget(use_tracker_key, provider_name) or 0
 
     @staticmethod
+    @guarded()
+    def get_routing_snapshot(provider_names, use_tracker_key, health_key, latency_key, rate_limits=None, rate_limit_key=None):
+        """
+        Lee en un solo viaje (pipeline) el uso, la salud, la latencia y la capacidad de envío
+        de todos los proveedores. rate_limits es {proveedor: (tasa, burst)}; los proveedores
+        sin límite tienen capacidad infinita.
+        """
+        pipe = get_redis_client().pipeline(transaction=False)
+        queue_routing_snapshot(pipe, provider_names, use_tracker_key, health_key, latency_key, rate_limits, rate_limit_key)
+        return parse_routing_snapshot(pipe.execute(), provider_names, rate_limits)
+
+    @staticmethod
+    @guarded()
+    async def get_routing_snapshot_async(provider_names, use_tracker_key, health_key, latency_key, rate_limits=None, rate_limit_key=None):
+        """
+        Versión asíncrona de get_routing_snapshot.
+        """
+        pipe = get_async_redis_client().pipeline(transaction=False)
+        queue_routing_snapshot(pipe, provider_names, use_tracker_key, health_key, latency_key, rate_limits, rate_limit_key)
+        return parse_routing_snapshot(await pipe.execute(), provider_names, rate_limits)
+
+    @staticmethod
+    @guarded()
     def mark_provider_unhealthy(provider_name, health_key):
-        redis_client.hset(health_key, provider_name, "unhealthy")
+        """
+        Excluye al proveedor durante un backoff que crece con cada marca reciente.
+        Devuelve la duración del backoff en segundos.
+        """
+        return float(mark_unhealthy_script(
+            keys=[health_redis_key(provider_name, health_key)],
+            args=[HEALTH_BACKOFF_BASE, HEALTH_BACKOFF_MAX, HEALTH_STRIKE_TTL]
+        ))
 
     @staticmethod
+    @guarded()
+    async def mark_provider_unhealthy_async(provider_name, health_key):
+        """
+        Versión asíncrona de mark_provider_unhealthy.
+        """
+        return float(await mark_unhealthy_script.run_async(
+            keys=[health_redis_key(provider_name, health_key)],
+            args=[HEALTH_BACKOFF_BASE, HEALTH_BACKOFF_MAX, HEALTH_STRIKE_TTL]
+        ))
+
+    @staticmethod
+    @guarded()
     def mark_provider_healthy(provider_name, health_key):
-        redis_client.hset(health_key, provider_name, "healthy")
+        """
+        Devuelve el proveedor al pool de inmediato, olvidando sus marcas.
+        """
+        get_redis_client().delete(health_redis_key(provider_name, health_key))
+
+    @staticmethod
+    @guarded()
+    def acquire_probe(provider_name, health_key, lease_ttl):
+        """
+        Reserva durante lease_ttl segundos el sondeo de un proveedor cuyo backoff venció.
+        Devuelve True si esta instancia debe confirmar su recuperación.
+        """
+        return bool(int(acquire_probe_script(keys=[health_redis_key(provider_name, health_key)], args=[lease_ttl])))
+
+    @staticmethod
+    @guarded()
+    async def acquire_probe_async(provider_name, health_key, lease_ttl):
+        """
+        Versión asíncrona de acquire_probe.
+        """
+        return bool(int(await acquire_probe_script.run_async(keys=[health_redis_key(provider_name, health_key)], args=[lease_ttl])))
 
     @staticmethod
+    @guarded()
     def is_provider_healthy(provider_name, health_key):
-        return redis_client.hget(health_key, provider_name) != "unhealthy"
+        values = get_redis_client().hmget(health_redis_key(provider_name, health_key), ("state", "until"))
+        return parse_health(values, time.time()) == "healthy"
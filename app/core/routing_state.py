@@ -0,0 +1,188 @@
+# core/routing_state.py
+import logging as logger
+import redis
+import threading
+import time
+
+
+def local_latency_stats(stats: dict, latency: float, alpha: float, gain: float) -> dict:
+    """
+    Aplica una muestra de latencia a las estadísticas del proveedor en el proceso, con la misma
+    aproximación que el script de Redis (usa |x - ewma| en lugar de la dispersión media).
+    """
+    if not stats or stats.get("n", 0) == 0:
+        return {"n": 1, "ewma": latency, "p50": latency, "p95": latency, "p99": latency}
+    step = gain * max(abs(latency - stats["ewma"]), 0.001)
+    quantiles = [
+        stats[field] + step * p if latency > stats[field] else stats[field] - step * (1 - p)
+        for field, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+    ]
+    p50 = max(quantiles[0], 0)
+    p95 = max(quantiles[1], p50)
+    p99 = max(quantiles[2], p95)
+    return {"n": stats["n"] + 1, "ewma": stats["ewma"] + alpha * (latency - stats["ewma"]), "p50": p50, "p95": p95, "p99": p99}
+
+
+class RoutingStateCache:
+    """
+    Copia en proceso del estado de enrutamiento (uso, salud y latencia por proveedor).
+
+    Se recarga desde Redis en una sola lectura cuando vence el TTL y se actualiza con
+    las escrituras locales, de modo que la mayoría de las decisiones de enrutamiento
+    no hacen llamadas de red. Redis sigue siendo la fuente de verdad entre instancias.
+
+    Si Redis no responde, el caché pasa a modo degradado: conserva el último estado conocido
+    (o el de fallback si nunca cargó), levanta las marcas de no saludable cuyo backoff venció
+    y sigue aplicando los resultados de los envíos localmente hasta que Redis vuelva.
+
+    get_async recarga con async_loader sin bloquear el event loop; mientras una recarga está
+    en curso, las demás corrutinas siguen con el snapshot anterior.
+    """
+
+    def __init__(self, loader, ttl: float, fallback=None, async_loader=None) -> None:
+        self._loader = loader
+        self._async_loader = async_loader
+        self._ttl = ttl
+        self._fallback = fallback
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._reloading = False
+        # Sondeos tomados por este proceso: proveedor -> fin del lease en el reloj del proceso
+        self._probe_leases = {}
+        self.degraded = False
+
+    def get(self) -> dict:
+        """
+        Devuelve el snapshot vigente, recargándolo desde Redis si expiró.
+        """
+        with self._lock:
+            if self._expired():
+                try:
+                    self._store(self._loader())
+                except redis.RedisError as e:
+                    self._store_failure(e)
+            return self._snapshot
+
+    async def get_async(self) -> dict:
+        """
+        Equivalente a get para el event loop.
+        """
+        if self._async_loader is None:
+            return self.get()
+        if not self._expired() or (self._reloading and self._snapshot is not None):
+            return self._snapshot
+        self._reloading = True
+        try:
+            snapshot = await self._async_loader()
+        except redis.RedisError as e:
+            with self._lock:
+                self._store_failure(e)
+        else:
+            with self._lock:
+                self._store(snapshot)
+        finally:
+            self._reloading = False
+        return self._snapshot
+
+    def _expired(self) -> bool:
+        return self._snapshot is None or time.monotonic() - self._loaded_at > self._ttl
+
+    def _store(self, snapshot: dict) -> None:
+        self._snapshot = snapshot
+        self.degraded = False
+        self._loaded_at = time.monotonic()
+
+    def _store_failure(self, error: redis.RedisError) -> None:
+        if self._snapshot is None and self._fallback is None:
+            raise error
+        if not self.degraded:
+            logger.warning("No se pudo cargar el estado de enrutamiento de Redis; se usa el estado local.")
+        self.degraded = True
+        self._snapshot = self._local_snapshot()
+        self._loaded_at = time.monotonic()
+
+    def _local_snapshot(self) -> dict:
+        snapshot = self._snapshot if self._snapshot is not None else self._fallback()
+        now = time.monotonic()
+        for state in snapshot.values():
+            if not state["healthy"] and state.get("unhealthy_until", 0.0) <= now:
+                state["healthy"] = True
+                state["probe"] = False
+        return snapshot
+
+    def invalidate(self) -> None:
+        """
+        Descarta el snapshot para forzar una recarga en la próxima lectura.
+        """
+        with self._lock:
+            self._snapshot = None
+
+    def record_send_outcome(self, provider_name: str, healthy: bool, usage: int, latency_stats: dict) -> None:
+        """
+        Aplica localmente el resultado de un envío ya registrado en Redis.
+        """
+        with self._lock:
+            if self._snapshot is None or provider_name not in self._snapshot:
+                return
+            for name, state in self._snapshot.items():
+                state["usage"] = usage if name == provider_name else 0
+            self._snapshot[provider_name]["healthy"] = healthy
+            self._snapshot[provider_name]["probe"] = False
+            self._snapshot[provider_name]["latency"] = latency_stats
+            self._probe_leases.pop(provider_name, None)
+
+    def record_local_outcome(self, provider_name: str, healthy: bool, latency: float, sent_count: int,
+                             alpha: float, gain: float, backoff: float = 0.0) -> tuple:
+        """
+        Aplica en el proceso el resultado de un envío que no se pudo registrar en Redis.
+        Devuelve (uso consecutivo, estadísticas de latencia) estimados localmente.
+        """
+        with self._lock:
+            if self._snapshot is None or provider_name not in self._snapshot:
+                return sent_count, local_latency_stats({}, latency, alpha, gain)
+            state = self._snapshot[provider_name]
+            usage = state["usage"] + sent_count
+            latency_stats = local_latency_stats(state["latency"], latency, alpha, gain)
+        self.record_send_outcome(provider_name, healthy, usage, latency_stats)
+        if not healthy:
+            self.mark_unhealthy(provider_name, backoff)
+        return usage, latency_stats
+
+    def mark_unhealthy(self, provider_name: str, backoff: float = 0.0) -> None:
+        """
+        Aplica localmente una marca de proveedor no saludable durante backoff segundos.
+        """
+        with self._lock:
+            self._probe_leases.pop(provider_name, None)
+            if self._snapshot is not None and provider_name in self._snapshot:
+                self._snapshot[provider_name]["healthy"] = False
+                self._snapshot[provider_name]["probe"] = False
+                self._snapshot[provider_name]["unhealthy_until"] = time.monotonic() + backoff
+
+    def record_probe(self, provider_name: str, granted: bool, lease_ttl: float) -> None:
+        """
+        Aplica localmente el intento de sondeo. Si esta instancia lo tomó, sólo guarda el lease
+        durante lease_ttl segundos: el proveedor sigue no saludable, fuera del pool, hasta que el
+        envío del sondeo responda a tiempo (record_send_outcome) o falle (mark_unhealthy).
+        """
+        with self._lock:
+            if granted:
+                self._probe_leases[provider_name] = time.monotonic() + lease_ttl
+            if self._snapshot is not None and provider_name in self._snapshot:
+                self._snapshot[provider_name]["probe"] = False
+
+    def holds_probe(self, provider_name: str) -> bool:
+        """
+        Indica si este proceso tiene un sondeo vigente del proveedor.
+        """
+        with self._lock:
+            return self._probe_leases.get(provider_name, 0.0) > time.monotonic()
+
+    def record_tokens(self, provider_name: str, tokens: float) -> None:
+        """
+        Aplica localmente la capacidad de envío restante del proveedor.
+        """
+        with self._lock:
+            if self._snapshot is not None and provider_name in self._snapshot:
+                self._snapshot[provider_name]["tokens"] = tokens
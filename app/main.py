@@ -1,12 +1,15 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from app.api import email_routes
+from app.core.metrics import metrics
+from app.core.logging_config import configure_logging
 from dotenv import load_dotenv
 import os
 
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv()
+configure_logging()
 
 app = FastAPI()
 
@@ -27,3 +30,8 @@ def serve_frontend() -> HTMLResponse:
 @app.get("/health")
 def health_check() -> dict:
     return {"status": "ok"}
+
+# Métricas del proceso en formato de texto de Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1 +1,2 @@
-from .email import EmailRequest
\ No newline at end of file
+from .email import EmailRequest
+from .template import TemplateRequest
\ No newline at end of file
@@ -1,11 +1,39 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+import json
+from pydantic import BaseModel, EmailStr, field_validator, model_validator
+from typing import Any, Dict, Optional
+from ..core.config import PRIORITY_LANES
 
 class EmailRequest(BaseModel):
     to: EmailStr  # Validación automática para direcciones de correo válidas
-    subject: str  # Asunto del correo
-    body: str     # Cuerpo del correo en formato HTML o texto plano
+    subject: Optional[str] = None  # Asunto del correo (no se usa con template_id)
+    body: Optional[str] = None     # Cuerpo del correo en formato HTML o texto plano (no se usa con template_id)
     from_email: Optional[EmailStr] = None  # Opción de usar un correo 'from' específico
+    idempotency_key: Optional[str] = None  # Clave del cliente para no enviar dos veces el mismo correo
+    template_id: Optional[str] = None  # Plantilla registrada en el servicio, en lugar de subject y body
+    template_vars: Dict[str, Any] = {}  # Variables con las que se renderiza la plantilla
+    priority: Optional[str] = None  # Carril de prioridad (por defecto, según el endpoint)
+
+    @field_validator("priority")
+    @classmethod
+    def check_priority(cls, priority):
+        if priority is not None and priority not in PRIORITY_LANES:
+            raise ValueError(f"Prioridad desconocida: {priority}. Opciones: {', '.join(PRIORITY_LANES)}.")
+        return priority
+
+    @model_validator(mode="after")
+    def check_content(self):
+        if self.template_id is None and (self.subject is None or self.body is None):
+            raise ValueError("Se requieren subject y body, o un template_id.")
+        return self
+
+    def content_key(self) -> tuple:
+        """
+        Identifica el contenido del correo: los correos con la misma clave se pueden enviar
+        juntos por la API masiva de los proveedores.
+        """
+        if self.template_id is None:
+            return self.subject, self.body, self.from_email
+        return self.template_id, json.dumps(self.template_vars, sort_keys=True, default=str), self.from_email
     
     class Config:
         schema_extra = {
@@ -13,6 +41,7 @@ class EmailRequest(BaseModel):
                 "to": "destinatario@example.com",
                 "subject": "Asunto del correo",
                 "body": "<h1>Este es un mensaje de prueba</h1>",
-                "from_email": "foreromartinez.andres@gmail.com"  # Este campo es opcional
+                "from_email": "foreromartinez.andres@gmail.com",  # Este campo es opcional
+                "idempotency_key": "pedido-1234-confirmacion"  # Este campo es opcional
             }
         }
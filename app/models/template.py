@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Dict
+
+class TemplateRequest(BaseModel):
+    subject: str  # Asunto, con variables $nombre o ${nombre}
+    body: str     # Cuerpo HTML, con variables $nombre o ${nombre}
+    provider_templates: Dict[str, str] = {}  # Plantilla nativa por proveedor, que la renderiza él mismo
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "subject": "Tu pedido $order_id fue confirmado",
+                "body": "<h1>Hola $name</h1><p>Gracias por tu compra.</p>",
+                "provider_templates": {"SendGrid": "d-0123456789abcdef"}  # Este campo es opcional
+            }
+        }
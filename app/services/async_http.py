@@ -0,0 +1,46 @@
+import asyncio
+import httpx
+from typing import Optional
+from ..core.config import PROVIDER_HTTP_MAX_CONNECTIONS, PROVIDER_HTTP_MAX_KEEPALIVE, PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT
+
+
+def http_timeout(timeout: Optional[float] = None) -> httpx.Timeout:
+    """
+    Timeout de httpx para un intento de timeout segundos (PROVIDER_READ_TIMEOUT si es None).
+    """
+    timeout = timeout or PROVIDER_READ_TIMEOUT
+    return httpx.Timeout(timeout, connect=min(PROVIDER_CONNECT_TIMEOUT, timeout))
+
+
+class AsyncClientPool:
+    """
+    Mantiene un httpx.AsyncClient con conexiones keep-alive reutilizadas entre envíos.
+
+    Las conexiones de httpx pertenecen al event loop que las abrió, así que se crea un
+    cliente nuevo sólo cuando cambia el loop (por ejemplo, entre invocaciones con asyncio.run).
+    """
+
+    def __init__(self, **client_kwargs) -> None:
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._loop = None
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=PROVIDER_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=PROVIDER_HTTP_MAX_KEEPALIVE
+                ),
+                timeout=http_timeout(),
+                **self._client_kwargs
+            )
+            self._loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
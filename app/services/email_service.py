@@ -1,177 +1,767 @@
-import logging as logger
+import asyncio
+import logging
+import threading
 import time
 import pybreaker
+import redis
+from contextlib import contextmanager
 from ..core import RedisHandler
 from ..core import get_circuit_breakers
+from ..core import RoutingStateCache
+from ..core.redis_handler import ewma_alpha
+from ..core.deadline import Deadline
+from ..core.exceptions import ProviderThrottledError, ProviderTimeoutError, DeadlineExceededError
+from ..core.lanes import HIGH_PRIORITY_LANE
+from ..core.metrics import metrics
 from .sendgrid_service import SendGridService
 from .ses_service import SESService
+from .provider_registry import build_provider_registry
+from .routing_strategies import get_routing_strategy, LeastLatencyStrategy
+from .templates import template_store
 from ..models import EmailRequest
-from ..core.config import LATENCY_THRESHOLD, LATENCY_HISTORY_SIZE, MAX_CONSECUTIVE_USE, USE_TRACKER_KEY, EMAIL_COUNT_KEY, HEALTH_CHECK_KEY, LATENCY_KEY
+from ..core.config import LATENCY_THRESHOLD, LATENCY_HISTORY_SIZE, USE_TRACKER_KEY, EMAIL_COUNT_KEY, HEALTH_CHECK_KEY, LATENCY_KEY, PROVIDER_MAX_CONCURRENCY, ROUTING_STATE_TTL, ROUTING_LATENCY_PERCENTILE, EMAIL_PROVIDERS, ROUTING_STRATEGY, RATE_LIMIT_KEY, HIGH_PRIORITY_RESERVED_CAPACITY, HEALTH_PROBE_LEASE_TTL, SEND_DEADLINE_SECONDS, LATENCY_QUANTILE_STEP, HEALTH_BACKOFF_BASE
 
 
-logger.basicConfig(level=logger.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s',  
-                    datefmt='%Y-%m-%d %H:%M:%S', 
-                    handlers=[logger.StreamHandler()])
+logger = logging.getLogger(__name__)
 
+# Tipos de proveedor que se pueden declarar en EMAIL_PROVIDERS
+PROVIDER_FACTORIES = {
+    "sendgrid": SendGridService,
+    "ses": SESService,
+}
 
 class EmailService:
 
-    def __init__(self):
-        self.sendgrid_service = SendGridService()
-        self.ses_service = SESService()
-        self.providers = [
-            ("SendGrid", self.sendgrid_service),
-            ("Amazon SES", self.ses_service)
-        ]
-        self.circuit_breakers = get_circuit_breakers()
+    def __init__(self, provider_configs=EMAIL_PROVIDERS, routing_strategy=ROUTING_STRATEGY, templates=None):
+        self.registry = build_provider_registry(provider_configs, PROVIDER_FACTORIES)
+        self.providers = self.registry.providers
+        self.provider_weights = self.registry.weights
+        self.rate_limits = self.registry.rate_limits
+        self.routing_strategy = get_routing_strategy(routing_strategy)
+        self.circuit_breakers = get_circuit_breakers([provider_name for provider_name, _ in self.providers])
+        # Envíos en curso por proveedor, usados por las estrategias de menor carga
+        self.outstanding = {provider_name: 0 for provider_name, _ in self.providers}
+        self._outstanding_lock = threading.Lock()
+        # Limita los envíos simultáneos por proveedor cuando el worker procesa en paralelo
+        self.provider_semaphores = {
+            provider_name: threading.BoundedSemaphore(PROVIDER_MAX_CONCURRENCY)
+            for provider_name, _ in self.providers
+        }
+        # Semáforos de asyncio por proveedor para send_email_async, ligados a su event loop
+        self._async_semaphores = {}
+        self._async_semaphores_loop = None
+        # Estado de enrutamiento cacheado en proceso; se recarga de Redis en un solo viaje y,
+        # si Redis no responde, se sigue usando el último conocido (o el inicial)
+        self.routing_state = RoutingStateCache(
+            self.load_routing_snapshot, ROUTING_STATE_TTL, self.initial_routing_snapshot, self.load_routing_snapshot_async
+        )
+        # Plantillas compiladas para los correos con template_id
+        self.templates = templates if templates is not None else template_store
 
-    def send_email(self, email_data: EmailRequest, max_retries=2):
+    def send_email(self, email_data: EmailRequest, max_retries=2, deadline: Deadline = None):
         """
         Envía un correo electrónico utilizando el proveedor más adecuado basado en el uso y la latencia.
+        El tiempo hasta deadline (SEND_DEADLINE_SECONDS si no se indica) se reparte entre los intentos.
         """
-        current_provider = self.choose_provider_based_on_usage()
+        deadline = deadline or Deadline.after(SEND_DEADLINE_SECONDS)
+        content = self.prepare_content(email_data)
+        current_provider = self.choose_provider_based_on_usage(email_data.priority, deadline)
+        tried = set()
 
-        for _ in range(max_retries):
+        for attempt in range(max_retries):
             provider_name, provider_service = current_provider
             circuit_breaker = self.circuit_breakers[provider_name]
+            tried.add(provider_name)
 
             if not self.is_provider_healthy(provider_name):
-                current_provider = self.get_next_healthy_provider(provider_name)
+                current_provider = self.get_next_healthy_provider(provider_name, tried, email_data.priority, deadline)
                 continue
 
+            timeout = deadline.attempt_timeout(max_retries - attempt)
             try:
-                self.attempt_send_email(provider_name, provider_service, circuit_breaker, email_data)
+                self.attempt_send_email(provider_name, provider_service, circuit_breaker, email_data, content, timeout)
                 return provider_name  # Retornar si el envío fue exitoso
 
             except pybreaker.CircuitBreakerError:
                 self.handle_circuit_breaker_error(provider_name)
-                current_provider = self.get_next_healthy_provider(provider_name)
+                current_provider = self.get_next_healthy_provider(provider_name, tried, email_data.priority, deadline)
+            except ProviderThrottledError as e:
+                self.handle_throttling(provider_name, e)
+                current_provider = self.get_next_healthy_provider(provider_name, tried, email_data.priority, deadline)
+            except ProviderTimeoutError as e:
+                self.handle_timeout(provider_name, e)
+                current_provider = self.get_next_healthy_provider(provider_name, tried, email_data.priority, deadline)
             except Exception as e:
                 self.handle_general_exception(provider_name, e)
-                current_provider = self.get_next_healthy_provider(provider_name)
+                current_provider = self.get_next_healthy_provider(provider_name, tried, email_data.priority, deadline)
 
         raise RuntimeError("Error al enviar el correo después de múltiples reintentos.")
 
-    def choose_provider_based_on_usage(self):
+    async def send_email_async(self, email_data: EmailRequest, max_retries=2, deadline: Deadline = None):
         """
-        Elige el proveedor basado en el uso y la latencia.
+        Versión asíncrona de send_email: usa los clientes HTTP asíncronos de los proveedores
+        con el mismo enrutamiento, circuit breakers, métricas y presupuesto de tiempo. Redis se
+        consulta con el cliente asíncrono, así que el envío no bloquea el event loop.
         """
-        sendgrid_count = self.get_usage_count("SendGrid")
-        ses_count = self.get_usage_count("Amazon SES")
+        deadline = deadline or Deadline.after(SEND_DEADLINE_SECONDS)
+        content = await self.prepare_content_async(email_data)
+        current_provider = await self.choose_provider_based_on_usage_async(email_data.priority, deadline)
+        tried = set()
+
+        for attempt in range(max_retries):
+            provider_name, provider_service = current_provider
+            circuit_breaker = self.circuit_breakers[provider_name]
+            tried.add(provider_name)
+
+            if not self.is_provider_healthy(provider_name, await self.routing_state.get_async()):
+                current_provider = self.get_next_healthy_provider(
+                    provider_name, tried, email_data.priority, deadline, await self.routing_state.get_async()
+                )
+                continue
+
+            timeout = deadline.attempt_timeout(max_retries - attempt)
+            try:
+                await self.attempt_send_email_async(provider_name, provider_service, circuit_breaker, email_data, content, timeout)
+                return provider_name  # Retornar si el envío fue exitoso
 
-        if self.should_switch_provider(sendgrid_count, "Amazon SES"):
-            return self.providers[1]  # Switch to Amazon SES
+            except pybreaker.CircuitBreakerError:
+                await self.handle_circuit_breaker_error_async(provider_name)
+            except ProviderThrottledError as e:
+                self.handle_throttling(provider_name, e)
+            except ProviderTimeoutError as e:
+                self.handle_timeout(provider_name, e)
+            except Exception as e:
+                await self.handle_general_exception_async(provider_name, e)
+            current_provider = self.get_next_healthy_provider(
+                provider_name, tried, email_data.priority, deadline, await self.routing_state.get_async()
+            )
+
+        raise RuntimeError("Error al enviar el correo después de múltiples reintentos.")
 
-        if self.should_switch_provider(ses_count, "SendGrid"):
-            return self.providers[0]  # Switch to SendGrid
+    def send_bulk(self, emails: list, deadline: Deadline = None) -> list:
+        """
+        Envía un lote de correos agrupando los de contenido idéntico en envíos masivos del proveedor.
+        Devuelve, por correo y en el mismo orden, el proveedor usado o la excepción del fallo.
+        """
+        deadline = deadline or Deadline.after(SEND_DEADLINE_SECONDS)
+        groups = {}
+        for index, email_data in enumerate(emails):
+            groups.setdefault((email_data.priority, email_data.content_key()), []).append(index)
+
+        results = [None] * len(emails)
+        for indexes in groups.values():
+            if len(indexes) == 1:
+                try:
+                    results[indexes[0]] = self.send_email(emails[indexes[0]], deadline=deadline)
+                except Exception as e:
+                    results[indexes[0]] = e
+                continue
 
-        return self.choose_provider_with_lower_latency()
+            group_results = self.send_bulk_group([emails[index] for index in indexes], deadline=deadline)
+            for index, result in zip(indexes, group_results):
+                results[index] = result
+        return results
 
-    def get_next_healthy_provider(self, current_provider) -> str:
+    def send_bulk_group(self, group: list, max_retries=2, deadline: Deadline = None) -> list:
         """
-        Obtiene el siguiente proveedor saludable.
+        Envía un grupo de correos con el mismo contenido usando la API masiva de los proveedores,
+        en bloques del tamaño máximo que admite cada uno.
+        """
+        deadline = deadline or Deadline.after(SEND_DEADLINE_SECONDS)
+        try:
+            content = self.prepare_content(group[0])
+        except Exception as e:
+            return [e] * len(group)
+
+        results = [None] * len(group)
+        pending = list(range(len(group)))
+        failures = 0
+        tried = set()
+        priority = group[0].priority
+        current_provider = self.choose_provider_based_on_usage(priority, deadline)
+        error = RuntimeError("Error al enviar el correo después de múltiples reintentos.")
+
+        while pending and failures < max_retries:
+            provider_name, provider_service = current_provider
+            circuit_breaker = self.circuit_breakers[provider_name]
+            tried.add(provider_name)
+
+            if self.is_provider_healthy(provider_name):
+                chunk = pending[:provider_service.max_bulk_recipients]
+                try:
+                    timeout = deadline.attempt_timeout(max_retries - failures)
+                except DeadlineExceededError as e:
+                    error = e
+                    break
+                try:
+                    errors = self.attempt_send_bulk_email(provider_name, provider_service, circuit_breaker, [group[i] for i in chunk], content, timeout)
+                    for index, chunk_error in zip(chunk, errors):
+                        results[index] = provider_name if chunk_error is None else RuntimeError(chunk_error)
+                    pending = pending[len(chunk):]
+                    failures = 0
+                    continue
+                except pybreaker.CircuitBreakerError:
+                    self.handle_circuit_breaker_error(provider_name)
+                except ProviderThrottledError as e:
+                    self.handle_throttling(provider_name, e)
+                except ProviderTimeoutError as e:
+                    self.handle_timeout(provider_name, e)
+                except Exception as e:
+                    self.handle_general_exception(provider_name, e)
+
+            failures += 1
+            try:
+                current_provider = self.get_next_healthy_provider(provider_name, tried, priority, deadline)
+            except RuntimeError:
+                break
+
+        for index in pending:
+            results[index] = error
+        return results
+
+    def choose_provider_based_on_usage(self, priority=None, deadline: Deadline = None):
+        """
+        Elige el proveedor entre los saludables, con cuota disponible para el carril del correo
+        y con latencia compatible con su deadline, según la estrategia de enrutamiento configurada.
+        """
+        with metrics.timer("email_stage_seconds", stage="route"):
+            routing_state = self.routing_state.get()
+            return self.claim_probe(routing_state) or self.choose_among_healthy(routing_state, priority, deadline)
+
+    async def choose_provider_based_on_usage_async(self, priority=None, deadline: Deadline = None):
+        """
+        Versión asíncrona de choose_provider_based_on_usage.
+        """
+        with metrics.timer("email_stage_seconds", stage="route"):
+            routing_state = await self.routing_state.get_async()
+            return await self.claim_probe_async(routing_state) or self.choose_among_healthy(routing_state, priority, deadline)
+
+    def choose_among_healthy(self, routing_state: dict, priority=None, deadline: Deadline = None):
+        healthy = [provider for provider in self.providers if routing_state[provider[0]]["healthy"]]
+        # Si ninguno está saludable se elige entre todos y el envío decidirá el fallback
+        candidates = self.with_capacity(healthy, routing_state, priority) or healthy or self.providers
+        candidates = self.within_deadline(candidates, routing_state, deadline) or candidates
+        return self.routing_strategy.choose(candidates, routing_state, self.provider_weights, self.outstanding)
+
+    def claim_probe(self, routing_state: dict):
         """
-        for provider in self.providers:
-            if provider[0] != current_provider and self.is_provider_healthy(provider[0]):
-                logger.info(f"Cambiando a {provider[0]}, ya que es saludable.")
+        Si el backoff de un proveedor venció, intenta tomar su sondeo: el correo actual se envía
+        con él para confirmar que se recuperó. Sólo una instancia a la vez sondea cada proveedor.
+        """
+        for provider in self.probe_candidates(routing_state):
+            try:
+                granted = RedisHandler.acquire_probe(provider[0], HEALTH_CHECK_KEY, HEALTH_PROBE_LEASE_TTL)
+            except redis.RedisError:
+                # Sin Redis no hay coordinación entre instancias; cada una sondea por su cuenta
+                granted = True
+            if self.record_probe(provider, granted):
                 return provider
-        logger.error("No hay proveedores saludables disponibles.")
-        raise RuntimeError("No hay proveedores saludables disponibles.")
+        return None
+
+    async def claim_probe_async(self, routing_state: dict):
+        """
+        Versión asíncrona de claim_probe.
+        """
+        for provider in self.probe_candidates(routing_state):
+            try:
+                granted = await RedisHandler.acquire_probe_async(provider[0], HEALTH_CHECK_KEY, HEALTH_PROBE_LEASE_TTL)
+            except redis.RedisError:
+                granted = True
+            if self.record_probe(provider, granted):
+                return provider
+        return None
+
+    def probe_candidates(self, routing_state: dict) -> list:
+        return [provider for provider in self.providers if routing_state[provider[0]].get("probe")]
+
+    def record_probe(self, provider, granted: bool) -> bool:
+        self.routing_state.record_probe(provider[0], granted, HEALTH_PROBE_LEASE_TTL)
+        if granted:
+            logger.info("Sondeando %s con un envío real tras su backoff.", provider[0])
+            metrics.increment("email_provider_probes_total", provider=provider[0])
+        return granted
+
+    def get_next_healthy_provider(self, current_provider, tried=(), priority=None, deadline: Deadline = None, routing_state: dict = None) -> tuple:
+        """
+        Obtiene el siguiente proveedor saludable, priorizando los que aún no se intentaron.
+        """
+        metrics.increment("email_fallback_hops_total", from_provider=current_provider)
+        if routing_state is None:
+            routing_state = self.routing_state.get()
+        healthy = [
+            provider for provider in self.providers
+            if provider[0] != current_provider and routing_state[provider[0]]["healthy"]
+        ]
+        candidates = [provider for provider in healthy if provider[0] not in tried] or healthy
+        candidates = self.with_capacity(candidates, routing_state, priority) or candidates
+        candidates = self.within_deadline(candidates, routing_state, deadline) or candidates
+        if not candidates:
+            logger.error("No hay proveedores saludables disponibles.")
+            raise RuntimeError("No hay proveedores saludables disponibles.")
+
+        provider = self.routing_strategy.choose(candidates, routing_state, self.provider_weights, self.outstanding)
+        logger.info("Cambiando a %s, ya que es saludable.", provider[0])
+        return provider
+
+    def with_capacity(self, providers: list, routing_state: dict, priority=None) -> list:
+        """
+        Filtra los proveedores que tienen al menos un token de envío disponible para el carril.
+        """
+        return [
+            provider for provider in providers
+            if routing_state[provider[0]]["tokens"] - self.reserved_tokens(provider[0], priority) >= 1
+        ]
+
+    @staticmethod
+    def within_deadline(providers: list, routing_state: dict, deadline: Deadline = None) -> list:
+        """
+        Filtra los proveedores cuya latencia en el percentil de enrutamiento cabe en el tiempo
+        que le queda al deadline. Los proveedores sin muestras de latencia no se descartan.
+        """
+        if deadline is None:
+            return providers
+        remaining = deadline.remaining()
+        return [
+            provider for provider in providers
+            if routing_state[provider[0]]["latency"]["n"] == 0
+            or routing_state[provider[0]]["latency"][ROUTING_LATENCY_PERCENTILE] <= remaining
+        ]
+
+    def reserved_tokens(self, provider_name, priority=None) -> float:
+        """
+        Tokens del proveedor reservados para el carril de alta prioridad, que los demás
+        carriles no pueden usar.
+        """
+        if priority in (None, HIGH_PRIORITY_LANE) or provider_name not in self.rate_limits:
+            return 0.0
+        return self.rate_limits[provider_name][1] * HIGH_PRIORITY_RESERVED_CAPACITY
+
+    def load_routing_snapshot(self) -> dict:
+        """
+        Carga desde Redis el estado de enrutamiento de todos los proveedores.
+        """
+        provider_names = [provider_name for provider_name, _ in self.providers]
+        with metrics.timer("email_stage_seconds", stage="routing_snapshot"):
+            return RedisHandler.get_routing_snapshot(
+                provider_names, USE_TRACKER_KEY, HEALTH_CHECK_KEY, LATENCY_KEY, self.rate_limits, RATE_LIMIT_KEY
+            )
+
+    async def load_routing_snapshot_async(self) -> dict:
+        """
+        Versión asíncrona de load_routing_snapshot.
+        """
+        provider_names = [provider_name for provider_name, _ in self.providers]
+        with metrics.timer("email_stage_seconds", stage="routing_snapshot"):
+            return await RedisHandler.get_routing_snapshot_async(
+                provider_names, USE_TRACKER_KEY, HEALTH_CHECK_KEY, LATENCY_KEY, self.rate_limits, RATE_LIMIT_KEY
+            )
+
+    def initial_routing_snapshot(self) -> dict:
+        """
+        Estado de enrutamiento sin datos de Redis: todos los proveedores saludables, sin uso,
+        sin muestras de latencia y sin límite de cuota.
+        """
+        return {
+            provider_name: {
+                "usage": 0,
+                "healthy": True,
+                "probe": False,
+                "unhealthy_until": 0.0,
+                "latency": {"n": 0, "ewma": float('inf'), "p50": float('inf'), "p95": float('inf'), "p99": float('inf')},
+                "tokens": float('inf'),
+            }
+            for provider_name, _ in self.providers
+        }
 
     def log_provider_latencies(self) -> None:
         """
-        Muestra las latencias actuales de los proveedores desde Redis.
+        Muestra las latencias actuales de los proveedores según el estado de enrutamiento.
         """
-        sendgrid_latency = RedisHandler.get_predicted_latency("SendGrid", LATENCY_KEY)
-        ses_latency = RedisHandler.get_predicted_latency("Amazon SES", LATENCY_KEY)
-        logger.info(f"Latencias actuales en Redis -> SendGrid: {sendgrid_latency:.2f}s, Amazon SES: {ses_latency:.2f}s")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        routing_state = self.routing_state.get()
+        for provider_name, _ in self.providers:
+            latency = routing_state[provider_name]["latency"]
+            logger.info("Latencias actuales de %s -> p50: %.2fs, p95: %.2fs, p99: %.2fs",
+                        provider_name, latency['p50'], latency['p95'], latency['p99'])
 
-    def is_provider_healthy(self, provider_name) -> bool:
+    def is_provider_healthy(self, provider_name, routing_state: dict = None) -> bool:
         """
-        Verifica si el proveedor está saludable.
+        Verifica si el proveedor está saludable. Un proveedor cuyo sondeo tomó este proceso se
+        puede intentar aunque siga marcado como no saludable.
         """
-        if not RedisHandler.is_provider_healthy(provider_name, HEALTH_CHECK_KEY):
-            logger.warning(f"Proveedor {provider_name} marcado como no saludable. Cambiando de proveedor.")
+        if routing_state is None:
+            routing_state = self.routing_state.get()
+        if not routing_state[provider_name]["healthy"] and not self.routing_state.holds_probe(provider_name):
+            logger.warning("Proveedor %s marcado como no saludable. Cambiando de proveedor.", provider_name)
             return False
         return True
 
-    def attempt_send_email(self, provider_name, provider_service, circuit_breaker, email_data) -> None:
+    def prepare_content(self, email_data) -> tuple:
         """
-        Intenta enviar el correo electrónico utilizando el proveedor y el circuito breaker.
+        Resuelve el contenido del correo antes de elegir proveedor: (asunto, cuerpo, plantilla).
+        Una plantilla se toma de la caché de plantillas compiladas y se renderiza aquí, así que
+        una plantilla inexistente o una variable faltante no se atribuyen a ningún proveedor.
         """
-        start_time = time.time()
-        logger.info(f"Intentando enviar con {provider_name}")
-        print(f"Intentando enviar con {provider_name}")
+        if email_data.template_id is None:
+            return email_data.subject, email_data.body, None
+        with metrics.timer("email_stage_seconds", stage="render"):
+            template = self.templates.get(email_data.template_id)
+            subject, body = template.render(email_data.template_vars)
+        return subject, body, template
 
-        circuit_breaker.call(
-            provider_service.send_email,
-            to=email_data.to,
-            subject=email_data.subject,
-            body=email_data.body,
-            from_email=email_data.from_email
-        )
+    async def prepare_content_async(self, email_data) -> tuple:
+        """
+        Versión asíncrona de prepare_content: una plantilla fuera de la caché se lee sin
+        bloquear el event loop.
+        """
+        if email_data.template_id is None:
+            return email_data.subject, email_data.body, None
+        with metrics.timer("email_stage_seconds", stage="render"):
+            template = await self.templates.get_async(email_data.template_id)
+            subject, body = template.render(email_data.template_vars)
+        return subject, body, template
+
+    @staticmethod
+    def provider_request(provider_name, provider_service, email_data, content, timeout=None, asynchronous=False) -> tuple:
+        """
+        Devuelve el método del proveedor y sus argumentos para enviar el correo en timeout
+        segundos. Si el proveedor tiene la plantilla nativa, la renderiza él con las variables.
+        """
+        subject, body, template = content
+        native_template_id = template.provider_templates.get(provider_name) if template is not None else None
+        if native_template_id:
+            send = provider_service.send_template_email_async if asynchronous else provider_service.send_template_email
+            return send, {
+                "to": email_data.to,
+                "template_id": native_template_id,
+                "template_vars": email_data.template_vars,
+                "from_email": email_data.from_email,
+                "timeout": timeout
+            }
+        send = provider_service.send_email_async if asynchronous else provider_service.send_email
+        return send, {"to": email_data.to, "subject": subject, "body": body, "from_email": email_data.from_email, "timeout": timeout}
+
+    def attempt_send_email(self, provider_name, provider_service, circuit_breaker, email_data, content, timeout=None) -> None:
+        """
+        Intenta enviar el correo electrónico utilizando el proveedor y el circuito breaker,
+        esperando como máximo timeout segundos su respuesta.
+        """
+        send, arguments = self.provider_request(provider_name, provider_service, email_data, content, timeout)
+        self.acquire_send_capacity(provider_name, priority=email_data.priority)
+        with self.track_outstanding(provider_name), self.provider_semaphores[provider_name]:
+            start_time = time.perf_counter()
+            logger.debug("Intentando enviar con %s", provider_name)
 
-        latency = time.time() - start_time
-        logger.info(f"Correo enviado exitosamente con {provider_name} en {latency:.2f} segundos.")
+            try:
+                circuit_breaker.call(send, **arguments)
+            except ProviderTimeoutError:
+                self.record_timeout(provider_name, time.perf_counter() - start_time)
+                raise
+
+            latency = time.perf_counter() - start_time
+        logger.info("Correo enviado exitosamente con %s en %.3f segundos.", provider_name, latency)
+        self.record_send_success(provider_name, latency)
         self.update_provider_metrics(provider_name, latency)
 
-    def update_provider_metrics(self, provider_name:str, latency:float) -> None:
+    async def attempt_send_email_async(self, provider_name, provider_service, circuit_breaker, email_data, content, timeout=None) -> None:
+        """
+        Intenta enviar el correo de forma asíncrona con el proveedor y su circuit breaker,
+        esperando como máximo timeout segundos su respuesta.
+        """
+        send, arguments = self.provider_request(provider_name, provider_service, email_data, content, timeout, asynchronous=True)
+        await self.acquire_send_capacity_async(provider_name, 1, email_data.priority)
+        with self.track_outstanding(provider_name):
+            async with self.get_async_semaphore(provider_name):
+                start_time = time.perf_counter()
+                logger.debug("Intentando enviar con %s", provider_name)
+
+                try:
+                    await circuit_breaker.call_async(send, **arguments)
+                except ProviderTimeoutError:
+                    await self.record_timeout_async(provider_name, time.perf_counter() - start_time)
+                    raise
+
+                latency = time.perf_counter() - start_time
+        logger.info("Correo enviado exitosamente con %s en %.3f segundos.", provider_name, latency)
+        self.record_send_success(provider_name, latency)
+        await self.update_provider_metrics_async(provider_name, latency)
+
+    def get_async_semaphore(self, provider_name) -> asyncio.Semaphore:
+        """
+        Devuelve el semáforo de concurrencia del proveedor para el event loop actual.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_semaphores_loop is not loop:
+            self._async_semaphores = {
+                name: asyncio.Semaphore(PROVIDER_MAX_CONCURRENCY) for name, _ in self.providers
+            }
+            self._async_semaphores_loop = loop
+        return self._async_semaphores[provider_name]
+
+    def attempt_send_bulk_email(self, provider_name, provider_service, circuit_breaker, emails, content, timeout=None) -> list:
+        """
+        Intenta enviar un bloque de correos idénticos en una sola llamada masiva al proveedor.
+        Las plantillas van ya renderizadas, ya que el contenido es el mismo para todos.
+        """
+        subject, body, _ = content
+        self.acquire_send_capacity(provider_name, len(emails), emails[0].priority)
+        with self.track_outstanding(provider_name), self.provider_semaphores[provider_name]:
+            start_time = time.perf_counter()
+            logger.debug("Intentando envío masivo de %d correos con %s", len(emails), provider_name)
+
+            try:
+                errors = circuit_breaker.call(
+                    provider_service.send_bulk_email,
+                    recipients=[email_data.to for email_data in emails],
+                    subject=subject,
+                    body=body,
+                    from_email=emails[0].from_email,
+                    timeout=timeout
+                )
+            except ProviderTimeoutError:
+                self.record_timeout(provider_name, time.perf_counter() - start_time)
+                raise
+
+            latency = time.perf_counter() - start_time
+        logger.info("Envío masivo de %d correos con %s completado en %.3f segundos.", len(emails), provider_name, latency)
+        self.record_send_success(provider_name, latency, sum(1 for error in errors if error is None))
+        self.update_provider_metrics(provider_name, latency, sent_count=sum(1 for error in errors if error is None))
+        return errors
+
+    def acquire_send_capacity(self, provider_name, count=1, priority=None) -> None:
+        """
+        Toma del token bucket del proveedor la cuota para count correos antes de enviarlos,
+        respetando la reserva del carril de alta prioridad.
+        Lanza ProviderThrottledError si no hay cuota disponible.
+        """
+        if provider_name not in self.rate_limits:
+            return
+        rate, burst = self.rate_limits[provider_name]
+        try:
+            with metrics.timer("email_stage_seconds", stage="rate_limit"):
+                allowed, tokens = RedisHandler.acquire_send_tokens(
+                    provider_name, rate, burst, RATE_LIMIT_KEY, count, self.reserved_tokens(provider_name, priority)
+                )
+        except redis.RedisError as e:
+            # Sin Redis no se puede repartir la cuota entre instancias; se deja el límite al proveedor
+            logger.warning("No se pudo tomar cuota de %s en Redis (%s); se envía sin límite local.", provider_name, e)
+            return
+        self.apply_send_capacity(provider_name, allowed, tokens)
+
+    async def acquire_send_capacity_async(self, provider_name, count=1, priority=None) -> None:
+        """
+        Versión asíncrona de acquire_send_capacity.
+        """
+        if provider_name not in self.rate_limits:
+            return
+        rate, burst = self.rate_limits[provider_name]
+        try:
+            with metrics.timer("email_stage_seconds", stage="rate_limit"):
+                allowed, tokens = await RedisHandler.acquire_send_tokens_async(
+                    provider_name, rate, burst, RATE_LIMIT_KEY, count, self.reserved_tokens(provider_name, priority)
+                )
+        except redis.RedisError as e:
+            logger.warning("No se pudo tomar cuota de %s en Redis (%s); se envía sin límite local.", provider_name, e)
+            return
+        self.apply_send_capacity(provider_name, allowed, tokens)
+
+    def apply_send_capacity(self, provider_name, allowed: bool, tokens: float) -> None:
+        self.routing_state.record_tokens(provider_name, tokens)
+        if not allowed:
+            rate, _ = self.rate_limits[provider_name]
+            raise ProviderThrottledError(f"{provider_name} no tiene cuota de envío disponible ({rate}/s).")
+
+    @staticmethod
+    def record_send_success(provider_name, latency, sent_count=1) -> None:
+        """
+        Registra en las métricas del proceso la llamada exitosa al proveedor.
+        """
+        metrics.observe("email_stage_seconds", latency, stage="provider_call", provider=provider_name)
+        metrics.increment("email_sends_total", sent_count, provider=provider_name, outcome="success")
+
+    def update_provider_metrics(self, provider_name:str, latency:float, sent_count:int = 1) -> None:
         """
-        Actualiza las métricas del proveedor en Redis.
+        Actualiza las métricas del proveedor en Redis en un solo viaje.
         """
-        RedisHandler.cache_latency(provider_name, latency, LATENCY_KEY, LATENCY_HISTORY_SIZE)
-        RedisHandler.increment_email_count(provider_name, EMAIL_COUNT_KEY)
-        self.log_provider_latencies()
+        healthy = latency <= LATENCY_THRESHOLD
+        other_providers = [name for name, _ in self.providers if name != provider_name]
+        try:
+            with metrics.timer("email_stage_seconds", stage="metrics_write"):
+                outcome = RedisHandler.record_send_outcome(
+                    provider_name, latency, healthy, other_providers,
+                    LATENCY_KEY, LATENCY_HISTORY_SIZE, EMAIL_COUNT_KEY, HEALTH_CHECK_KEY, USE_TRACKER_KEY,
+                    sent_count=sent_count
+                )
+        except redis.RedisError as e:
+            logger.debug("No se pudieron registrar las métricas de %s en Redis: %s", provider_name, e)
+            outcome = None
+        self.apply_send_outcome(provider_name, latency, healthy, sent_count, outcome)
 
-        if latency > LATENCY_THRESHOLD:
-            logger.warning(f"Latencia de {provider_name} excedió el umbral de {LATENCY_THRESHOLD} segundos.")
-            RedisHandler.mark_provider_unhealthy(provider_name, HEALTH_CHECK_KEY)
-            logger.info(f"{provider_name} marcado como no saludable debido a alta latencia.")
+    async def update_provider_metrics_async(self, provider_name:str, latency:float, sent_count:int = 1) -> None:
+        """
+        Versión asíncrona de update_provider_metrics.
+        """
+        healthy = latency <= LATENCY_THRESHOLD
+        other_providers = [name for name, _ in self.providers if name != provider_name]
+        try:
+            with metrics.timer("email_stage_seconds", stage="metrics_write"):
+                outcome = await RedisHandler.record_send_outcome_async(
+                    provider_name, latency, healthy, other_providers,
+                    LATENCY_KEY, LATENCY_HISTORY_SIZE, EMAIL_COUNT_KEY, HEALTH_CHECK_KEY, USE_TRACKER_KEY,
+                    sent_count=sent_count
+                )
+        except redis.RedisError as e:
+            logger.debug("No se pudieron registrar las métricas de %s en Redis: %s", provider_name, e)
+            outcome = None
+        self.apply_send_outcome(provider_name, latency, healthy, sent_count, outcome)
+
+    def apply_send_outcome(self, provider_name, latency, healthy, sent_count, outcome) -> None:
+        """
+        Aplica al estado de enrutamiento el resultado registrado en Redis: (uso consecutivo,
+        estadísticas de latencia), o None si no se pudo registrar.
+        """
+        if outcome is None:
+            # La escritura quedó pendiente en RedisHandler; mientras tanto se estima en el proceso
+            usage, latency_stats = self.routing_state.record_local_outcome(
+                provider_name, healthy, latency, sent_count,
+                ewma_alpha(LATENCY_HISTORY_SIZE), LATENCY_QUANTILE_STEP, HEALTH_BACKOFF_BASE
+            )
+        else:
+            usage, latency_stats = outcome
+            self.routing_state.record_send_outcome(provider_name, healthy, usage, latency_stats)
+
+        if not healthy:
+            logger.warning("Latencia de %s (%.3f s) excedió el umbral de %s segundos; marcado como no saludable.",
+                           provider_name, latency, LATENCY_THRESHOLD)
         else:
-            RedisHandler.mark_provider_healthy(provider_name, HEALTH_CHECK_KEY)
-            logger.info(f"{provider_name} marcado como saludable.")
+            logger.debug("Métricas de %s registradas en Redis (uso consecutivo %d).", provider_name, usage)
+
+    def record_timeout(self, provider_name, latency) -> None:
+        """
+        Registra el tiempo esperado por un intento que venció como una muestra de latencia del
+        proveedor y lo marca como no saludable con backoff. El uso consecutivo no cambia, ya
+        que no se envió ningún correo.
+        """
+        metrics.increment("email_sends_total", provider=provider_name, outcome="timeout")
+        try:
+            RedisHandler.cache_latency(provider_name, latency, LATENCY_KEY, LATENCY_HISTORY_SIZE)
+        except redis.RedisError as e:
+            # La escritura quedó pendiente en RedisHandler
+            logger.debug("No se pudo registrar la latencia de %s en Redis: %s", provider_name, e)
+        self.mark_unhealthy(provider_name)
+
+    async def record_timeout_async(self, provider_name, latency) -> None:
+        """
+        Versión asíncrona de record_timeout.
+        """
+        metrics.increment("email_sends_total", provider=provider_name, outcome="timeout")
+        try:
+            await RedisHandler.cache_latency_async(provider_name, latency, LATENCY_KEY, LATENCY_HISTORY_SIZE)
+        except redis.RedisError as e:
+            logger.debug("No se pudo registrar la latencia de %s en Redis: %s", provider_name, e)
+        await self.mark_unhealthy_async(provider_name)
+
+    def handle_timeout(self, provider_name, exception) -> None:
+        """
+        Maneja el timeout de un intento: la latencia y la marca de no saludable ya se registraron,
+        así que sólo cambia de proveedor.
+        """
+        logger.warning("%s no respondió a tiempo: %s. Cambiando de proveedor.", provider_name, exception)
 
-        RedisHandler.track_provider_usage(provider_name, USE_TRACKER_KEY)
-        logger.info(f"Uso del proveedor {provider_name} registrado en Redis.")
+    def handle_throttling(self, provider_name, exception) -> None:
+        """
+        Maneja el throttling del proveedor: no lo marca como no saludable, sólo deja de
+        enrutarle envíos hasta que el estado de enrutamiento se recargue.
+        """
+        logger.warning("%s sin cuota de envío: %s. Cambiando de proveedor.", provider_name, exception)
+        metrics.increment("email_sends_total", provider=provider_name, outcome="throttled")
+        self.routing_state.record_tokens(provider_name, 0)
 
     def handle_circuit_breaker_error(self, provider_name) -> None:
         """
         Maneja el error del circuito breaker.
         """
-        logger.warning(f"Circuito abierto para {provider_name}. Cambiando a otro proveedor.")
-        RedisHandler.mark_provider_unhealthy(provider_name, self.HEALTH_CHECK_KEY)
+        logger.warning("Circuito abierto para %s. Cambiando a otro proveedor.", provider_name)
+        metrics.increment("email_sends_total", provider=provider_name, outcome="circuit_open")
+        self.mark_unhealthy(provider_name)
+
+    async def handle_circuit_breaker_error_async(self, provider_name) -> None:
+        """
+        Versión asíncrona de handle_circuit_breaker_error.
+        """
+        logger.warning("Circuito abierto para %s. Cambiando a otro proveedor.", provider_name)
+        metrics.increment("email_sends_total", provider=provider_name, outcome="circuit_open")
+        await self.mark_unhealthy_async(provider_name)
 
     def handle_general_exception(self, provider_name, exception) -> None:
         """
         Maneja excepciones generales durante el envío del correo.
         """
-        logger.error(f"Error al enviar con {provider_name}: {exception}")
-        RedisHandler.mark_provider_unhealthy(provider_name, HEALTH_CHECK_KEY)
+        logger.error("Error al enviar con %s: %s", provider_name, exception)
+        metrics.increment("email_sends_total", provider=provider_name, outcome="error")
+        self.mark_unhealthy(provider_name)
 
-    def get_usage_count(self, provider_name) -> int:
+    async def handle_general_exception_async(self, provider_name, exception) -> None:
         """
-        Obtiene el conteo de uso del proveedor desde Redis.
+        Versión asíncrona de handle_general_exception.
         """
-        return int(RedisHandler.get_usage_count(provider_name, USE_TRACKER_KEY) or 0)
+        logger.error("Error al enviar con %s: %s", provider_name, exception)
+        metrics.increment("email_sends_total", provider=provider_name, outcome="error")
+        await self.mark_unhealthy_async(provider_name)
 
-    def should_switch_provider(self, usage_count, other_provider_name) -> bool:
+    def mark_unhealthy(self, provider_name) -> None:
         """
-        Determina si se debe cambiar de proveedor basado en el uso y la salud del otro proveedor.
+        Excluye al proveedor del enrutamiento hasta que venza su backoff y un sondeo lo confirme.
         """
-        if usage_count >= MAX_CONSECUTIVE_USE:
-            if RedisHandler.is_provider_healthy(other_provider_name, HEALTH_CHECK_KEY):
-                logger.info(f"{other_provider_name} ha alcanzado el límite de uso consecutivo. Cambiando a {other_provider_name}.")
-                return True
-        return False
+        try:
+            backoff = RedisHandler.mark_provider_unhealthy(provider_name, HEALTH_CHECK_KEY)
+        except redis.RedisError:
+            # Sin Redis, la marca sólo vale en este proceso con el backoff inicial
+            backoff = HEALTH_BACKOFF_BASE
+        self.apply_unhealthy(provider_name, backoff)
 
-    def choose_provider_with_lower_latency(self) -> str:
+    async def mark_unhealthy_async(self, provider_name) -> None:
         """
-        Elige el proveedor con la menor latencia.
+        Versión asíncrona de mark_unhealthy.
         """
-        sendgrid_latency = RedisHandler.get_predicted_latency("SendGrid", LATENCY_KEY)
-        ses_latency = RedisHandler.get_predicted_latency("Amazon SES", LATENCY_KEY)
-        
-        logger.info(f"Latencia SendGrid: {sendgrid_latency:.2f} segundos, Latencia Amazon SES: {ses_latency:.2f} segundos")
+        try:
+            backoff = await RedisHandler.mark_provider_unhealthy_async(provider_name, HEALTH_CHECK_KEY)
+        except redis.RedisError:
+            backoff = HEALTH_BACKOFF_BASE
+        self.apply_unhealthy(provider_name, backoff)
+
+    def apply_unhealthy(self, provider_name, backoff: float) -> None:
+        self.routing_state.mark_unhealthy(provider_name, backoff)
+        logger.warning("%s excluido del enrutamiento durante %.0f segundos.", provider_name, backoff)
 
-        return self.providers[0] if sendgrid_latency <= ses_latency else self.providers[1]
\ No newline at end of file
+    def get_usage_count(self, provider_name) -> int:
+        """
+        Obtiene el conteo de uso del proveedor según el estado de enrutamiento.
+        """
+        return self.routing_state.get()[provider_name]["usage"]
+
+    def choose_provider_with_lower_latency(self) -> tuple:
+        """
+        Elige el proveedor con la menor latencia en el percentil configurado (ROUTING_LATENCY_PERCENTILE).
+        """
+        routing_state = self.routing_state.get()
+        if logger.isEnabledFor(logging.DEBUG):
+            for provider_name, _ in self.providers:
+                logger.debug("Latencia %s de %s: %.2f segundos", ROUTING_LATENCY_PERCENTILE, provider_name,
+                             routing_state[provider_name]['latency'][ROUTING_LATENCY_PERCENTILE])
+
+        return LeastLatencyStrategy().choose(self.providers, routing_state, self.provider_weights, self.outstanding)
+
+    @contextmanager
+    def track_outstanding(self, provider_name):
+        """
+        Cuenta el envío como en curso mientras dura la llamada al proveedor.
+        """
+        with self._outstanding_lock:
+            self.outstanding[provider_name] += 1
+        try:
+            yield
+        finally:
+            with self._outstanding_lock:
+                self.outstanding[provider_name] -= 1
@@ -0,0 +1,60 @@
+class ProviderRegistry:
+    """
+    Registro ordenado de los proveedores de correo, su peso de enrutamiento y su cuota de envío.
+
+    El orden de registro es el orden de preferencia en los empates; el peso indica la
+    capacidad relativa del proveedor para las estrategias ponderadas.
+    """
+
+    def __init__(self) -> None:
+        self._providers = []
+        self._weights = {}
+        self._rate_limits = {}
+
+    def register(self, name: str, service, weight: float = 1, rate: float = None, burst: float = None) -> None:
+        if name in self._weights:
+            raise ValueError(f"El proveedor {name} ya está registrado.")
+        if weight <= 0:
+            raise ValueError(f"El peso del proveedor {name} debe ser positivo.")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"La tasa de envío del proveedor {name} debe ser positiva.")
+        self._providers.append((name, service))
+        self._weights[name] = weight
+        if rate is not None:
+            # Sin burst explícito se permite un segundo de envíos a la tasa configurada
+            self._rate_limits[name] = (rate, burst or rate)
+
+    @property
+    def providers(self) -> list:
+        return list(self._providers)
+
+    @property
+    def weights(self) -> dict:
+        return dict(self._weights)
+
+    @property
+    def rate_limits(self) -> dict:
+        """
+        {proveedor: (tasa en envíos/s, burst)} de los proveedores con cuota configurada.
+        """
+        return dict(self._rate_limits)
+
+
+def build_provider_registry(provider_configs: list, factories: dict) -> ProviderRegistry:
+    """
+    Construye el registro a partir de la configuración: cada entrada tiene name, type,
+    weight, rate y burst opcionales, y el resto de claves se pasa al constructor del tipo
+    de proveedor.
+    """
+    registry = ProviderRegistry()
+    for provider_config in provider_configs:
+        options = dict(provider_config)
+        name = options.pop("name")
+        provider_type = options.pop("type")
+        weight = options.pop("weight", 1)
+        rate = options.pop("rate", None)
+        burst = options.pop("burst", None)
+        if provider_type not in factories:
+            raise ValueError(f"Tipo de proveedor desconocido: {provider_type}")
+        registry.register(name, factories[provider_type](**options), weight, rate, burst)
+    return registry
@@ -0,0 +1,135 @@
+import logging
+import random
+import threading
+from abc import ABC, abstractmethod
+from ..core.config import MAX_CONSECUTIVE_USE, ROUTING_LATENCY_PERCENTILE
+
+logger = logging.getLogger(__name__)
+
+
+def predicted_latency(routing_state: dict, provider_name: str) -> float:
+    """
+    Latencia estimada del proveedor en el percentil configurado (inf si no hay muestras).
+    """
+    return routing_state[provider_name]["latency"][ROUTING_LATENCY_PERCENTILE]
+
+
+class RoutingStrategy(ABC):
+    """
+    Estrategia de enrutamiento: elige un proveedor entre los candidatos (name, service).
+
+    Recibe el snapshot de enrutamiento, el peso configurado de cada proveedor y los
+    envíos en curso por proveedor en este proceso.
+    """
+
+    @abstractmethod
+    def choose(self, candidates: list, routing_state: dict, weights: dict, outstanding: dict) -> tuple:
+        """
+        Devuelve el proveedor (name, service) elegido entre candidates.
+        """
+
+
+class LeastLatencyStrategy(RoutingStrategy):
+    """
+    Menor latencia estimada, dividida por el peso del proveedor.
+    """
+
+    def choose(self, candidates, routing_state, weights, outstanding):
+        return min(candidates, key=lambda provider: predicted_latency(routing_state, provider[0]) / weights[provider[0]])
+
+
+class ConsecutiveUseStrategy(LeastLatencyStrategy):
+    """
+    Comportamiento original: menor latencia, pero si un proveedor alcanzó MAX_CONSECUTIVE_USE
+    envíos seguidos se cambia al mejor de los demás.
+    """
+
+    def __init__(self, max_consecutive_use: int = MAX_CONSECUTIVE_USE) -> None:
+        self.max_consecutive_use = max_consecutive_use
+
+    def choose(self, candidates, routing_state, weights, outstanding):
+        for provider_name, _ in candidates:
+            if routing_state[provider_name]["usage"] >= self.max_consecutive_use:
+                others = [provider for provider in candidates if provider[0] != provider_name]
+                if others:
+                    logger.debug("%s ha alcanzado el límite de uso consecutivo. Cambiando de proveedor.", provider_name)
+                    return super().choose(others, routing_state, weights, outstanding)
+        return super().choose(candidates, routing_state, weights, outstanding)
+
+
+class WeightedRoundRobinStrategy(RoutingStrategy):
+    """
+    Round robin ponderado suave: reparte los envíos en proporción al peso sin ráfagas.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._current_weights = {}
+
+    def choose(self, candidates, routing_state, weights, outstanding):
+        with self._lock:
+            total_weight = sum(weights[provider_name] for provider_name, _ in candidates)
+            for provider_name, _ in candidates:
+                self._current_weights[provider_name] = self._current_weights.get(provider_name, 0) + weights[provider_name]
+            chosen = max(candidates, key=lambda provider: self._current_weights[provider[0]])
+            self._current_weights[chosen[0]] -= total_weight
+            return chosen
+
+
+class LeastOutstandingStrategy(RoutingStrategy):
+    """
+    Menos envíos en curso por unidad de peso; desempata por latencia estimada.
+    """
+
+    def choose(self, candidates, routing_state, weights, outstanding):
+        return min(
+            candidates,
+            key=lambda provider: (
+                (outstanding.get(provider[0], 0) + 1) / weights[provider[0]],
+                predicted_latency(routing_state, provider[0])
+            )
+        )
+
+
+class PowerOfTwoChoicesStrategy(RoutingStrategy):
+    """
+    Toma dos candidatos al azar (según su peso) y se queda con el de menor latencia esperada,
+    estimada como latencia predicha por (envíos en curso + 1). Los proveedores sin muestras
+    se consideran de latencia cero para que reciban tráfico y se midan.
+    """
+
+    def __init__(self, rng: random.Random = None) -> None:
+        self._rng = rng or random.Random()
+
+    def choose(self, candidates, routing_state, weights, outstanding):
+        if len(candidates) > 2:
+            first = self._rng.choices(candidates, weights=[weights[name] for name, _ in candidates])[0]
+            rest = [provider for provider in candidates if provider is not first]
+            second = self._rng.choices(rest, weights=[weights[name] for name, _ in rest])[0]
+            candidates = [first, second]
+
+        def expected_latency(provider):
+            latency = predicted_latency(routing_state, provider[0])
+            if latency == float('inf'):
+                latency = 0.0
+            return latency * (outstanding.get(provider[0], 0) + 1)
+
+        return min(candidates, key=expected_latency)
+
+
+ROUTING_STRATEGIES = {
+    "consecutive_use": ConsecutiveUseStrategy,
+    "least_latency": LeastLatencyStrategy,
+    "weighted_round_robin": WeightedRoundRobinStrategy,
+    "least_outstanding": LeastOutstandingStrategy,
+    "power_of_two_choices": PowerOfTwoChoicesStrategy,
+}
+
+
+def get_routing_strategy(name: str) -> RoutingStrategy:
+    """
+    Crea la estrategia de enrutamiento configurada por nombre.
+    """
+    if name not in ROUTING_STRATEGIES:
+        raise ValueError(f"Estrategia de enrutamiento desconocida: {name}")
+    return ROUTING_STRATEGIES[name]()
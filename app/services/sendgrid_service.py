@@ -1,18 +1,39 @@
+import httpx
 import os
 import sendgrid
+from functools import cached_property
+from urllib.error import URLError
+from python_http_client.exceptions import TooManyRequestsError
 from sendgrid.helpers.mail import Mail
 from typing import Optional
-from ..core.config import SENDGRID_API_KEY, SES_EMAIL_FROM
+from ..core.config import SENDGRID_API_KEY, SES_EMAIL_FROM, SENDGRID_API_HOST, PROVIDER_READ_TIMEOUT
+from ..core.exceptions import ProviderThrottledError, ProviderTimeoutError
+from .async_http import AsyncClientPool, http_timeout
 
 class SendGridService:
+    # Máximo de personalizations que SendGrid acepta en una sola solicitud
+    max_bulk_recipients = 1000
+
     def __init__(self) -> None:
         # Cargamos la API Key de SendGrid desde las variables de entorno
         self.api_key = os.getenv("SENDGRID_API_KEY", SENDGRID_API_KEY)
         if not self.api_key:
             raise ValueError("La clave de API de SendGrid no está configurada.")
-        self.client = sendgrid.SendGridAPIClient(self.api_key)
+        self.api_host = os.getenv("SENDGRID_API_HOST", SENDGRID_API_HOST)
+        # Cliente HTTP asíncrono con conexiones keep-alive para send_email_async
+        self.async_clients = AsyncClientPool(
+            base_url=self.api_host,
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+
+    @cached_property
+    def client(self) -> sendgrid.SendGridAPIClient:
+        """
+        Cliente de SendGrid, creado en el primer envío y reutilizado después.
+        """
+        return sendgrid.SendGridAPIClient(self.api_key, host=self.api_host)
 
-    def send_email(self, to: str, subject: str, body: str, from_email: Optional[str] = None) -> any:
+    def send_email(self, to: str, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> any:
         """
         Envía un correo electrónico utilizando el servicio de SendGrid.
         """
@@ -28,10 +49,113 @@ class SendGridService:
         )
         
         # Enviar el mensaje a través de SendGrid
-        response = self.client.send(message)
+        response = self.send_message(message, timeout)
 
         # Validar que el correo se haya enviado exitosamente
         if response.status_code != 202:
             raise Exception(f"SendGrid falló con el estado: {response.status_code}")
         
         return response
+
+    async def send_email_async(self, to: str, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> any:
+        """
+        Envía un correo electrónico con SendGrid sin bloquear el event loop.
+        """
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+
+        message = Mail(
+            from_email=from_email,
+            to_emails=to,
+            subject=subject,
+            html_content=body
+        )
+
+        response = await self.post_async(message, timeout)
+
+        if response.status_code == 429:
+            raise ProviderThrottledError("SendGrid rechazó el envío por límite de tasa (429).")
+        if response.status_code != 202:
+            raise Exception(f"SendGrid falló con el estado: {response.status_code}")
+
+        return response
+
+    def send_template_email(self, to: str, template_id: str, template_vars: dict, from_email: Optional[str] = None, timeout: Optional[float] = None) -> any:
+        """
+        Envía un correo con una plantilla dinámica de SendGrid, que la renderiza con template_vars.
+        """
+        response = self.send_message(self.template_message(to, template_id, template_vars, from_email), timeout)
+        if response.status_code != 202:
+            raise Exception(f"SendGrid falló con el estado: {response.status_code}")
+        return response
+
+    async def send_template_email_async(self, to: str, template_id: str, template_vars: dict, from_email: Optional[str] = None, timeout: Optional[float] = None) -> any:
+        """
+        Envía un correo con una plantilla dinámica de SendGrid sin bloquear el event loop.
+        """
+        message = self.template_message(to, template_id, template_vars, from_email)
+        response = await self.post_async(message, timeout)
+
+        if response.status_code == 429:
+            raise ProviderThrottledError("SendGrid rechazó el envío por límite de tasa (429).")
+        if response.status_code != 202:
+            raise Exception(f"SendGrid falló con el estado: {response.status_code}")
+
+        return response
+
+    @staticmethod
+    def template_message(to: str, template_id: str, template_vars: dict, from_email: Optional[str] = None) -> Mail:
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+        message = Mail(from_email=from_email, to_emails=to)
+        message.template_id = template_id
+        message.dynamic_template_data = template_vars
+        return message
+
+    def send_bulk_email(self, recipients: list, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> list:
+        """
+        Envía el mismo correo a varios destinatarios en una sola solicitud, con una
+        personalization por destinatario para que no se vean entre sí.
+        Devuelve un resultado por destinatario (None si fue aceptado).
+        """
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+
+        message = Mail(
+            from_email=from_email,
+            to_emails=recipients,
+            subject=subject,
+            html_content=body,
+            is_multiple=True
+        )
+
+        response = self.send_message(message, timeout)
+
+        # SendGrid acepta o rechaza la solicitud completa
+        if response.status_code != 202:
+            raise Exception(f"SendGrid falló con el estado: {response.status_code}")
+
+        return [None] * len(recipients)
+
+    def send_message(self, message: Mail, timeout: Optional[float] = None) -> any:
+        """
+        Envía el mensaje con un timeout de timeout segundos (PROVIDER_READ_TIMEOUT si es None),
+        distinguiendo el límite de tasa (429) y el timeout de los demás errores.
+        """
+        try:
+            return self.client.client.mail.send.post(request_body=message.get(), timeout=timeout or PROVIDER_READ_TIMEOUT)
+        except TooManyRequestsError as e:
+            raise ProviderThrottledError(f"SendGrid rechazó el envío por límite de tasa: {e}")
+        except (TimeoutError, URLError) as e:
+            if isinstance(e, TimeoutError) or isinstance(e.reason, TimeoutError):
+                raise ProviderTimeoutError(f"SendGrid no respondió en {timeout or PROVIDER_READ_TIMEOUT} segundos.")
+            raise
+
+    async def post_async(self, message: Mail, timeout: Optional[float] = None) -> httpx.Response:
+        """
+        Envía el mensaje con el cliente asíncrono y el timeout del intento.
+        """
+        try:
+            return await self.async_clients.get().post("/v3/mail/send", json=message.get(), timeout=http_timeout(timeout))
+        except httpx.TimeoutException:
+            raise ProviderTimeoutError(f"SendGrid no respondió en {timeout or PROVIDER_READ_TIMEOUT} segundos.")
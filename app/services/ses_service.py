@@ -1,20 +1,102 @@
 import boto3
+import hashlib
+import httpx
+import json
+import logging
+import math
 import os
-from botocore.exceptions import BotoCoreError, ClientError
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, ConnectTimeoutError, ReadTimeoutError
 from typing import Optional
-from ..core.config import AWS_REGION, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, SES_EMAIL_FROM
+from ..core.config import AWS_REGION, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, SES_EMAIL_FROM, PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT, SES_BULK_TEMPLATE_CACHE_SIZE
+from ..core.deadline import Deadline
+from ..core.exceptions import ProviderThrottledError, ProviderTimeoutError, DeadlineExceededError
+from .async_http import AsyncClientPool, http_timeout
+
+logger = logging.getLogger(__name__)
+
+# Códigos de error con los que SES indica que se superó la tasa de envío
+SES_THROTTLING_CODES = {"Throttling", "ThrottlingException", "TooManyRequestsException"}
+
+
+def ses_error(e: Exception) -> Exception:
+    """
+    Traduce un error de boto3 a ProviderTimeoutError si es un timeout, a ProviderThrottledError
+    si es throttling, o a RuntimeError.
+    """
+    if isinstance(e, (ConnectTimeoutError, ReadTimeoutError)):
+        return ProviderTimeoutError(f"Amazon SES no respondió a tiempo: {e}")
+    if isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in SES_THROTTLING_CODES:
+        return ProviderThrottledError(f"Amazon SES rechazó el envío por límite de tasa: {e}")
+    return RuntimeError(f"Error al enviar correo con SES: {e}")
 
 class SESService:
-    def __init__(self) -> None:
-        # Inicializar el cliente de SES con las credenciales de AWS
-        self.client = boto3.client(
-            'ses',
-            region_name=os.getenv("AWS_REGION", AWS_REGION),
+    # Máximo de destinos por llamada a SendBulkTemplatedEmail
+    max_bulk_recipients = 50
+
+    def __init__(self, region: Optional[str] = None, bulk_template_cache_size: int = SES_BULK_TEMPLATE_CACHE_SIZE) -> None:
+        # La sesión y el cliente de SES se crean en el primer uso (region permite registrar varias regiones)
+        self.region = region or os.getenv("AWS_REGION", AWS_REGION)
+        self.v2_endpoint = f"https://email.{self.region}.amazonaws.com/v2/email/outbound-emails"
+        self.async_clients = AsyncClientPool()
+        # Plantillas de SES creadas por este contenedor, de la usada hace más tiempo a la más reciente
+        self.bulk_templates = OrderedDict()
+        self.bulk_template_cache_size = bulk_template_cache_size
+        self._bulk_templates_lock = threading.Lock()
+        # Clientes de SES por timeout de lectura en segundos enteros
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    @cached_property
+    def session(self) -> boto3.Session:
+        return boto3.Session(
+            region_name=self.region,
             aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID", AWS_ACCESS_KEY_ID),
             aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY", AWS_SECRET_ACCESS_KEY)
         )
 
-    def send_email(self, to: str, subject: str, body: str, from_email: Optional[str] = None) -> dict:
+    @property
+    def client(self):
+        """
+        Cliente de SES con las credenciales de AWS y el timeout por defecto.
+        """
+        return self.client_for()
+
+    def client_for(self, timeout: Optional[float] = None):
+        """
+        Cliente de SES con un read timeout de timeout segundos redondeado hacia arriba (como
+        máximo PROVIDER_READ_TIMEOUT), creado en el primer envío con ese timeout y reutilizado
+        después. Sin reintentos internos de botocore: el fallback entre proveedores los reemplaza
+        y no se pasarían del timeout del intento.
+        """
+        seconds = max(math.ceil(min(timeout or PROVIDER_READ_TIMEOUT, PROVIDER_READ_TIMEOUT)), 1)
+        client = self._clients.get(seconds)
+        if client is None:
+            # Crear clientes de una misma sesión boto3 no es seguro entre hilos
+            with self._clients_lock:
+                client = self._clients.get(seconds)
+                if client is None:
+                    client = self.session.client('ses', config=Config(
+                        connect_timeout=min(PROVIDER_CONNECT_TIMEOUT, seconds),
+                        read_timeout=seconds,
+                        retries={"total_max_attempts": 1}
+                    ))
+                    self._clients[seconds] = client
+        return client
+
+    @cached_property
+    def credentials(self):
+        """
+        Credenciales para firmar (SigV4) las llamadas asíncronas a la API v2 de SES.
+        """
+        return self.session.get_credentials()
+
+    def send_email(self, to: str, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> dict:
         """
         Envía un correo electrónico utilizando Amazon SES.
         """
@@ -23,7 +105,7 @@ class SESService:
 
         try:
             # Enviar el correo utilizando SES
-            response = self.client.send_email(
+            response = self.client_for(timeout).send_email(
                 Source=from_email,
                 Destination={
                     'ToAddresses': [to]
@@ -47,4 +129,198 @@ class SESService:
             return response
 
         except (BotoCoreError, ClientError) as e:
+            raise ses_error(e)
+
+    async def send_email_async(self, to: str, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        """
+        Envía un correo electrónico con la API v2 de Amazon SES sin bloquear el event loop.
+        """
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+
+        return await self.post_v2({
+            'FromEmailAddress': from_email,
+            'Destination': {'ToAddresses': [to]},
+            'Content': {
+                'Simple': {
+                    'Subject': {'Data': subject},
+                    'Body': {'Html': {'Data': body}}
+                }
+            }
+        }, timeout)
+
+    def send_template_email(self, to: str, template_id: str, template_vars: dict, from_email: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        """
+        Envía un correo con una plantilla de SES, que la renderiza con template_vars.
+        """
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+
+        try:
+            response = self.client_for(timeout).send_templated_email(
+                Source=from_email,
+                Destination={'ToAddresses': [to]},
+                Template=template_id,
+                TemplateData=json.dumps(template_vars, default=str)
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise ses_error(e)
+
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise RuntimeError(f"Amazon SES falló con el estado: {response['ResponseMetadata']['HTTPStatusCode']}")
+        return response
+
+    async def send_template_email_async(self, to: str, template_id: str, template_vars: dict, from_email: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        """
+        Envía un correo con una plantilla de SES por la API v2 sin bloquear el event loop.
+        """
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+
+        return await self.post_v2({
+            'FromEmailAddress': from_email,
+            'Destination': {'ToAddresses': [to]},
+            'Content': {
+                'Template': {
+                    'TemplateName': template_id,
+                    'TemplateData': json.dumps(template_vars, default=str)
+                }
+            }
+        }, timeout)
+
+    async def post_v2(self, content: dict, timeout: Optional[float] = None) -> dict:
+        """
+        Envía un correo con la API v2 de SES, firmando la solicitud.
+        """
+        payload = json.dumps(content)
+
+        # Firmar la solicitud con SigV4 igual que lo haría boto3
+        request = AWSRequest(method='POST', url=self.v2_endpoint, data=payload, headers={'Content-Type': 'application/json'})
+        SigV4Auth(self.credentials.get_frozen_credentials(), 'ses', self.region).add_auth(request)
+
+        try:
+            response = await self.async_clients.get().post(
+                self.v2_endpoint, content=payload, headers=dict(request.headers), timeout=http_timeout(timeout)
+            )
+        except httpx.TimeoutException:
+            raise ProviderTimeoutError(f"Amazon SES no respondió en {timeout or PROVIDER_READ_TIMEOUT} segundos.")
+        except httpx.HTTPError as e:
             raise RuntimeError(f"Error al enviar correo con SES: {e}")
+
+        if response.status_code == 429:
+            raise ProviderThrottledError("Amazon SES rechazó el envío por límite de tasa (429).")
+        if response.status_code != 200:
+            raise RuntimeError(f"Amazon SES falló con el estado: {response.status_code}")
+
+        return response.json()
+
+    def send_bulk_email(self, recipients: list, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> list:
+        """
+        Envía el mismo correo a varios destinatarios con SendBulkTemplatedEmail.
+        Devuelve un resultado por destinatario (None si fue aceptado o el error de SES).
+        """
+        if not from_email:
+            from_email = os.getenv("SES_EMAIL_FROM", SES_EMAIL_FROM)
+
+        # SES interpretaría las llaves {{ }} del contenido como variables de plantilla
+        if "{{" in subject or "{{" in body:
+            return self._send_each(recipients, subject, body, from_email, timeout)
+
+        try:
+            try:
+                response = self._send_bulk_templated(recipients, subject, body, from_email, timeout)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'TemplateDoesNotExist':
+                    raise
+                # Otro contenedor borró la plantilla al sacarla de su caché; se vuelve a crear
+                self.forget_bulk_template(subject, body)
+                response = self._send_bulk_templated(recipients, subject, body, from_email, timeout)
+        except (BotoCoreError, ClientError) as e:
+            raise ses_error(e)
+
+        results = []
+        for status in response['Status']:
+            code = status.get('Status', 'Success')
+            results.append(None if code == 'Success' else f"Amazon SES rechazó el destinatario: {code} {status.get('Error', '')}".strip())
+        return results
+
+    def _send_bulk_templated(self, recipients: list, subject: str, body: str, from_email: str, timeout: Optional[float] = None) -> dict:
+        return self.client_for(timeout).send_bulk_templated_email(
+            Source=from_email,
+            Template=self.ensure_bulk_template(subject, body),
+            DefaultTemplateData="{}",
+            Destinations=[
+                {'Destination': {'ToAddresses': [to]}, 'ReplacementTemplateData': "{}"}
+                for to in recipients
+            ]
+        )
+
+    @staticmethod
+    def bulk_template_name(subject: str, body: str) -> str:
+        digest = hashlib.sha256(json.dumps([subject, body]).encode("utf-8")).hexdigest()
+        return f"bulk-{digest[:32]}"
+
+    def ensure_bulk_template(self, subject: str, body: str) -> str:
+        """
+        Crea (una sola vez) una plantilla de SES direccionada por el contenido del correo.
+        Se conservan las bulk_template_cache_size usadas más recientemente; las demás se
+        borran de SES para no acumular una plantilla por cada contenido enviado.
+        """
+        template_name = self.bulk_template_name(subject, body)
+        with self._bulk_templates_lock:
+            if template_name in self.bulk_templates:
+                self.bulk_templates.move_to_end(template_name)
+                return template_name
+
+        try:
+            self.client.create_template(
+                Template={'TemplateName': template_name, 'SubjectPart': subject, 'HtmlPart': body}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'AlreadyExists':
+                raise
+
+        evicted = []
+        with self._bulk_templates_lock:
+            self.bulk_templates[template_name] = None
+            while len(self.bulk_templates) > self.bulk_template_cache_size:
+                evicted.append(self.bulk_templates.popitem(last=False)[0])
+        for evicted_name in evicted:
+            self.delete_bulk_template(evicted_name)
+        return template_name
+
+    def forget_bulk_template(self, subject: str, body: str) -> None:
+        with self._bulk_templates_lock:
+            self.bulk_templates.pop(self.bulk_template_name(subject, body), None)
+
+    def delete_bulk_template(self, template_name: str) -> None:
+        """
+        Borra de SES una plantilla masiva que salió de la caché; si falla sólo se registra.
+        """
+        try:
+            self.client.delete_template(TemplateName=template_name)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning("No se pudo borrar la plantilla %s de SES: %s", template_name, e)
+
+    def _send_each(self, recipients: list, subject: str, body: str, from_email: str, timeout: Optional[float] = None) -> list:
+        """
+        Envía el correo destinatario por destinatario repartiendo entre ellos el timeout del
+        intento; cuando se agota, los destinatarios restantes fallan sin llamar a SES.
+        """
+        deadline = Deadline.after(timeout or PROVIDER_READ_TIMEOUT)
+        results = []
+        for index, to in enumerate(recipients):
+            try:
+                attempt_timeout = deadline.attempt_timeout(len(recipients) - index)
+            except DeadlineExceededError as e:
+                return results + [str(e)] * (len(recipients) - index)
+            results.append(self._send_or_error(to, subject, body, from_email, attempt_timeout))
+        return results
+
+    def _send_or_error(self, to: str, subject: str, body: str, from_email: str, timeout: Optional[float] = None) -> Optional[str]:
+        # Un timeout o un rechazo de un destinatario no impide enviar a los demás
+        try:
+            self.send_email(to, subject, body, from_email, timeout)
+            return None
+        except (RuntimeError, ProviderTimeoutError) as e:
+            return str(e)
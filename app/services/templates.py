@@ -0,0 +1,128 @@
+import html
+import json
+import string
+import threading
+import time
+from collections import OrderedDict
+from ..core import RedisHandler
+from ..core.config import TEMPLATE_KEY, TEMPLATE_CACHE_SIZE, TEMPLATE_CACHE_TTL
+from ..core.exceptions import TemplateNotFoundError
+
+
+def compile_parts(text: str) -> list:
+    """
+    Separa un texto con la sintaxis de string.Template ($nombre o ${nombre}) en pares
+    (texto literal, variable que lo sigue o None).
+    """
+    parts, position = [], 0
+    for match in string.Template.pattern.finditer(text):
+        literal = text[position:match.start()]
+        position = match.end()
+        if match.group("escaped") is not None:
+            parts.append((literal + string.Template.delimiter, None))
+            continue
+        name = match.group("named") or match.group("braced")
+        if name is None:
+            raise ValueError(f"Variable de plantilla inválida en la posición {match.start()}.")
+        parts.append((literal, name))
+    parts.append((text[position:], None))
+    return parts
+
+
+def render_parts(parts: list, variables: dict, escape) -> str:
+    try:
+        return "".join(literal if name is None else literal + escape(str(variables[name])) for literal, name in parts)
+    except KeyError as e:
+        raise ValueError(f"Falta la variable de plantilla {e.args[0]}.")
+
+
+class CompiledTemplate:
+    """
+    Plantilla analizada una sola vez: renderizarla sólo une los fragmentos ya separados.
+    Los valores se escapan como HTML en el cuerpo, igual que en las plantillas de los proveedores.
+    """
+
+    def __init__(self, subject: str, body: str, provider_templates: dict = None) -> None:
+        self.subject_parts = compile_parts(subject)
+        self.body_parts = compile_parts(body)
+        # Plantilla nativa por proveedor, que el proveedor renderiza con las variables
+        self.provider_templates = provider_templates or {}
+
+    def render(self, variables: dict) -> tuple:
+        """
+        Devuelve (asunto, cuerpo) con las variables reemplazadas.
+        """
+        return render_parts(self.subject_parts, variables, str), render_parts(self.body_parts, variables, html.escape)
+
+
+class TemplateStore:
+    """
+    Plantillas registradas en Redis y compiladas en una caché LRU del proceso. Una plantilla
+    cacheada se vuelve a leer pasados ttl segundos para tomar sus actualizaciones.
+    """
+
+    def __init__(self, key: str = TEMPLATE_KEY, cache_size: int = TEMPLATE_CACHE_SIZE, ttl: float = TEMPLATE_CACHE_TTL) -> None:
+        self.key = key
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # template_id -> (plantilla compilada, vencimiento), de la menos a la más reciente
+        self._cache = OrderedDict()
+
+    def _remember(self, template_id: str, template: CompiledTemplate) -> None:
+        with self._lock:
+            self._cache[template_id] = (template, time.monotonic() + self.ttl)
+            self._cache.move_to_end(template_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def register(self, template_id: str, subject: str, body: str, provider_templates: dict = None) -> CompiledTemplate:
+        """
+        Valida y guarda una plantilla. Lanza ValueError si su sintaxis es inválida.
+        """
+        template = CompiledTemplate(subject, body, provider_templates)
+        RedisHandler.save_template(
+            template_id,
+            {"subject": subject, "body": body, "provider_templates": json.dumps(provider_templates or {})},
+            self.key
+        )
+        self._remember(template_id, template)
+        return template
+
+    def get(self, template_id: str) -> CompiledTemplate:
+        """
+        Devuelve la plantilla compilada, desde la caché o desde Redis.
+        Lanza TemplateNotFoundError si no está registrada.
+        """
+        template = self._cached(template_id)
+        if template is None:
+            template = self._compile(template_id, RedisHandler.get_template(template_id, self.key))
+        return template
+
+    async def get_async(self, template_id: str) -> CompiledTemplate:
+        """
+        Versión asíncrona de get: una plantilla fuera de la caché se lee con el cliente asíncrono.
+        """
+        template = self._cached(template_id)
+        if template is None:
+            template = self._compile(template_id, await RedisHandler.get_template_async(template_id, self.key))
+        return template
+
+    def _cached(self, template_id: str):
+        with self._lock:
+            cached = self._cache.get(template_id)
+            if cached is not None and cached[1] > time.monotonic():
+                self._cache.move_to_end(template_id)
+                return cached[0]
+        return None
+
+    def _compile(self, template_id: str, fields: dict) -> CompiledTemplate:
+        if not fields:
+            raise TemplateNotFoundError(f"La plantilla {template_id} no está registrada.")
+        template = CompiledTemplate(fields["subject"], fields["body"], json.loads(fields.get("provider_templates") or "{}"))
+        self._remember(template_id, template)
+        return template
+
+
+# Plantillas compartidas por la API (registro) y los envíos del proceso
+template_store = TemplateStore()
@@ -0,0 +1,96 @@
+import pybreaker
+import pytest
+from app.core.circuit_breaker import ConcurrentCircuitBreaker, RedisCircuitStorage
+
+
+class FakeRedis:
+    """
+    Redis mínimo en memoria con los comandos que usa RedisCircuitStorage.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.keys = {}
+
+    def hmget(self, key, *fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = str(value)
+
+    def hincrby(self, key, field, amount):
+        value = int(self.hashes.get(key, {}).get(field, 0)) + amount
+        self.hset(key, field, value)
+        return value
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    def delete(self, key):
+        self.keys.pop(key, None)
+
+
+def shared_breaker(redis_object, reset_timeout=60, state_ttl=0):
+    return ConcurrentCircuitBreaker(
+        fail_max=3,
+        reset_timeout=reset_timeout,
+        state_storage=RedisCircuitStorage("SendGrid", redis_object, state_ttl=state_ttl),
+        name="SendGrid"
+    )
+
+def failing_send():
+    raise Exception("Proveedor caído")
+
+# Los fallos de una instancia abren el breaker para las demás
+def test_open_state_is_shared_between_instances():
+    fake_redis = FakeRedis()
+    first, second = shared_breaker(fake_redis), shared_breaker(fake_redis)
+
+    for _ in range(3):
+        with pytest.raises(Exception):
+            first.call(failing_send)
+
+    calls = []
+    with pytest.raises(pybreaker.CircuitBreakerError):
+        second.call(calls.append, "enviado")
+    assert calls == []
+    assert second.current_state == pybreaker.STATE_OPEN
+
+# En half-open sólo una instancia prueba la recuperación; el resto sigue evitando al proveedor
+def test_half_open_probe_is_coordinated():
+    fake_redis = FakeRedis()
+    first, second = shared_breaker(fake_redis, reset_timeout=0), shared_breaker(fake_redis, reset_timeout=0)
+    for _ in range(3):
+        with pytest.raises(Exception):
+            first.call(failing_send)
+
+    def probe():
+        # Mientras la prueba está en curso, la otra instancia no llama al proveedor
+        with pytest.raises(pybreaker.CircuitBreakerError):
+            second.call(lambda: None)
+        return "ok"
+
+    assert first.call(probe) == "ok"
+    assert second.current_state == pybreaker.STATE_CLOSED
+    assert second.call(lambda: "enviado") == "enviado"
+
+# Cerrado y sin fallos, el estado se reutiliza sin un viaje a Redis por envío
+def test_closed_state_is_cached_between_calls():
+    fake_redis = FakeRedis()
+    reads = []
+    hmget = fake_redis.hmget
+    fake_redis.hmget = lambda key, *fields: reads.append(key) or hmget(key, *fields)
+    breaker = shared_breaker(fake_redis, state_ttl=60)
+
+    for _ in range(5):
+        assert breaker.call(lambda: "enviado") == "enviado"
+    assert len(reads) == 1
+
+    # Tras un fallo el estado se vuelve a leer en cada consulta
+    with pytest.raises(Exception):
+        breaker.call(failing_send)
+    breaker.call(lambda: "enviado")
+    assert len(reads) == 2
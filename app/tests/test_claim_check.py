@@ -0,0 +1,45 @@
+import json
+from unittest.mock import patch
+from app.core.claim_check import ClaimCheck, LocalBlobStore
+from app.models import EmailRequest
+from app.workers.sqs_worker import process_email_queue
+
+# Un cuerpo grande viaja como referencia y se guarda una sola vez, comprimido
+def test_large_body_is_offloaded_once_and_resolved_through_cache(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    claim_check = ClaimCheck(store, threshold=1024)
+    body = "<p>Novedades del mes</p>" * 500
+    emails = [EmailRequest(to=f"user{i}@example.com", subject="Boletín", body=body) for i in range(3)]
+
+    with patch.object(store, "put", wraps=store.put) as mock_put:
+        message_bodies = [claim_check.dump(email_data) for email_data in emails]
+
+    mock_put.assert_called_once()
+    assert len(list(tmp_path.iterdir())) == 1
+    assert all("body" not in json.loads(message_body) for message_body in message_bodies)
+    assert all(len(message_body) < 1024 for message_body in message_bodies)
+
+    with patch.object(store, "get", wraps=store.get) as mock_get:
+        loaded = [claim_check.load(message_body) for message_body in message_bodies]
+
+    mock_get.assert_called_once()
+    assert [data["body"] for data in loaded] == [body] * 3
+    assert loaded[1]["to"] == "user1@example.com"
+
+    # Un cuerpo pequeño se encola tal cual
+    small = EmailRequest(to="user@example.com", subject="Hola", body="Hola")
+    assert json.loads(claim_check.dump(small))["body"] == "Hola"
+
+# El worker resuelve la referencia antes de enviar
+@patch('app.services.email_service.EmailService.send_email')
+def test_worker_resolves_body_reference(mock_send_email, tmp_path):
+    claim_check = ClaimCheck(LocalBlobStore(str(tmp_path)), threshold=16)
+    body = "<h1>Un cuerpo más largo que el umbral</h1>"
+    message_body = claim_check.dump(EmailRequest(to="user@example.com", subject="Boletín", body=body))
+    mock_send_email.return_value = "SendGrid"
+
+    with patch('app.workers.sqs_worker.claim_check', claim_check):
+        response = process_email_queue({"Records": [{"body": message_body}]}, None)
+
+    assert response == {"batchItemFailures": []}
+    assert mock_send_email.call_args.args[0].body == body
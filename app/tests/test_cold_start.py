@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+# Presupuesto de importación de los puntos de entrada de Lambda, en milisegundos
+# (aprox. el doble de lo medido; IMPORT_TIME_BUDGET_FACTOR lo ajusta en máquinas lentas)
+IMPORT_TIME_BUDGET_MS = {
+    "app.workers.sqs_worker": 1000,
+    "app.api.email_routes": 1500,
+}
+
+# Importa el módulo en un proceso limpio y reporta el tiempo y los clientes ya creados
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=["*"])
+elapsed_ms = (time.perf_counter() - start) * 1000
+from app.core import redis_handler
+print(json.dumps({
+    "elapsed_ms": elapsed_ms,
+    "redis_client": redis_handler.redis_client is not None,
+    "email_service": getattr(module, "email_service", None) is not None,
+    "sqs_client": getattr(module, "sqs_client", None) is not None,
+}))
+"""
+
+@pytest.mark.parametrize("module", sorted(IMPORT_TIME_BUDGET_MS))
+def test_entry_point_import_is_lazy_and_within_budget(module):
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE, module],
+        cwd=Path(__file__).resolve().parents[2],
+        capture_output=True, text=True, check=True
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # Ningún cliente ni proveedor se crea al importar
+    assert not probe["redis_client"]
+    assert not probe["email_service"]
+    assert not probe["sqs_client"]
+
+    budget = IMPORT_TIME_BUDGET_MS[module] * float(os.getenv("IMPORT_TIME_BUDGET_FACTOR", "1"))
+    assert probe["elapsed_ms"] < budget, f"{module} tardó {probe['elapsed_ms']:.0f} ms en importar (presupuesto {budget:.0f} ms)"
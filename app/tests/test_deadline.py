@@ -0,0 +1,37 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from app.core.deadline import Deadline
+from app.core.exceptions import DeadlineExceededError
+from app.workers.sqs_worker import process_email_queue
+
+# El deadline del lote parte del tiempo restante de la invocación de Lambda
+def test_deadline_from_lambda_context_splits_budget_between_attempts():
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 10000
+
+    deadline = Deadline.from_lambda_context(context, margin=2)
+
+    assert deadline.remaining() == pytest.approx(8, abs=0.1)
+    assert deadline.attempt_timeout(2, max_timeout=10) == pytest.approx(4, abs=0.1)
+    # Cada intento tiene un tope aunque sobre tiempo
+    assert deadline.attempt_timeout(1, max_timeout=3) == 3
+    assert Deadline.from_lambda_context(None) is None
+    with pytest.raises(DeadlineExceededError):
+        Deadline.after(0.1).attempt_timeout()
+
+# En Lambda el presupuesto del lote es el más corto entre la invocación y SEND_DEADLINE_SECONDS
+@patch('app.workers.sqs_worker.process_records', return_value=[])
+def test_lambda_batch_deadline_is_capped_by_configured_send_deadline(mock_process_records):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 800 * 1000
+
+    with patch('app.workers.sqs_worker.SEND_DEADLINE_SECONDS', 5):
+        process_email_queue({"Records": []}, context)
+
+    deadline = mock_process_records.call_args.args[1]
+    assert deadline.remaining() == pytest.approx(5, abs=0.1)
+
+    # Si a la invocación le queda menos, manda la invocación
+    context.get_remaining_time_in_millis.return_value = 4000
+    process_email_queue({"Records": []}, context)
+    assert mock_process_records.call_args.args[1].remaining() == pytest.approx(2, abs=0.1)
@@ -1,11 +1,35 @@
+import asyncio
 import pytest
-from unittest.mock import patch
+import redis
+from unittest.mock import AsyncMock, patch
 from app.services.email_service import EmailService
 from app.models import EmailRequest
+from app.core.circuit_breaker import ConcurrentCircuitBreaker
+from app.core.config import HEALTH_CHECK_KEY
+from app.core.deadline import Deadline
+from app.core.exceptions import ProviderTimeoutError
+from app.services.routing_strategies import RoutingStrategy, WeightedRoundRobinStrategy
 
 @pytest.fixture
 def email_service():
-    return EmailService()
+    service = EmailService()
+    # Breakers propios para que los fallos simulados no afecten a otras pruebas
+    service.circuit_breakers = {
+        provider_name: ConcurrentCircuitBreaker(fail_max=3, reset_timeout=60)
+        for provider_name, _ in service.providers
+    }
+    # Sin cuota de envío para que las pruebas no dependan del token bucket
+    service.rate_limits = {}
+    return service
+
+def latency_stats(latency=0.2):
+    return {"n": 10, "ewma": latency, "p50": latency, "p95": latency, "p99": latency}
+
+def routing_snapshot(sendgrid_usage, ses_usage, latency=0.2, tokens=float('inf')):
+    return {
+        "SendGrid": {"usage": sendgrid_usage, "healthy": True, "latency": latency_stats(latency), "tokens": tokens},
+        "Amazon SES": {"usage": ses_usage, "healthy": True, "latency": latency_stats(latency), "tokens": tokens},
+    }
 
 # Ajuste 1: Mock de Redis, SendGrid y SES correctamente
 @patch('app.services.email_service.RedisHandler')
@@ -20,8 +44,8 @@ def test_send_email_with_sendgrid(mock_ses_send_email, mock_sendgrid_send_email,
     )
 
     # Simulamos que SendGrid es el proveedor seleccionado
-    mock_redis.get_usage_count.return_value = 0
-    mock_redis.get_predicted_latency.return_value = 0.2
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=0, ses_usage=0)
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
     
     provider_used = email_service.send_email(email_data)
 
@@ -42,11 +66,324 @@ def test_send_email_with_ses(mock_ses_send_email, mock_sendgrid_send_email, mock
     )
 
     # Simulamos que SendGrid fue utilizado 2 veces y que SES debe ser seleccionado
-    mock_redis.get_usage_count.side_effect = [2, 0]  # Primer proveedor (SendGrid) se usa 2 veces
-    mock_redis.get_predicted_latency.return_value = 0.2
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=2, ses_usage=0)
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
     
     provider_used = email_service.send_email(email_data)
 
     # Validamos que SES fue utilizado
     assert provider_used == "Amazon SES"
     mock_ses_send_email.assert_called_once()  # Aseguramos que el método send_email fue llamado en SES
+
+# Las métricas de un envío exitoso se registran en un solo viaje a Redis
+@patch('app.services.email_service.RedisHandler')
+def test_update_provider_metrics_single_round_trip(mock_redis, email_service):
+    mock_redis.record_send_outcome.return_value = (1, latency_stats(0.1))
+    email_service.update_provider_metrics("SendGrid", 0.1)
+
+    mock_redis.record_send_outcome.assert_called_once()
+    args = mock_redis.record_send_outcome.call_args.args
+    assert args[:4] == ("SendGrid", 0.1, True, ["Amazon SES"])
+    mock_redis.cache_latency.assert_not_called()
+    mock_redis.track_provider_usage.assert_not_called()
+    mock_redis.get_predicted_latency.assert_not_called()
+
+# El enrutamiento por latencia usa el percentil de cola y no la mediana
+@patch('app.services.email_service.RedisHandler')
+def test_choose_provider_with_lower_tail_latency(mock_redis, email_service):
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0)
+    snapshot["SendGrid"]["latency"] = {"n": 10, "ewma": 0.2, "p50": 0.1, "p95": 1.5, "p99": 3.0}
+    snapshot["Amazon SES"]["latency"] = {"n": 10, "ewma": 0.3, "p50": 0.3, "p95": 0.4, "p99": 0.5}
+    mock_redis.get_routing_snapshot.return_value = snapshot
+
+    provider_name, _ = email_service.choose_provider_with_lower_latency()
+
+    assert provider_name == "Amazon SES"
+
+# Las decisiones de enrutamiento reutilizan el snapshot en proceso sin volver a Redis
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_routing_state_is_cached_between_sends(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    email_data = EmailRequest(to="example@example.com", subject="Test", body="This is a test.")
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=0, ses_usage=0)
+    mock_redis.record_send_outcome.side_effect = [(1, latency_stats()), (2, latency_stats())]
+
+    assert email_service.send_email(email_data) == "SendGrid"
+    assert email_service.send_email(email_data) == "SendGrid"
+
+    mock_redis.get_routing_snapshot.assert_called_once()
+    # La escritura local actualiza el uso consecutivo sin recargar el snapshot
+    assert email_service.get_usage_count("SendGrid") == 2
+
+# Los correos idénticos se envían en una sola llamada masiva y los resultados vuelven por destinatario
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_bulk_email')
+@patch('app.services.email_service.SESService.send_bulk_email')
+def test_send_bulk_maps_results_per_recipient(mock_ses_send_bulk, mock_sendgrid_send_bulk, mock_redis, email_service):
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=2, ses_usage=0)
+    mock_redis.record_send_outcome.return_value = (3, latency_stats())
+    mock_ses_send_bulk.return_value = [None, "Amazon SES rechazó el destinatario: MessageRejected", None]
+    emails = [
+        EmailRequest(to=f"user{i}@example.com", subject="Boletín", body="<h1>Novedades</h1>")
+        for i in range(3)
+    ]
+
+    results = email_service.send_bulk(emails)
+
+    mock_ses_send_bulk.assert_called_once()
+    assert mock_ses_send_bulk.call_args.kwargs["recipients"] == ["user0@example.com", "user1@example.com", "user2@example.com"]
+    mock_sendgrid_send_bulk.assert_not_called()
+    assert results[0] == "Amazon SES" and results[2] == "Amazon SES"
+    assert isinstance(results[1], RuntimeError)
+    # Sólo los correos aceptados cuentan en las métricas
+    assert mock_redis.record_send_outcome.call_args.kwargs["sent_count"] == 2
+
+# Si un bloque falla en parte y luego se agotan los reintentos, los pendientes quedan como fallidos
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_bulk_email')
+@patch('app.services.email_service.SESService.send_bulk_email')
+@patch('app.services.email_service.SESService.max_bulk_recipients', 2)
+def test_send_bulk_marks_pending_recipients_failed_when_retries_run_out(mock_ses_send_bulk, mock_sendgrid_send_bulk, mock_redis, email_service):
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=2, ses_usage=0)
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    mock_redis.mark_provider_unhealthy.return_value = 5
+    mock_ses_send_bulk.side_effect = [[None, "Amazon SES rechazó el destinatario: MessageRejected"], Exception("SES caído")]
+    mock_sendgrid_send_bulk.side_effect = Exception("SendGrid caído")
+    emails = [
+        EmailRequest(to=f"user{i}@example.com", subject="Boletín", body="<h1>Novedades</h1>")
+        for i in range(4)
+    ]
+
+    results = email_service.send_bulk(emails)
+
+    assert results[0] == "Amazon SES"
+    assert all(isinstance(result, Exception) for result in results[1:])
+
+# El envío asíncrono mantiene el enrutamiento y la conmutación ante fallos, sin llamadas síncronas a Redis
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email_async', new_callable=AsyncMock)
+@patch('app.services.email_service.SESService.send_email_async', new_callable=AsyncMock)
+def test_send_email_async_falls_back_to_next_provider(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    email_data = EmailRequest(to="example@example.com", subject="Test", body="This is a test.")
+    mock_redis.get_routing_snapshot_async = AsyncMock(return_value=routing_snapshot(sendgrid_usage=0, ses_usage=0))
+    mock_redis.record_send_outcome_async = AsyncMock(return_value=(1, latency_stats()))
+    mock_redis.mark_provider_unhealthy_async = AsyncMock(return_value=5)
+    mock_sendgrid_send_email.side_effect = Exception("SendGrid falló con el estado: 500")
+
+    async def send_many():
+        return await asyncio.gather(*(email_service.send_email_async(email_data) for _ in range(3)))
+
+    assert asyncio.run(send_many()) == ["Amazon SES"] * 3
+    mock_redis.mark_provider_unhealthy_async.assert_called_with("SendGrid", HEALTH_CHECK_KEY)
+    # El snapshot se carga una vez y se reutiliza entre los envíos
+    mock_redis.get_routing_snapshot_async.assert_awaited_once()
+    assert [call.args[0] for call in mock_redis.record_send_outcome_async.await_args_list] == ["Amazon SES"] * 3
+    mock_redis.get_routing_snapshot.assert_not_called()
+    mock_redis.record_send_outcome.assert_not_called()
+    mock_redis.mark_provider_unhealthy.assert_not_called()
+
+# Con round robin ponderado el reparto sigue los pesos configurados
+def test_weighted_round_robin_follows_weights():
+    strategy = WeightedRoundRobinStrategy()
+    providers = [("SendGrid", None), ("Amazon SES", None)]
+    weights = {"SendGrid": 3, "Amazon SES": 1}
+    state = routing_snapshot(sendgrid_usage=0, ses_usage=0)
+
+    chosen = [strategy.choose(providers, state, weights, {})[0] for _ in range(8)]
+
+    assert chosen.count("SendGrid") == 6
+    assert chosen.count("Amazon SES") == 2
+
+# Una estrategia sin choose falla al crearla, no en el primer envío
+def test_incomplete_routing_strategy_fails_when_built():
+    class IncompleteStrategy(RoutingStrategy):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteStrategy()
+
+# Un tercer proveedor declarado en la configuración participa en el enrutamiento y el fallback
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_send_email_with_third_provider(mock_ses_send_email, mock_sendgrid_send_email, mock_redis):
+    service = EmailService(provider_configs=[
+        {"name": "SendGrid", "type": "sendgrid"},
+        {"name": "Amazon SES", "type": "ses"},
+        {"name": "Amazon SES eu", "type": "ses", "region": "eu-west-1", "weight": 2},
+    ], routing_strategy="least_latency")
+    service.circuit_breakers = {
+        provider_name: ConcurrentCircuitBreaker(fail_max=3, reset_timeout=60)
+        for provider_name, _ in service.providers
+    }
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0, latency=0.4)
+    snapshot["Amazon SES eu"] = {"usage": 0, "healthy": True, "latency": latency_stats(0.6), "tokens": float('inf')}
+    mock_redis.get_routing_snapshot.return_value = snapshot
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    # Falla el primer envío por SES para forzar el fallback
+    mock_ses_send_email.side_effect = [Exception("SES caído"), None]
+
+    provider_used = service.send_email(EmailRequest(
+        to="example@example.com",
+        subject="Test Email",
+        body="This is a test.",
+        from_email="foreromartinez.andres@gmail.com"
+    ))
+
+    # 0.6 / 2 es la menor latencia ponderada; tras el fallo se prueba un proveedor nuevo
+    assert service.providers[2][1].region == "eu-west-1"
+    assert provider_used == "SendGrid"
+    mock_sendgrid_send_email.assert_called_once()
+
+# El throttling del proveedor cambia de proveedor sin marcarlo como no saludable
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_throttling_does_not_mark_provider_unhealthy(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    email_service.rate_limits = {"SendGrid": (100, 200), "Amazon SES": (14, 14)}
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=0, ses_usage=0, tokens=10)
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    # El bucket de SendGrid está vacío; SES tiene cuota
+    mock_redis.acquire_send_tokens.side_effect = lambda provider_name, *args: (provider_name != "SendGrid", 0.0)
+
+    provider_used = email_service.send_email(EmailRequest(
+        to="example@example.com",
+        subject="Test Email",
+        body="This is a test.",
+        from_email="foreromartinez.andres@gmail.com"
+    ))
+
+    assert provider_used == "Amazon SES"
+    mock_sendgrid_send_email.assert_not_called()
+    mock_redis.mark_provider_unhealthy.assert_not_called()
+
+# El router evita los proveedores sin cuota disponible
+@patch('app.services.email_service.RedisHandler')
+def test_router_skips_providers_without_capacity(mock_redis, email_service):
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0, latency=0.1)
+    snapshot["SendGrid"]["tokens"] = 0.4
+    mock_redis.get_routing_snapshot.return_value = snapshot
+
+    assert email_service.choose_provider_based_on_usage()[0] == "Amazon SES"
+
+# Los carriles de menor prioridad no usan la cuota reservada al transaccional
+@patch('app.services.email_service.RedisHandler')
+def test_bulk_lane_leaves_reserved_capacity(mock_redis, email_service):
+    email_service.rate_limits = {"SendGrid": (100, 200), "Amazon SES": (14, 14)}
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0, latency=0.1)
+    snapshot["SendGrid"]["tokens"] = 30
+    mock_redis.get_routing_snapshot.return_value = snapshot
+
+    assert email_service.choose_provider_based_on_usage("transactional")[0] == "SendGrid"
+    assert email_service.choose_provider_based_on_usage("bulk")[0] == "Amazon SES"
+
+# Al vencer el backoff, sólo la instancia que toma el sondeo envía un correo real con el proveedor
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_expired_unhealthy_provider_is_probed_once(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0, latency=0.1)
+    snapshot["Amazon SES"].update(healthy=False, probe=True)
+    mock_redis.get_routing_snapshot.side_effect = lambda *args: {name: dict(state) for name, state in snapshot.items()}
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    email_data = EmailRequest(to="example@example.com", subject="Test", body="This is a test.")
+
+    # Otra instancia tiene el sondeo: SES sigue fuera del pool y no se vuelve a pedir
+    mock_redis.acquire_probe.return_value = False
+    assert [email_service.send_email(email_data) for _ in range(2)] == ["SendGrid"] * 2
+    mock_redis.acquire_probe.assert_called_once()
+
+    # Esta instancia toma el sondeo y el envío exitoso lo registra como saludable
+    email_service.routing_state.invalidate()
+    mock_redis.acquire_probe.return_value = True
+    assert email_service.send_email(email_data) == "Amazon SES"
+    provider_name, _, healthy, *_ = mock_redis.record_send_outcome.call_args.args
+    assert (provider_name, healthy) == ("Amazon SES", True)
+    mock_ses_send_email.assert_called_once()
+
+# Mientras el sondeo espera respuesta, el proveedor sigue fuera del pool de los demás envíos
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_probed_provider_stays_unhealthy_until_the_probe_succeeds(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0, latency=0.1)
+    snapshot["Amazon SES"].update(healthy=False, probe=True)
+    mock_redis.get_routing_snapshot.side_effect = lambda *args: {name: dict(state) for name, state in snapshot.items()}
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    mock_redis.acquire_probe.return_value = True
+    email_data = EmailRequest(to="example@example.com", subject="Test", body="This is a test.")
+    during_probe = []
+
+    def probe_send(**kwargs):
+        during_probe.append((
+            email_service.routing_state.get()["Amazon SES"]["healthy"],
+            email_service.choose_provider_based_on_usage()[0],
+        ))
+
+    mock_ses_send_email.side_effect = probe_send
+    assert email_service.send_email(email_data) == "Amazon SES"
+
+    assert during_probe == [(False, "SendGrid")]
+    assert email_service.routing_state.get()["Amazon SES"]["healthy"]
+
+# Si el sondeo falla, el proveedor nunca se marcó como saludable y vuelve a su backoff
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_failed_probe_never_marks_the_provider_healthy(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    snapshot = routing_snapshot(sendgrid_usage=0, ses_usage=0, latency=0.1)
+    snapshot["Amazon SES"].update(healthy=False, probe=True)
+    mock_redis.get_routing_snapshot.side_effect = lambda *args: {name: dict(state) for name, state in snapshot.items()}
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    mock_redis.acquire_probe.return_value = True
+    mock_redis.mark_provider_unhealthy.return_value = 5
+    mock_ses_send_email.side_effect = Exception("SES sigue caído")
+    email_data = EmailRequest(to="example@example.com", subject="Test", body="This is a test.")
+
+    assert email_service.send_email(email_data) == "SendGrid"
+    provider_name, _, healthy, *_ = mock_redis.record_send_outcome.call_args.args
+    assert provider_name == "SendGrid"
+    assert not email_service.routing_state.get()["Amazon SES"]["healthy"]
+    assert not email_service.routing_state.holds_probe("Amazon SES")
+
+# Un intento que vence cuenta como muestra de latencia y el siguiente proveedor usa el tiempo restante
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_timed_out_attempt_is_recorded_and_falls_back(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot(sendgrid_usage=0, ses_usage=0)
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+    mock_sendgrid_send_email.side_effect = ProviderTimeoutError("SendGrid no respondió a tiempo.")
+    mock_redis.mark_provider_unhealthy.return_value = 5
+    email_data = EmailRequest(to="example@example.com", subject="Test", body="This is a test.")
+
+    assert email_service.send_email(email_data, deadline=Deadline.after(8)) == "Amazon SES"
+
+    # El presupuesto se reparte entre los dos intentos
+    assert mock_sendgrid_send_email.call_args.kwargs["timeout"] == pytest.approx(4, abs=0.1)
+    assert mock_ses_send_email.call_args.kwargs["timeout"] <= 8
+    # El timeout cuenta como muestra de latencia y deja al proveedor no saludable, sin tocar el uso
+    assert mock_redis.cache_latency.call_args.args[0] == "SendGrid"
+    mock_redis.mark_provider_unhealthy.assert_called_once_with("SendGrid", HEALTH_CHECK_KEY)
+    assert [call.args[0] for call in mock_redis.record_send_outcome.call_args_list] == ["Amazon SES"]
+    assert email_service.routing_state.get()["SendGrid"]["healthy"] is False
+
+# Sin Redis el envío sigue con el estado inicial y las métricas se estiman en el proceso
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_email')
+@patch('app.services.email_service.SESService.send_email')
+def test_send_email_keeps_working_when_redis_is_down(mock_ses_send_email, mock_sendgrid_send_email, mock_redis, email_service):
+    mock_redis.get_routing_snapshot.side_effect = redis.ConnectionError("Connection refused")
+    mock_redis.record_send_outcome.side_effect = redis.ConnectionError("Connection refused")
+    mock_redis.mark_provider_unhealthy.side_effect = redis.ConnectionError("Connection refused")
+    mock_sendgrid_send_email.side_effect = Exception("SendGrid caído")
+
+    provider = email_service.send_email(EmailRequest(to="example@example.com", subject="Hola", body="Hola"))
+
+    assert provider == "Amazon SES"
+    routing_state = email_service.routing_state.get()
+    assert email_service.routing_state.degraded
+    assert not routing_state["SendGrid"]["healthy"]
+    assert routing_state["Amazon SES"]["usage"] == 1
+    assert routing_state["Amazon SES"]["latency"]["n"] == 1
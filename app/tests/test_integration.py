@@ -24,8 +24,12 @@ def test_integration_sqs_to_email_provider():
     )
 
     # Mock Redis and SendGrid/SES services
-    with patch('app.services.email_service.RedisHandler.get_usage_count', return_value=0), \
-         patch('app.services.email_service.RedisHandler.get_predicted_latency', return_value=0.2), \
+    routing_snapshot = {
+        "SendGrid": {"usage": 0, "healthy": True, "latency": {"n": 1, "ewma": 0.2, "p50": 0.2, "p95": 0.2, "p99": 0.2}, "tokens": float('inf')},
+        "Amazon SES": {"usage": 0, "healthy": True, "latency": {"n": 1, "ewma": 0.2, "p50": 0.2, "p95": 0.2, "p99": 0.2}, "tokens": float('inf')},
+    }
+
+    with patch('app.services.email_service.RedisHandler.get_routing_snapshot', return_value=routing_snapshot), \
          patch('app.services.email_service.SendGridService.send_email') as mock_sendgrid, \
          patch('app.services.email_service.SESService.send_email') as mock_ses:
 
@@ -0,0 +1,40 @@
+import json
+import logging
+from app.core.logging_config import ContextFilter, JSONFormatter, SamplingFilter, correlation_scope
+
+
+def make_record(name, level, message, *args, **extra):
+    record = logging.LogRecord(name, level, __file__, 1, message, args, None)
+    record.__dict__.update(extra)
+    return record
+
+# El formato JSON incluye el correlation_id del contexto y los campos extra
+def test_json_formatter_includes_correlation_id_and_extras():
+    record = make_record("app.workers.sqs_worker", logging.INFO, "Correo enviado con %s", "SendGrid", provider="SendGrid")
+    with correlation_scope("msg-1"):
+        ContextFilter().filter(record)
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["message"] == "Correo enviado con SendGrid"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.workers.sqs_worker"
+    assert entry["correlation_id"] == "msg-1"
+    assert entry["provider"] == "SendGrid"
+
+# El muestreo conserva o descarta todos los logs de un mismo mensaje y nunca descarta advertencias
+def test_sampling_is_consistent_per_correlation_id():
+    sampling = SamplingFilter({"INFO": 0.5})
+    kept = set()
+    for index in range(200):
+        decisions = {
+            sampling.filter(make_record("app.services.email_service", logging.INFO, "envío", correlation_id=f"msg-{index}"))
+            for _ in range(3)
+        }
+        assert len(decisions) == 1
+        if decisions.pop():
+            kept.add(index)
+
+    assert 50 < len(kept) < 150
+    assert sampling.filter(make_record("app.services.email_service", logging.WARNING, "fallo", correlation_id="msg-0"))
+    assert sampling.filter(make_record("app.api.email_routes", logging.INFO, "fuera del camino de envío", correlation_id="msg-0"))
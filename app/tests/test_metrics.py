@@ -0,0 +1,43 @@
+import json
+from fastapi.testclient import TestClient
+from app.core.metrics import MetricsRegistry, lambda_metrics, metrics
+from app.main import app
+
+# Los histogramas se exportan acumulados por bucket en formato Prometheus
+def test_render_prometheus_histogram_and_counter():
+    registry = MetricsRegistry(namespace="Test")
+    registry.observe("email_stage_seconds", 0.003, stage="route")
+    registry.observe("email_stage_seconds", 0.2, stage="route")
+    registry.increment("email_sends_total", provider="SendGrid", outcome="success")
+
+    text = registry.render_prometheus()
+
+    assert 'email_sends_total{outcome="success",provider="SendGrid"} 1' in text
+    assert 'email_stage_seconds_bucket{stage="route",le="0.005"} 1' in text
+    assert 'email_stage_seconds_bucket{stage="route",le="+Inf"} 2' in text
+    assert 'email_stage_seconds_count{stage="route"} 2' in text
+
+# Los handlers de Lambda emiten en EMF sólo lo registrado desde el último envío
+def test_lambda_handler_flushes_emf(capsys):
+    metrics.reset()
+
+    @lambda_metrics("test_handler")
+    def handler(event, context):
+        metrics.increment("email_sends_total", provider="SendGrid", outcome="success")
+        return {"statusCode": 200}
+
+    assert handler({}, None) == {"statusCode": 200}
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    sends = next(document for document in documents if "email_sends_total" in document)
+    assert sends["email_sends_total"] == 1
+    assert sends["provider"] == "SendGrid"
+    assert sends["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["outcome", "provider"]]
+    timing = next(document for document in documents if "lambda_handler_seconds" in document)
+    assert sum(timing["lambda_handler_seconds"]["Counts"]) == 1
+
+    # Lo ya enviado no se repite, pero sigue en /metrics
+    assert metrics.emf_documents() == []
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert 'email_sends_total{outcome="success",provider="SendGrid"} 1' in response.text
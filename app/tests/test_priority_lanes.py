@@ -0,0 +1,42 @@
+from concurrent.futures import Future
+from unittest.mock import patch
+from app.workers.scheduler import WeightedFairScheduler
+from app.workers.sqs_worker import process_email_queue
+
+# Con trabajo en ambos carriles se reparten los turnos por peso; un carril solo los usa todos
+def test_weighted_fair_scheduler_interleaves_by_weight():
+    scheduler = WeightedFairScheduler({"transactional": 4, "bulk": 1})
+    for index in range(6):
+        scheduler.put("bulk", f"b{index}")
+    for index in range(8):
+        scheduler.put("transactional", f"t{index}")
+
+    order = [item for _, item in scheduler.drain()]
+
+    assert sum(1 for item in order[:5] if item.startswith("t")) == 4
+    assert sum(1 for item in order[:10] if item.startswith("t")) == 8
+    assert order[10:] == ["b2", "b3", "b4", "b5"]
+    assert len(scheduler) == 0
+
+def run_inline(send, *args):
+    # Ejecuta el envío en el orden en que el worker lo entrega al pool
+    future = Future()
+    future.set_result(send(*args))
+    return future
+
+# El worker atiende antes los correos transaccionales aunque lleguen detrás del masivo
+# y registra la espera en la cola por carril
+@patch('app.workers.sqs_worker.metrics')
+@patch('app.services.email_service.EmailService.send_email')
+def test_worker_schedules_high_priority_first(mock_send_email, mock_metrics):
+    mock_send_email.return_value = "SendGrid"
+    body = '{"to": "user%d@example.com", "subject": "Asunto %d", "body": "Hola", "priority": "%s"}'
+    records = [{"body": body % (i, i, "bulk"), "attributes": {"SentTimestamp": "1700000000000"}} for i in range(4)]
+    records.append({"body": body % (9, 9, "transactional"), "attributes": {"SentTimestamp": "1700000000000"}})
+
+    with patch('app.workers.sqs_worker.executor.submit', side_effect=run_inline):
+        process_email_queue({"Records": records}, None)
+
+    assert mock_send_email.call_args_list[0].args[0].priority == "transactional"
+    lanes = [call.kwargs["lane"] for call in mock_metrics.observe.call_args_list if call.args[0] == "worker_queue_age_seconds"]
+    assert sorted(lanes) == ["bulk"] * 4 + ["transactional"]
@@ -1,6 +1,37 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 from app.workers.sqs_worker import process_email_queue  # Asegúrate de que esta ruta sea correcta
+from app.workers.retry import RetryScheduler
+from app.core.idempotency import IdempotencyGuard, CLAIMED, PENDING, SENT
+
+
+@pytest.fixture(autouse=True)
+def idempotency_store():
+    # Guard nuevo por prueba y reservas de Redis simuladas con un diccionario {clave: estado}
+    store = {}
+
+    def claim(keys, key_prefix, pending_ttl):
+        statuses = {key: store.get(key, CLAIMED) for key in keys}
+        store.update((key, PENDING) for key, status in statuses.items() if status == CLAIMED)
+        return statuses
+
+    def complete(sent, failed, key_prefix, ttl):
+        store.update((key, SENT) for key in sent)
+        for key in failed:
+            store.pop(key, None)
+
+    with patch('app.workers.sqs_worker.idempotency_guard', IdempotencyGuard()), \
+            patch('app.core.redis_handler.RedisHandler.claim_idempotency_keys', side_effect=claim) as mock_claim, \
+            patch('app.core.redis_handler.RedisHandler.complete_idempotency_keys', side_effect=complete):
+        store["claim"] = mock_claim
+        yield store
+
+
+@pytest.fixture(autouse=True)
+def retry_scheduler():
+    # Sin reintentos diferidos ni cola de mensajes muertos: los fallidos se reportan a SQS
+    with patch('app.workers.sqs_worker.retry_scheduler', RetryScheduler(dead_letter_queue_url="", max_attempts=1)) as scheduler:
+        yield scheduler
 
 # Ajusta el patch al lugar correcto donde se usa `EmailService`
 @patch('app.services.email_service.EmailService.send_email')
@@ -19,3 +50,169 @@ def test_process_email_queue(mock_send_email):
 
     # Validamos que el servicio de correo fue llamado
     mock_send_email.assert_called_once()
+
+@patch('app.services.email_service.EmailService.send_email')
+def test_process_email_queue_reports_only_failed_messages(mock_send_email):
+    # Sólo el mensaje cuyo envío falla debe volver a la cola
+    def send_email(email_data, deadline=None):
+        if email_data.subject == "Falla":
+            raise RuntimeError("Proveedor caído")
+        return "SendGrid"
+
+    mock_send_email.side_effect = send_email
+    event = {
+        "Records": [
+            {"messageId": f"msg-{i}", "body": f'{{"to": "example@example.com", "subject": "{subject}", "body": "This is test {i}."}}'}
+            for i, subject in enumerate(["Ok", "Falla", "Ok"])
+        ]
+    }
+
+    response = process_email_queue(event, None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-1"}]}
+    assert mock_send_email.call_count == 3
+
+
+@patch('app.services.email_service.EmailService.send_bulk')
+@patch('app.services.email_service.EmailService.send_email')
+def test_process_email_queue_groups_identical_content(mock_send_email, mock_send_bulk):
+    # Tres correos con el mismo contenido van por la API masiva; el distinto, por envío individual
+    newsletter = '{"to": "user%d@example.com", "subject": "Boletín", "body": "<h1>Novedades</h1>"}'
+    event = {
+        "Records": [{"messageId": f"msg-{i}", "body": newsletter % i} for i in range(3)]
+        + [{"messageId": "msg-3", "body": '{"to": "other@example.com", "subject": "Reset", "body": "Tu código"}'}]
+    }
+    mock_send_email.return_value = "SendGrid"
+    mock_send_bulk.return_value = ["SendGrid", RuntimeError("Destinatario rechazado"), "SendGrid"]
+
+    response = process_email_queue(event, None)
+
+    mock_send_bulk.assert_called_once()
+    assert [email.to for email in mock_send_bulk.call_args.args[0]] == [f"user{i}@example.com" for i in range(3)]
+    mock_send_email.assert_called_once()
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-1"}]}
+
+
+@patch('app.services.email_service.EmailService.send_email')
+def test_process_email_queue_drops_duplicates_before_sending(mock_send_email, idempotency_store):
+    # Un mensaje ya enviado por otra instancia y una clave repetida en el lote no se reenvían
+    mock_send_email.return_value = "SendGrid"
+    idempotency_store["msg-0"] = SENT
+    body = '{"to": "user%d@example.com", "subject": "Pedido %d", "body": "Confirmado", "idempotency_key": "%s"}'
+    event = {
+        "Records": [
+            {"messageId": "msg-0", "body": '{"to": "user0@example.com", "subject": "Hola", "body": "Hola"}'},
+            {"messageId": "msg-1", "body": body % (1, 1, "pedido-1")},
+            {"messageId": "msg-2", "body": body % (2, 2, "pedido-1")},
+        ]
+    }
+
+    assert process_email_queue(event, None) == {"batchItemFailures": []}
+    mock_send_email.assert_called_once()
+    assert idempotency_store["pedido-1"] == SENT
+
+    # La reentrega del lote se descarta con el filtro local, sin volver a consultar Redis
+    idempotency_store["claim"].reset_mock()
+    assert process_email_queue(event, None) == {"batchItemFailures": []}
+    mock_send_email.assert_called_once()
+    idempotency_store["claim"].assert_not_called()
+
+
+@patch('app.services.email_service.EmailService.send_email')
+def test_process_email_queue_retries_in_flight_and_failed_messages(mock_send_email, idempotency_store):
+    # Un mensaje en proceso en otra instancia vuelve a la cola; uno fallido libera su clave
+    mock_send_email.side_effect = RuntimeError("Proveedor caído")
+    idempotency_store["msg-0"] = PENDING
+    event = {
+        "Records": [
+            {"messageId": f"msg-{i}", "body": f'{{"to": "user{i}@example.com", "subject": "Asunto {i}", "body": "Hola"}}'}
+            for i in range(2)
+        ]
+    }
+
+    response = process_email_queue(event, None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "msg-0"}, {"itemIdentifier": "msg-1"}]}
+    mock_send_email.assert_called_once()
+    assert "msg-1" not in idempotency_store
+
+
+@patch('app.services.email_service.EmailService.send_email')
+def test_process_email_queue_reschedules_failures_with_backoff(mock_send_email):
+    # Los fallidos vuelven a su cola con retraso y el siguiente intento; agotados, van a la cola de mensajes muertos
+    mock_send_email.side_effect = RuntimeError("Proveedor caído")
+    sqs = MagicMock()
+    sqs.send_message_batch.return_value = {"Successful": [], "Failed": []}
+    scheduler = RetryScheduler(dead_letter_queue_url="https://sqs/dlq", max_attempts=3, base_delay=10, max_delay=900, sqs_client=sqs)
+    event = {
+        "Records": [
+            {"messageId": "msg-0", "body": '{"to": "user0@example.com", "subject": "A", "body": "Hola"}',
+             "messageAttributes": {"attempt": {"stringValue": "2", "dataType": "Number"}}},
+            {"messageId": "msg-1", "body": '{"to": "user1@example.com", "subject": "B", "body": "Hola"}',
+             "messageAttributes": {"attempt": {"stringValue": "3", "dataType": "Number"}}},
+            {"messageId": "msg-2", "body": '{"to": "no es un correo"}'},
+        ]
+    }
+
+    with patch('app.workers.sqs_worker.retry_scheduler', scheduler):
+        assert process_email_queue(event, None) == {"batchItemFailures": []}
+
+    calls = {call.kwargs["QueueUrl"]: call.kwargs["Entries"] for call in sqs.send_message_batch.call_args_list}
+    [retried] = [entries for queue_url, entries in calls.items() if queue_url != "https://sqs/dlq"]
+    assert [entry["Id"] for entry in retried] == ["0"]
+    assert retried[0]["MessageAttributes"]["attempt"]["StringValue"] == "3"
+    assert 10 <= retried[0]["DelaySeconds"] <= 20
+    # El agotado y el inválido van a la cola de mensajes muertos con su error
+    assert [entry["Id"] for entry in calls["https://sqs/dlq"]] == ["1", "2"]
+    assert calls["https://sqs/dlq"][0]["MessageAttributes"]["error"]["StringValue"] == "Proveedor caído"
+
+
+@patch('app.services.email_service.EmailService.send_email')
+def test_repeated_message_in_batch_is_rescheduled_once(mock_send_email):
+    # SQS puede entregar el mismo mensaje dos veces en un lote: se reprograma una sola copia
+    mock_send_email.side_effect = RuntimeError("Proveedor caído")
+    sqs = MagicMock()
+    sqs.send_message_batch.return_value = {"Successful": [], "Failed": []}
+    scheduler = RetryScheduler(dead_letter_queue_url="https://sqs/dlq", max_attempts=3, sqs_client=sqs)
+    message = {"messageId": "msg-0", "receiptHandle": "rh-0", "body": '{"to": "user0@example.com", "subject": "A", "body": "Hola"}'}
+    invalid = {"messageId": "msg-1", "receiptHandle": "rh-1", "body": '{"to": "no es un correo"}'}
+    event = {"Records": [message, dict(message), invalid, dict(invalid)]}
+
+    with patch('app.workers.sqs_worker.retry_scheduler', scheduler):
+        assert process_email_queue(event, None) == {"batchItemFailures": []}
+
+    mock_send_email.assert_called_once()
+    calls = {call.kwargs["QueueUrl"]: call.kwargs["Entries"] for call in sqs.send_message_batch.call_args_list}
+    [retried] = [entries for queue_url, entries in calls.items() if queue_url != "https://sqs/dlq"]
+    assert [entry["Id"] for entry in retried] == ["0"]
+    assert [entry["Id"] for entry in calls["https://sqs/dlq"]] == ["2"]
+
+
+@patch('app.services.email_service.EmailService.send_email')
+def test_rescheduled_copy_keeps_original_idempotency_key(mock_send_email, idempotency_store):
+    # La copia reprogramada lleva la clave del original; un mensaje en proceso en otra instancia no se reprograma
+    mock_send_email.side_effect = RuntimeError("Proveedor caído")
+    idempotency_store["msg-1"] = PENDING
+    idempotency_store["msg-5"] = SENT
+    sqs = MagicMock()
+    sqs.send_message_batch.return_value = {"Successful": [], "Failed": []}
+    scheduler = RetryScheduler(dead_letter_queue_url="https://sqs/dlq", max_attempts=3, sqs_client=sqs)
+    event = {
+        "Records": [
+            {"messageId": f"msg-{i}", "body": f'{{"to": "user{i}@example.com", "subject": "Asunto {i}", "body": "Hola"}}'}
+            for i in range(2)
+        ] + [
+            # Copia reprogramada de msg-5, que ya se envió
+            {"messageId": "msg-9", "body": '{"to": "user5@example.com", "subject": "Asunto 5", "body": "Hola"}',
+             "messageAttributes": {"attempt": {"stringValue": "2", "dataType": "Number"},
+                                   "idempotency_key": {"stringValue": "msg-5", "dataType": "String"}}},
+        ]
+    }
+
+    with patch('app.workers.sqs_worker.retry_scheduler', scheduler):
+        assert process_email_queue(event, None) == {"batchItemFailures": [{"itemIdentifier": "msg-1"}]}
+
+    mock_send_email.assert_called_once()
+    [call] = sqs.send_message_batch.call_args_list
+    assert [entry["Id"] for entry in call.kwargs["Entries"]] == ["0"]
+    assert call.kwargs["Entries"][0]["MessageAttributes"]["idempotency_key"]["StringValue"] == "msg-0"
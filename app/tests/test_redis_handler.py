@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+import redis
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from app.core.redis_handler import RedisAvailability, RedisHandler, RedisUnavailableError, guarded
+
+# Tras un timeout las llamadas fallan de inmediato y las escrituras diferibles se reproducen al volver Redis
+def test_deferred_writes_are_replayed_in_order_when_redis_recovers():
+    availability = RedisAvailability(retry_interval=60, buffer_size=2, replay_batch_size=1)
+    replayed_in = []
+
+    def record_write(value):
+        if value == "a":
+            raise redis.TimeoutError("Timeout reading from socket")
+        replayed_in.append(threading.current_thread())
+
+    write = MagicMock(side_effect=record_write)
+
+    with patch('app.core.redis_handler.redis_availability', availability):
+        deferred_write = guarded(deferrable=True)(write)
+        with pytest.raises(redis.TimeoutError):
+            deferred_write("a")
+        assert availability.degraded
+        with pytest.raises(RedisUnavailableError):
+            availability.check()
+        # El búfer está acotado: se descarta la escritura más antigua
+        availability.defer(write, ("b",), {})
+        availability.defer(write, ("c",), {})
+
+        availability._down_until = None
+        guarded()(MagicMock(return_value="ok"))()
+
+    # La reproducción corre en segundo plano, fuera de la llamada que vio volver a Redis
+    deadline = time.monotonic() + 5
+    while len(replayed_in) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not availability.degraded
+    assert availability.pending_writes == 0
+    assert threading.current_thread() not in replayed_in
+    assert [call.args for call in write.call_args_list[1:]] == [("b",), ("c",)]
+
+# Una lectura compuesta pasa por un solo guard: el fallo se registra una vez
+def test_predicted_latency_failure_is_recorded_once():
+    availability = MagicMock()
+    client = MagicMock()
+    client.hmget.side_effect = redis.ConnectionError("Connection refused")
+
+    with patch('app.core.redis_handler.redis_availability', availability), \
+            patch('app.core.redis_handler.get_redis_client', return_value=client):
+        with pytest.raises(redis.ConnectionError):
+            RedisHandler.get_predicted_latency("SendGrid", "latency")
+
+    availability.record_failure.assert_called_once()
+    availability.defer.assert_not_called()
+
+# Una escritura asíncrona que no llegó a Redis se guarda con su versión síncrona para reproducirla
+def test_async_write_defers_its_synchronous_replay():
+    availability = MagicMock()
+    replay = MagicMock()
+
+    async def write(value):
+        raise redis.ConnectionError("Connection refused")
+
+    with patch('app.core.redis_handler.redis_availability', availability):
+        with pytest.raises(redis.ConnectionError):
+            asyncio.run(guarded(deferrable=True, replay=replay)(write)("a"))
+
+    availability.record_failure.assert_called_once()
+    availability.defer.assert_called_once_with(replay, ("a",), {})
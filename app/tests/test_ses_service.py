@@ -0,0 +1,108 @@
+import os
+import time
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock, patch
+from app.core.exceptions import ProviderTimeoutError
+from app.services.ses_service import SESService
+
+
+def ses_with_client(client, **kwargs):
+    service = SESService(**kwargs)
+    service.client_for = MagicMock(return_value=client)
+    return service
+
+
+def deployed_ses_actions() -> set:
+    """
+    Acciones de SES que el rol de serverless.yml concede a las funciones.
+    """
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "serverless.yml")
+    with open(path) as f:
+        return {line.strip()[len("- ses:"):] for line in f if line.strip().startswith("- ses:")}
+
+
+class PermissionCheckingClient:
+    """
+    Cliente de SES falso que, como IAM, rechaza con AccessDenied las acciones que el rol no concede.
+    """
+
+    def __init__(self, allowed_actions: set):
+        self.allowed_actions = allowed_actions
+        self.calls = []
+
+    def __getattr__(self, operation):
+        action = "".join(part.title() for part in operation.split("_"))
+
+        def call(**kwargs):
+            if action not in self.allowed_actions:
+                raise ClientError({"Error": {"Code": "AccessDenied", "Message": f"ses:{action}"}}, action)
+            self.calls.append((action, kwargs))
+            return {"Status": [{"Status": "Success"}]}
+        return call
+
+# Un timeout con un destinatario se reporta para ese destinatario y el resto se sigue enviando
+def test_bulk_with_braces_reports_timeouts_per_recipient():
+    service = SESService()
+    with patch.object(SESService, 'send_email', side_effect=[ProviderTimeoutError("SES no respondió a tiempo."), {}]):
+        results = service.send_bulk_email(["a@example.com", "b@example.com"], "Hola {{nombre}}", "Cuerpo")
+
+    assert results == ["SES no respondió a tiempo.", None]
+
+# Las plantillas masivas se conservan en una caché acotada y las que salen se borran de SES
+def test_bulk_templates_are_bounded_and_evicted_ones_deleted():
+    client = MagicMock()
+    client.send_bulk_templated_email.return_value = {"Status": [{"Status": "Success"}]}
+    service = ses_with_client(client, bulk_template_cache_size=2)
+
+    for body in ("uno", "dos", "uno", "tres"):
+        assert service.send_bulk_email(["a@example.com"], "Hola", body) == [None]
+
+    assert client.create_template.call_count == 3
+    client.delete_template.assert_called_once_with(TemplateName=service.bulk_template_name("Hola", "dos"))
+    assert list(service.bulk_templates) == [service.bulk_template_name("Hola", body) for body in ("uno", "tres")]
+
+# Si otro contenedor borró la plantilla, se vuelve a crear y el envío se repite una vez
+def test_bulk_template_deleted_elsewhere_is_recreated():
+    client = MagicMock()
+    missing = ClientError({"Error": {"Code": "TemplateDoesNotExist", "Message": "no existe"}}, "SendBulkTemplatedEmail")
+    client.send_bulk_templated_email.side_effect = [missing, {"Status": [{"Status": "Success"}]}]
+    service = ses_with_client(client)
+    service.bulk_templates[service.bulk_template_name("Hola", "uno")] = None
+
+    assert service.send_bulk_email(["a@example.com"], "Hola", "uno") == [None]
+    client.create_template.assert_called_once()
+    assert client.send_bulk_templated_email.call_count == 2
+
+# Con los permisos desplegados, las plantillas que salen de la caché se borran de verdad de SES
+def test_bulk_template_eviction_is_allowed_by_the_deployed_role():
+    client = PermissionCheckingClient(deployed_ses_actions())
+    service = ses_with_client(client, bulk_template_cache_size=1)
+
+    with patch('app.services.ses_service.logger') as mock_logger:
+        for body in ("uno", "dos"):
+            assert service.send_bulk_email(["a@example.com"], "Hola", body) == [None]
+
+    mock_logger.warning.assert_not_called()
+    assert ("DeleteTemplate", {"TemplateName": service.bulk_template_name("Hola", "uno")}) in client.calls
+
+# Sin plantilla, los envíos uno a uno comparten el timeout del intento en lugar de multiplicarlo
+def test_bulk_with_braces_stays_within_the_attempt_timeout():
+    calls = []
+
+    def slow_send(to, subject, body, from_email, timeout):
+        # El proveedor tarda todo el timeout que se le da
+        calls.append(timeout)
+        time.sleep(timeout)
+        raise ProviderTimeoutError("SES no respondió a tiempo.")
+
+    service = SESService()
+    recipients = [f"user{i}@example.com" for i in range(20)]
+    start = time.monotonic()
+    with patch.object(SESService, 'send_email', side_effect=slow_send):
+        results = service.send_bulk_email(recipients, "Hola {{nombre}}", "Cuerpo", timeout=1.5)
+
+    assert time.monotonic() - start < 2
+    assert all(results)
+    # Los destinatarios que no alcanzaron a intentarse fallan por el deadline
+    assert 1 <= len(calls) < len(recipients)
+    assert "No queda tiempo" in results[-1]
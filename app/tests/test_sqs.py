@@ -1,12 +1,20 @@
+import asyncio
 import pytest
 import json
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from app.api.email_routes import router  # Importa correctamente el router
+from app.api.email_routes import router, iter_ndjson_lines  # Importa correctamente el router
+from app.core.exceptions import BatchTooLargeError
 from app.models import EmailRequest
+from app.api.sqs_producer import SQSBatchProducer
 
 client = TestClient(router)
 
+def batch_response(QueueUrl, Entries):
+    # SQS acepta todas las entradas del lote
+    return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
 # Aquí es donde hacemos el mock directamente del cliente de boto3
 @patch('app.api.email_routes.sqs_client')  # Importa la referencia correcta de 'sqs_client'
 def test_send_email_sqs(mock_sqs_client):
@@ -18,8 +26,8 @@ def test_send_email_sqs(mock_sqs_client):
         from_email="from@example.com"
     )
 
-    # Simulamos una respuesta vacía del método send_message
-    mock_sqs_client.send_message.return_value = {}
+    # Simulamos que SQS acepta el lote
+    mock_sqs_client.send_message_batch.side_effect = batch_response
 
     # Envía la solicitud POST al endpoint
     response = client.post(
@@ -31,5 +39,123 @@ def test_send_email_sqs(mock_sqs_client):
     assert response.status_code == 200
     assert response.json() == {"message": "Email queued successfully"}
 
-    # Asegúrate de que el método send_message haya sido llamado una vez
-    mock_sqs_client.send_message.assert_called_once()
+    # Asegúrate de que el productor haya encolado el mensaje en un solo lote
+    mock_sqs_client.send_message_batch.assert_called_once()
+    mock_sqs_client.send_message.assert_not_called()
+
+@patch('app.api.email_routes.sqs_client')
+def test_send_email_batch_reports_each_item(mock_sqs_client):
+    mock_sqs_client.send_message_batch.side_effect = batch_response
+    emails = [
+        {"to": "example@example.com", "subject": "Test", "body": "This is a test."},
+        {"to": "no-es-un-correo", "subject": "Test", "body": "This is a test."},
+        {"to": "other@example.com", "subject": "Test", "body": "This is a test."},
+    ]
+
+    response = client.post("/send-email/batch", json=emails)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["queued"] == 2
+    assert data["failed"] == 1
+    assert [result["status"] for result in data["results"]] == ["queued", "invalid", "queued"]
+    mock_sqs_client.send_message_batch.assert_called_once()
+
+
+@patch('app.api.email_routes.sqs_client')
+def test_send_email_batch_ndjson_in_chunks_of_ten(mock_sqs_client):
+    mock_sqs_client.send_message_batch.side_effect = batch_response
+    lines = [
+        json.dumps({"to": f"user{i}@example.com", "subject": "Test", "body": "This is a test."})
+        for i in range(25)
+    ]
+
+    response = client.post(
+        "/send-email/batch",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["queued"] == 25
+    # 25 correos se encolan en 3 llamadas de hasta 10 mensajes
+    assert mock_sqs_client.send_message_batch.call_count == 3
+    assert sorted(len(call.kwargs["Entries"]) for call in mock_sqs_client.send_message_batch.call_args_list) == [5, 10, 10]
+
+
+# Las líneas se separan por parte aunque una línea llegue cortada entre dos partes
+def test_ndjson_lines_are_split_across_chunks():
+    async def stream():
+        for chunk in (b'{"a"', b': 1}\n\n{"b": 2}', b'\n{"c": 3}'):
+            yield chunk
+
+    async def collect():
+        return [line async for line in iter_ndjson_lines(stream())]
+
+    assert asyncio.run(collect()) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+# Un NDJSON con más correos que el máximo se rechaza con 413 sin leer el resto del cuerpo
+@patch('app.api.email_routes.sqs_client')
+def test_ndjson_batch_over_limit_is_rejected_while_streaming(mock_sqs_client):
+    read = []
+
+    async def stream():
+        for index in range(10):
+            read.append(index)
+            yield b'{"to": "a@example.com"}\n{"to": "b@example.com"}\n'
+
+    async def collect():
+        return [line async for line in iter_ndjson_lines(stream(), max_items=3)]
+
+    with pytest.raises(BatchTooLargeError):
+        asyncio.run(collect())
+    assert read == [0, 1]
+
+    with patch('app.api.email_routes.BULK_MAX_ITEMS', 3), pytest.raises(HTTPException) as error:
+        client.post("/send-email/batch", content="{}\n" * 4, headers={"Content-Type": "application/x-ndjson"})
+    assert error.value.status_code == 413
+    mock_sqs_client.send_message_batch.assert_not_called()
+
+
+def test_producer_coalesces_concurrent_sends():
+    sqs = MagicMock()
+
+    def partial_failure(QueueUrl, Entries):
+        # El mensaje "bad" es rechazado por SQS
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in Entries if entry["MessageBody"] != "bad"],
+            "Failed": [{"Id": entry["Id"], "Code": "InvalidMessageContents", "Message": "rechazado"}
+                       for entry in Entries if entry["MessageBody"] == "bad"],
+        }
+
+    sqs.send_message_batch.side_effect = partial_failure
+    producer = SQSBatchProducer(lambda: sqs, "queue-url", max_linger=0.05, max_batch_size=10)
+
+    async def send_all():
+        bodies = [f"msg-{i}" for i in range(14)] + ["bad"]
+        return await asyncio.gather(*(producer.send(body) for body in bodies), return_exceptions=True)
+
+    results = asyncio.run(send_all())
+
+    # 15 envíos concurrentes se agrupan en 2 llamadas y sólo el mensaje rechazado falla
+    assert sqs.send_message_batch.call_count == 2
+    assert results[:14] == [None] * 14
+    assert isinstance(results[14], RuntimeError)
+
+
+# Si no se puede crear el cliente de SQS, todos los envíos del lote fallan en lugar de quedar esperando
+def test_producer_fails_every_send_when_the_client_cannot_be_created():
+    def broken_client():
+        raise RuntimeError("Credenciales inválidas")
+
+    producer = SQSBatchProducer(broken_client, "queue-url", max_linger=0.01, max_batch_size=10)
+
+    async def send_all():
+        sends = asyncio.gather(*(producer.send(f"msg-{i}") for i in range(3)), return_exceptions=True)
+        return await asyncio.wait_for(sends, timeout=5)
+
+    results = asyncio.run(send_all())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert all("Credenciales inválidas" in str(result) for result in results)
@@ -0,0 +1,187 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from app.workers.sqs_consumer import SQSConsumer
+
+class FakeSQS:
+    """
+    Cola en memoria con la parte de la API de SQS que usa el consumidor.
+    """
+
+    def __init__(self, bodies):
+        self.messages = {f"rh-{i}": {"MessageId": f"m-{i}", "ReceiptHandle": f"rh-{i}", "Body": body} for i, body in enumerate(bodies)}
+        self.received = set()
+        self.lock = threading.Lock()
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds, **kwargs):
+        with self.lock:
+            available = [m for rh, m in self.messages.items() if rh not in self.received][:MaxNumberOfMessages]
+            self.received.update(m["ReceiptHandle"] for m in available)
+        if not available:
+            time.sleep(0.01)
+        return {"Messages": available}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        with self.lock:
+            for entry in Entries:
+                self.messages.pop(entry["ReceiptHandle"])
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+# Los mensajes exitosos se confirman en lote y los fallidos quedan en la cola para reentregarse
+def test_consumer_deletes_successes_and_leaves_failures():
+    sqs = FakeSQS([f"correo {i}" for i in range(25)])
+    processed = []
+
+    def process(records, deadline):
+        processed.extend(record["body"] for record in records)
+        return [index for index, record in enumerate(records) if record["body"] == "correo 7"]
+
+    consumer = SQSConsumer(sqs, lanes=["transactional"], process=process, prefetch=20, concurrency=2, wait_time=0)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    wait_for(lambda: len(processed) == 25)
+    consumer.stop()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert sorted(processed) == sorted(f"correo {i}" for i in range(25))
+    assert [m["Body"] for m in sqs.messages.values()] == ["correo 7"]
+
+# Mientras un lote se procesa, el heartbeat extiende la visibilidad de sus mensajes
+def test_heartbeat_extends_visibility_of_pending_messages():
+    sqs = MagicMock()
+    messages = [{"Messages": [{"MessageId": "m-1", "ReceiptHandle": "rh-1", "Body": "{}"}]}]
+    sqs.receive_message.side_effect = lambda **kwargs: messages.pop() if messages else time.sleep(0.01) or {}
+    sqs.delete_message_batch.return_value = {"Successful": [{"Id": "0"}]}
+    release = threading.Event()
+
+    def process(records, deadline):
+        release.wait(5)
+        return []
+
+    consumer = SQSConsumer(sqs, lanes=["transactional"], process=process, wait_time=0, visibility_timeout=30, heartbeat_interval=0.05)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    wait_for(lambda: sqs.change_message_visibility_batch.call_count >= 2)
+    release.set()
+    consumer.stop()
+    thread.join(timeout=5)
+
+    assert sqs.change_message_visibility_batch.call_args.kwargs["Entries"] == [{"Id": "0", "ReceiptHandle": "rh-1", "VisibilityTimeout": 30}]
+    sqs.delete_message_batch.assert_called_once()
+
+# Durante el drenado el heartbeat sigue esperando su intervalo entre extensiones
+def test_heartbeat_keeps_its_interval_while_draining():
+    sqs = MagicMock()
+    messages = [{"Messages": [{"MessageId": "m-1", "ReceiptHandle": "rh-1", "Body": "{}"}]}]
+    sqs.receive_message.side_effect = lambda **kwargs: messages.pop() if messages else time.sleep(0.01) or {}
+    sqs.delete_message_batch.return_value = {"Successful": [{"Id": "0"}]}
+    started, release = threading.Event(), threading.Event()
+
+    def process(records, deadline):
+        started.set()
+        release.wait(5)
+        return []
+
+    consumer = SQSConsumer(sqs, lanes=["transactional"], process=process, wait_time=0, heartbeat_interval=0.1, drain_timeout=5)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    started.wait(5)
+    consumer.stop()
+    time.sleep(0.5)
+    release.set()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert 1 <= sqs.change_message_visibility_batch.call_count <= 7
+
+# Pasado el drenado, lo que no se procesó y lo que un long polling reciba tarde vuelve a la cola
+def test_drain_releases_unprocessed_and_late_messages():
+    sqs = MagicMock()
+    late = threading.Event()
+    messages = [
+        {"Messages": [{"MessageId": "m-2", "ReceiptHandle": "rh-2", "Body": "{}"}]},
+        {"Messages": [{"MessageId": "m-1", "ReceiptHandle": "rh-1", "Body": "{}"}]},
+    ]
+
+    def receive_message(**kwargs):
+        if len(messages) == 1:
+            # El último long polling responde cuando el drenado ya terminó
+            late.wait(5)
+        return messages.pop() if messages else time.sleep(0.01) or {}
+
+    sqs.receive_message.side_effect = receive_message
+    sqs.delete_message_batch.return_value = {"Successful": [{"Id": "0"}]}
+    started, release = threading.Event(), threading.Event()
+    processed = []
+
+    def process(records, deadline):
+        processed.extend(record["messageId"] for record in records)
+        started.set()
+        release.wait(5)
+        return []
+
+    consumer = SQSConsumer(sqs, lanes=["transactional"], process=process, concurrency=1, wait_time=0,
+                           heartbeat_interval=5, drain_timeout=0.1)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    started.wait(5)
+    consumer.stop()
+    time.sleep(0.3)
+    release.set()
+    thread.join(timeout=5)
+    late.set()
+
+    def released():
+        return [
+            entry for call in sqs.change_message_visibility_batch.call_args_list
+            for entry in call.kwargs["Entries"] if entry["VisibilityTimeout"] == 0
+        ]
+
+    wait_for(lambda: len(released()) == 1)
+    assert not thread.is_alive()
+    assert processed == ["m-1"]
+    assert released() == [{"Id": "0", "ReceiptHandle": "rh-2", "VisibilityTimeout": 0}]
+
+# Con una cola por carril, cada poller llena sólo la parte del prefetch que le da el peso de su carril
+def test_prefetch_is_shared_between_lane_queues_by_weight():
+    counter = iter(range(10_000))
+
+    def receive_message(QueueUrl, MaxNumberOfMessages, **kwargs):
+        return {"Messages": [
+            {"MessageId": f"{QueueUrl}-{n}", "ReceiptHandle": f"{QueueUrl}-{n}", "Body": "{}"}
+            for n in (next(counter) for _ in range(MaxNumberOfMessages))
+        ]}
+
+    sqs = MagicMock()
+    sqs.receive_message.side_effect = receive_message
+    release = threading.Event()
+
+    def process(records, deadline):
+        release.wait(5)
+        return list(range(len(records)))
+
+    with patch('app.workers.sqs_consumer.lane_queue_url', side_effect=lambda lane: f"https://sqs/{lane}"):
+        consumer = SQSConsumer(sqs, lanes=["transactional", "bulk"], process=process, prefetch=100, concurrency=1,
+                               wait_time=0, heartbeat_interval=5, drain_timeout=0)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    wait_for(lambda: len(consumer._pending) == 100)
+    time.sleep(0.1)
+    queued = list(consumer._pending.values())
+    consumer.stop()
+    release.set()
+    thread.join(timeout=5)
+
+    # Pesos 4 y 1 de PRIORITY_LANES
+    assert queued.count("https://sqs/transactional") == 80
+    assert queued.count("https://sqs/bulk") == 20
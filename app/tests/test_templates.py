@@ -0,0 +1,60 @@
+import pytest
+from unittest.mock import patch
+from app.core.circuit_breaker import ConcurrentCircuitBreaker
+from app.models import EmailRequest
+from app.services.email_service import EmailService
+from app.services.templates import CompiledTemplate, TemplateStore
+
+def latency_stats(latency=0.2):
+    return {"n": 10, "ewma": latency, "p50": latency, "p95": latency, "p99": latency}
+
+def routing_snapshot():
+    return {
+        provider_name: {"usage": 0, "healthy": True, "latency": latency_stats(), "tokens": float('inf')}
+        for provider_name in ("SendGrid", "Amazon SES")
+    }
+
+# La plantilla se compila una vez y se lee de Redis sólo cuando no está en la caché
+@patch('app.services.templates.RedisHandler')
+def test_template_store_compiles_and_caches(mock_redis):
+    mock_redis.get_template.return_value = {
+        "subject": "Pedido $order_id",
+        "body": "<p>Hola ${name}, total: $$${total}</p>",
+        "provider_templates": "{}",
+    }
+    store = TemplateStore(cache_size=2)
+
+    for _ in range(3):
+        subject, body = store.get("pedido").render({"order_id": 7, "name": "<Ana>", "total": "10"})
+
+    mock_redis.get_template.assert_called_once_with("pedido", store.key)
+    assert subject == "Pedido 7"
+    assert body == "<p>Hola &lt;Ana&gt;, total: $10</p>"
+    with pytest.raises(ValueError):
+        store.get("pedido").render({"order_id": 7})
+
+# El correo con plantilla se renderiza antes del envío, salvo que el proveedor tenga la plantilla nativa
+@patch('app.services.email_service.RedisHandler')
+@patch('app.services.email_service.SendGridService.send_template_email')
+@patch('app.services.email_service.SendGridService.send_email')
+def test_send_email_renders_template_or_uses_native_one(mock_send_email, mock_send_template_email, mock_redis):
+    templates = TemplateStore()
+    templates._remember("bienvenida", CompiledTemplate("Hola $name", "<h1>Bienvenido, $name</h1>"))
+    templates._remember("nativa", CompiledTemplate("Hola $name", "<h1>$name</h1>", {"SendGrid": "d-123"}))
+    service = EmailService(templates=templates)
+    service.circuit_breakers = {
+        provider_name: ConcurrentCircuitBreaker(fail_max=3, reset_timeout=60)
+        for provider_name, _ in service.providers
+    }
+    service.rate_limits = {}
+    mock_redis.get_routing_snapshot.return_value = routing_snapshot()
+    mock_redis.record_send_outcome.return_value = (1, latency_stats())
+
+    assert service.send_email(EmailRequest(to="ana@example.com", template_id="bienvenida", template_vars={"name": "Ana"})) == "SendGrid"
+    assert mock_send_email.call_args.kwargs["subject"] == "Hola Ana"
+    assert mock_send_email.call_args.kwargs["body"] == "<h1>Bienvenido, Ana</h1>"
+
+    service.send_email(EmailRequest(to="ana@example.com", template_id="nativa", template_vars={"name": "Ana"}))
+    mock_send_email.assert_called_once()
+    assert mock_send_template_email.call_args.kwargs["template_id"] == "d-123"
+    assert mock_send_template_email.call_args.kwargs["template_vars"] == {"name": "Ana"}
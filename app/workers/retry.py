@@ -0,0 +1,147 @@
+# workers/retry.py
+import logging
+import os
+import random
+from functools import cached_property
+import boto3
+from ..core.config import AWS_REGION, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, SQS_DEAD_LETTER_QUEUE_URL
+
+logger = logging.getLogger(__name__)
+
+# Atributo del mensaje de SQS con el número de intento (1 en el primer envío)
+ATTEMPT_ATTRIBUTE = "attempt"
+# Atributo con la clave de idempotencia del mensaje original, para que la copia reprogramada
+# se deduplique con ella y no con su nuevo messageId
+IDEMPOTENCY_ATTRIBUTE = "idempotency_key"
+
+# Destino de cada mensaje fallido
+RETRIED = "retried"
+DEAD_LETTERED = "dead_lettered"
+FAILED = "failed"
+
+# Máximo de entradas por SendMessageBatch y de caracteres del error que viaja a la cola de mensajes muertos
+SQS_BATCH_SIZE = 10
+MAX_ERROR_LENGTH = 1000
+
+
+def attempt_of(record: dict) -> int:
+    """
+    Número de intento de un registro de SQS (con el formato del evento de Lambda).
+    """
+    attribute = record.get('messageAttributes', {}).get(ATTEMPT_ATTRIBUTE) or {}
+    try:
+        return max(int(attribute.get('stringValue', 1)), 1)
+    except ValueError:
+        return 1
+
+
+def idempotency_key_of(record: dict) -> str:
+    """
+    Clave de idempotencia heredada de un mensaje reprogramado, o None en un mensaje original.
+    """
+    attribute = record.get('messageAttributes', {}).get(IDEMPOTENCY_ATTRIBUTE) or {}
+    return attribute.get('stringValue') or None
+
+
+def number_attribute(value: int) -> dict:
+    return {"DataType": "Number", "StringValue": str(value)}
+
+
+def string_attribute(value: str) -> dict:
+    return {"DataType": "String", "StringValue": value}
+
+
+class RetryScheduler:
+    """
+    Reprograma fuera del lote los mensajes que fallaron, en lugar de reintentarlos de inmediato.
+
+    Cada mensaje vuelve a su cola con el número de intento en el atributo attempt y un
+    DelaySeconds con backoff exponencial y jitter (la mitad fija y la otra mitad aleatoria,
+    con tope en max_delay), así una ráfaga de fallos no se convierte en una tormenta de
+    reintentos. Agotados los intentos, o si el mensaje no se puede reintentar, va a la cola de
+    mensajes muertos con el error. Si SQS no acepta la reprogramación, el mensaje queda como
+    fallido y SQS lo vuelve a entregar al vencer su visibilidad.
+    """
+
+    def __init__(self, dead_letter_queue_url: str = None, max_attempts: int = RETRY_MAX_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY, sqs_client=None) -> None:
+        self.dead_letter_queue_url = dead_letter_queue_url if dead_letter_queue_url is not None else os.getenv("SQS_DEAD_LETTER_QUEUE_URL", SQS_DEAD_LETTER_QUEUE_URL)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        if sqs_client is not None:
+            self.sqs = sqs_client
+
+    @cached_property
+    def sqs(self):
+        # Cliente creado en el primer fallo (arranque en frío)
+        return boto3.client('sqs', region_name=os.getenv("AWS_REGION", AWS_REGION))
+
+    def backoff(self, attempt: int) -> int:
+        """
+        Segundos de espera antes del intento attempt + 1.
+        """
+        cap = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return int(cap / 2 + random.uniform(0, cap / 2))
+
+    def reschedule(self, failures: list) -> dict:
+        """
+        Reprograma los fallos, dados como (índice, registro, error, cola del mensaje o None si
+        no se debe reintentar). Devuelve {índice: RETRIED, DEAD_LETTERED o FAILED}.
+        Un mensaje repetido en el lote (mismo messageId o receiptHandle) se reprograma una sola
+        vez y sus repeticiones corren la suerte de la primera.
+        """
+        outcomes = {}
+        batches = {}
+        firsts, repeats = {}, {}
+        for index, record, error, queue_url in failures:
+            message_key = record.get('messageId') or record.get('receiptHandle')
+            if message_key in firsts:
+                repeats[index] = firsts[message_key]
+                continue
+            if message_key:
+                firsts[message_key] = index
+            attempt = attempt_of(record)
+            idempotency_key = idempotency_key_of(record) or record.get('messageId')
+            carried = {IDEMPOTENCY_ATTRIBUTE: string_attribute(idempotency_key)} if idempotency_key else {}
+            if queue_url is not None and attempt < self.max_attempts:
+                entry = {
+                    "Id": str(index),
+                    "MessageBody": record['body'],
+                    "DelaySeconds": self.backoff(attempt),
+                    "MessageAttributes": {ATTEMPT_ATTRIBUTE: number_attribute(attempt + 1), **carried},
+                }
+                batches.setdefault((queue_url, RETRIED), []).append(entry)
+            elif self.dead_letter_queue_url:
+                entry = {
+                    "Id": str(index),
+                    "MessageBody": record['body'],
+                    "MessageAttributes": {
+                        ATTEMPT_ATTRIBUTE: number_attribute(attempt),
+                        "error": string_attribute(str(error)[:MAX_ERROR_LENGTH] or type(error).__name__),
+                        "source_message_id": string_attribute(record.get('messageId') or "desconocido"),
+                        **carried,
+                    },
+                }
+                batches.setdefault((self.dead_letter_queue_url, DEAD_LETTERED), []).append(entry)
+            else:
+                outcomes[index] = FAILED
+
+        for (queue_url, outcome), entries in batches.items():
+            for start in range(0, len(entries), SQS_BATCH_SIZE):
+                outcomes.update(self._send(queue_url, entries[start:start + SQS_BATCH_SIZE], outcome))
+        outcomes.update((index, outcomes[first]) for index, first in repeats.items())
+        return outcomes
+
+    def _send(self, queue_url: str, entries: list, outcome: str) -> dict:
+        try:
+            response = self.sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except Exception:
+            logger.exception("Error al reprogramar %d mensajes en %s", len(entries), queue_url)
+            return {int(entry["Id"]): FAILED for entry in entries}
+
+        outcomes = {int(entry["Id"]): outcome for entry in entries}
+        for failure in response.get("Failed", []):
+            logger.error("SQS no aceptó el mensaje reprogramado %s: %s", failure["Id"], failure.get("Message", ""))
+            outcomes[int(failure["Id"])] = FAILED
+        return outcomes
@@ -0,0 +1,51 @@
+# workers/scheduler.py
+import threading
+from collections import deque
+
+
+class WeightedFairScheduler:
+    """
+    Cola con un carril por prioridad que entrega el trabajo con round robin ponderado suave.
+
+    Mientras varios carriles tienen trabajo, cada uno recibe turnos en proporción a su peso
+    (con pesos 4 y 1, cuatro de cada cinco turnos son del primero); un carril sin competencia
+    usa todos los turnos. Dentro de un carril el orden es FIFO.
+    """
+
+    def __init__(self, weights: dict) -> None:
+        self.weights = weights
+        self._lock = threading.Lock()
+        self._lanes = {lane: deque() for lane in weights}
+        self._current_weights = {lane: 0 for lane in weights}
+
+    def put(self, lane: str, item) -> None:
+        with self._lock:
+            self._lanes[lane].append(item)
+
+    def get(self):
+        """
+        Devuelve (carril, elemento) del siguiente turno, o None si no hay trabajo.
+        """
+        with self._lock:
+            active = [lane for lane, items in self._lanes.items() if items]
+            if not active:
+                return None
+            total_weight = sum(self.weights[lane] for lane in active)
+            for lane in active:
+                self._current_weights[lane] += self.weights[lane]
+            lane = max(active, key=lambda name: self._current_weights[name])
+            self._current_weights[lane] -= total_weight
+            return lane, self._lanes[lane].popleft()
+
+    def drain(self) -> list:
+        """
+        Saca todo el trabajo pendiente en el orden de los turnos.
+        """
+        scheduled = []
+        while (entry := self.get()) is not None:
+            scheduled.append(entry)
+        return scheduled
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(items) for items in self._lanes.values())
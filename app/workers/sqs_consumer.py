@@ -0,0 +1,320 @@
+# workers/sqs_consumer.py
+"""
+Consumidor de SQS de larga duración para correr los workers en servidores propios.
+
+Uso:
+    python -m app.workers.sqs_consumer --processes 2 --lanes transactional bulk
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import boto3
+from ..core.config import (
+    AWS_REGION, PRIORITY_LANES, CONSUMER_PROCESSES, CONSUMER_WAIT_TIME_SECONDS, CONSUMER_PREFETCH_MESSAGES,
+    CONSUMER_BATCH_CONCURRENCY, CONSUMER_VISIBILITY_TIMEOUT, CONSUMER_HEARTBEAT_INTERVAL, CONSUMER_DRAIN_TIMEOUT,
+    SEND_DEADLINE_SECONDS
+)
+from ..core.deadline import Deadline
+from ..core.lanes import lane_queue_url
+from .scheduler import WeightedFairScheduler
+from .sqs_worker import process_records
+
+logger = logging.getLogger(__name__)
+
+# Máximo de mensajes por ReceiveMessage y de entradas por llamada *Batch de SQS
+SQS_MAX_MESSAGES = 10
+
+
+def to_record(message: dict) -> dict:
+    """
+    Convierte un mensaje de ReceiveMessage al formato de registro del evento de Lambda.
+    """
+    return {
+        "messageId": message["MessageId"],
+        "receiptHandle": message["ReceiptHandle"],
+        "body": message["Body"],
+        "attributes": message.get("Attributes", {}),
+        "messageAttributes": {
+            name: {"stringValue": value.get("StringValue"), "dataType": value.get("DataType")}
+            for name, value in message.get("MessageAttributes", {}).items()
+        },
+    }
+
+
+def chunks(items: list, size: int = SQS_MAX_MESSAGES) -> list:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class SQSConsumer:
+    """
+    Consume las colas de los carriles con long polling y procesa los lotes con process_records.
+
+    Un hilo por cola recibe de a 10 mensajes mientras haya espacio en la parte del prefetch
+    (mensajes recibidos y aún no confirmados) que le toca según el peso de su carril, así un
+    carril con mucho tráfico no llena el búfer del otro. Los lotes recibidos esperan en un
+    WeightedFairScheduler y se procesan de a concurrency a la vez, con un deadline de
+    SEND_DEADLINE_SECONDS desde que se recibieron; los exitosos se confirman con
+    DeleteMessageBatch y los fallidos vuelven a la cola al vencer su visibilidad. Un heartbeat
+    extiende la visibilidad de los mensajes pendientes para que un envío lento no provoque una
+    reentrega.
+
+    stop() deja de recibir y termina de procesar lo ya recibido; pasado drain_timeout, lo que
+    aún no empezó se devuelve a la cola, igual que lo que un long polling en curso reciba
+    después.
+    """
+
+    def __init__(self, sqs_client=None, lanes=tuple(PRIORITY_LANES), process=process_records,
+                 prefetch: int = CONSUMER_PREFETCH_MESSAGES, concurrency: int = CONSUMER_BATCH_CONCURRENCY,
+                 wait_time: int = CONSUMER_WAIT_TIME_SECONDS, visibility_timeout: int = CONSUMER_VISIBILITY_TIMEOUT,
+                 heartbeat_interval: float = CONSUMER_HEARTBEAT_INTERVAL, drain_timeout: float = CONSUMER_DRAIN_TIMEOUT) -> None:
+        self.sqs = sqs_client or boto3.client('sqs', region_name=os.getenv("AWS_REGION", AWS_REGION))
+        self.process = process
+        self.prefetch = max(prefetch, SQS_MAX_MESSAGES)
+        self.concurrency = concurrency
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.drain_timeout = drain_timeout
+
+        # Una cola por carril; los carriles que comparten cola se consumen una sola vez
+        self.queues = {}
+        for lane in lanes:
+            self.queues.setdefault(lane_queue_url(lane), lane)
+        self.scheduler = WeightedFairScheduler({lane: PRIORITY_LANES[lane] for lane in self.queues.values()})
+        # Parte del prefetch de cada cola, en proporción al peso de su carril
+        total_weight = sum(self.scheduler.weights.values())
+        self.prefetch_shares = {
+            queue_url: max(SQS_MAX_MESSAGES, self.prefetch * PRIORITY_LANES[lane] // total_weight)
+            for queue_url, lane in self.queues.items()
+        }
+
+        self._stopping = threading.Event()
+        # El heartbeat sigue durante el drenado y se detiene cuando run() termina
+        self._heartbeat_stopped = threading.Event()
+        self._condition = threading.Condition()
+        # Mensajes recibidos y no confirmados: receipt handle -> cola
+        self._pending = {}
+        # Terminado el drenado, lo que se reciba vuelve a la cola sin procesarse
+        self._released = False
+
+    def stop(self) -> None:
+        """
+        Deja de recibir mensajes; run() vuelve cuando termina el drenado.
+        """
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def run(self) -> None:
+        pollers = [
+            threading.Thread(target=self._poll, args=(queue_url, lane), name=f"sqs-poller-{lane}", daemon=True)
+            for queue_url, lane in self.queues.items()
+        ]
+        heartbeat = threading.Thread(target=self._heartbeat, name="sqs-heartbeat", daemon=True)
+        for thread in (*pollers, heartbeat):
+            thread.start()
+
+        slots = threading.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            deadline = None
+            while True:
+                if self._stopping.is_set() and deadline is None:
+                    logger.info("Drenando el consumidor de SQS (%d mensajes pendientes)", len(self._pending))
+                    deadline = time.monotonic() + self.drain_timeout
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+
+                # Un lote sólo sale del scheduler cuando hay un hueco, así el reparto por carril se respeta
+                if not slots.acquire(timeout=0.1):
+                    continue
+                entry = self.scheduler.get()
+                if entry is None:
+                    slots.release()
+                    if self._stopping.is_set() and not any(poller.is_alive() for poller in pollers) and not self._pending:
+                        break
+                    with self._condition:
+                        self._condition.wait(timeout=0.1)
+                    continue
+
+                _, (queue_url, records, send_deadline) = entry
+                future = pool.submit(self._process_batch, queue_url, records, send_deadline)
+                future.add_done_callback(lambda _: slots.release())
+
+        # Los lotes en curso ya terminaron: lo que sigue pendiente no se llegó a procesar
+        self._release_unprocessed()
+        self._stopping.set()
+        self._heartbeat_stopped.set()
+        heartbeat.join()
+        logger.info("Consumidor de SQS detenido")
+
+    def _poll(self, queue_url: str, lane: str) -> None:
+        while not self._stopping.is_set():
+            with self._condition:
+                while not self._has_room(queue_url) and not self._stopping.is_set():
+                    self._condition.wait(timeout=1.0)
+            if self._stopping.is_set():
+                return
+
+            try:
+                response = self.sqs.receive_message(
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=SQS_MAX_MESSAGES,
+                    WaitTimeSeconds=self.wait_time,
+                    VisibilityTimeout=self.visibility_timeout,
+                    AttributeNames=["SentTimestamp", "ApproximateReceiveCount"],
+                    MessageAttributeNames=["All"]
+                )
+            except Exception:
+                logger.exception("Error al recibir mensajes de %s", queue_url)
+                self._stopping.wait(1.0)
+                continue
+
+            records = [to_record(message) for message in response.get("Messages", [])]
+            if not records:
+                continue
+            deadline = Deadline.after(SEND_DEADLINE_SECONDS)
+            with self._condition:
+                released = self._released
+                if not released:
+                    self._pending.update((record["receiptHandle"], queue_url) for record in records)
+                    self.scheduler.put(lane, (queue_url, records, deadline))
+                    self._condition.notify_all()
+            if released:
+                logger.warning("Devolviendo %d mensajes recibidos tras el drenado a %s", len(records), queue_url)
+                self._change_visibility([record["receiptHandle"] for record in records], queue_url, 0)
+
+    def _has_room(self, queue_url: str) -> bool:
+        """
+        Indica si caben otros 10 mensajes de la cola en su parte del prefetch y en el total.
+        """
+        queued = sum(1 for pending_queue_url in self._pending.values() if pending_queue_url == queue_url)
+        return (queued + SQS_MAX_MESSAGES <= self.prefetch_shares[queue_url]
+                and len(self._pending) + SQS_MAX_MESSAGES <= self.prefetch)
+
+    def _process_batch(self, queue_url: str, records: list, deadline: Deadline) -> None:
+        try:
+            failed = set(self.process(records, deadline))
+        except Exception:
+            logger.exception("Error al procesar un lote de %d mensajes", len(records))
+            failed = set(range(len(records)))
+
+        try:
+            self._delete([record for index, record in enumerate(records) if index not in failed], queue_url)
+        finally:
+            # Los fallidos dejan de extenderse y SQS los vuelve a entregar al vencer su visibilidad
+            self._forget(records)
+
+    def _delete(self, records: list, queue_url: str) -> None:
+        for chunk in chunks(records):
+            try:
+                response = self.sqs.delete_message_batch(
+                    QueueUrl=queue_url,
+                    Entries=[{"Id": str(index), "ReceiptHandle": record["receiptHandle"]} for index, record in enumerate(chunk)]
+                )
+            except Exception:
+                logger.exception("Error al confirmar %d mensajes en %s", len(chunk), queue_url)
+                continue
+            for failure in response.get("Failed", []):
+                logger.error("SQS no confirmó el mensaje %s: %s", chunk[int(failure["Id"])]["messageId"], failure.get("Message", ""))
+
+    def _forget(self, records: list) -> None:
+        with self._condition:
+            for record in records:
+                self._pending.pop(record["receiptHandle"], None)
+            self._condition.notify_all()
+
+    def _change_visibility(self, receipt_handles: list, queue_url: str, timeout: int) -> None:
+        for chunk in chunks(receipt_handles):
+            try:
+                self.sqs.change_message_visibility_batch(
+                    QueueUrl=queue_url,
+                    Entries=[
+                        {"Id": str(index), "ReceiptHandle": receipt_handle, "VisibilityTimeout": timeout}
+                        for index, receipt_handle in enumerate(chunk)
+                    ]
+                )
+            except Exception:
+                logger.exception("Error al cambiar la visibilidad de %d mensajes en %s", len(chunk), queue_url)
+
+    def _heartbeat(self) -> None:
+        """
+        Extiende la visibilidad de todos los mensajes recibidos y aún no confirmados.
+        """
+        while not self._heartbeat_stopped.wait(self.heartbeat_interval):
+            with self._condition:
+                by_queue = {}
+                for receipt_handle, queue_url in self._pending.items():
+                    by_queue.setdefault(queue_url, []).append(receipt_handle)
+            for queue_url, receipt_handles in by_queue.items():
+                self._change_visibility(receipt_handles, queue_url, self.visibility_timeout)
+
+    def _release_unprocessed(self) -> None:
+        """
+        Devuelve a la cola, con visibilidad 0, los mensajes pendientes que no se llegaron a
+        procesar durante el drenado. Desde aquí los pollers devuelven lo que reciban.
+        """
+        with self._condition:
+            self._released = True
+            self.scheduler.drain()
+            by_queue = {}
+            for receipt_handle, queue_url in self._pending.items():
+                by_queue.setdefault(queue_url, []).append(receipt_handle)
+            self._pending.clear()
+            self._condition.notify_all()
+        for queue_url, receipt_handles in by_queue.items():
+            logger.warning("Devolviendo %d mensajes sin procesar a %s", len(receipt_handles), queue_url)
+            self._change_visibility(receipt_handles, queue_url, 0)
+
+
+def run_consumer(lanes: Optional[list] = None) -> None:
+    """
+    Corre un consumidor en este proceso hasta recibir SIGTERM o SIGINT.
+    """
+    consumer = SQSConsumer(lanes=lanes or tuple(PRIORITY_LANES))
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: consumer.stop())
+    logger.info("Consumidor de SQS iniciado (pid %d, colas %s)", os.getpid(), list(consumer.queues))
+    consumer.run()
+
+
+def run_processes(processes: int, lanes: Optional[list] = None) -> None:
+    """
+    Corre processes consumidores en procesos separados y les reenvía SIGTERM y SIGINT.
+    """
+    if processes <= 1:
+        run_consumer(lanes)
+        return
+
+    # spawn: cada proceso crea sus propios hilos y clientes en lugar de heredarlos
+    context = multiprocessing.get_context("spawn")
+    children = [context.Process(target=run_consumer, args=(lanes,), name=f"sqs-consumer-{index}") for index in range(processes)]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, forward)
+    for child in children:
+        child.join()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Consumidor de SQS del servicio de correo.")
+    parser.add_argument("--processes", type=int, default=CONSUMER_PROCESSES)
+    parser.add_argument("--lanes", nargs="+", choices=list(PRIORITY_LANES), default=list(PRIORITY_LANES))
+    args = parser.parse_args(argv)
+    run_processes(args.processes, args.lanes)
+
+
+if __name__ == "__main__":
+    main()
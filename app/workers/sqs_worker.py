@@ -1,16 +1,243 @@
-import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ..models import EmailRequest
 from ..services.email_service import EmailService
+from ..core.config import WORKER_MAX_CONCURRENCY, BULK_MIN_GROUP_SIZE, PRIORITY_LANES, SEND_DEADLINE_SECONDS
+from ..core.metrics import metrics, lambda_metrics
+from ..core.logging_config import configure_logging, correlation_scope
+from ..core.idempotency import IdempotencyGuard, CLAIMED, SENT
+from ..core.exceptions import MessageInFlightError
+from ..core.claim_check import claim_check
+from ..core.lanes import lane_of, lane_queue_url
+from ..core.deadline import Deadline
+from .scheduler import WeightedFairScheduler
+from .retry import RetryScheduler, idempotency_key_of, RETRIED, DEAD_LETTERED, FAILED
 
-email_service = EmailService()
+configure_logging()
+logger = logging.getLogger(__name__)
 
-def process_email_queue(event, context) -> None:
+# EmailService se crea en la primera invocación y se reutiliza en las siguientes del contenedor
+email_service = None
+email_service_lock = threading.Lock()
+
+# Pool reutilizado entre invocaciones de un mismo contenedor Lambda
+executor = ThreadPoolExecutor(max_workers=WORKER_MAX_CONCURRENCY)
+
+# Deduplicación de mensajes; su filtro local se conserva entre invocaciones del contenedor
+idempotency_guard = IdempotencyGuard()
+
+# Reintentos diferidos y cola de mensajes muertos para los envíos fallidos
+retry_scheduler = RetryScheduler()
+
+
+def get_email_service() -> EmailService:
+    """
+    Devuelve el EmailService del contenedor, creándolo la primera vez.
+    """
+    global email_service
+    if email_service is None:
+        with email_service_lock:
+            if email_service is None:
+                email_service = EmailService()
+    return email_service
+
+
+def send_single(email_data: EmailRequest, message_id: str = None, deadline: Deadline = None) -> list:
+    """
+    Envía un correo antes de deadline y devuelve [(duración, error)]. Los logs del envío llevan el messageId.
+    """
+    # El contexto no se hereda en los hilos del pool, así que se fija aquí
+    with correlation_scope(message_id):
+        start_time = time.perf_counter()
+        try:
+            provider_name = get_email_service().send_email(email_data, deadline=deadline)
+            logger.info("Correo enviado con éxito usando %s", provider_name)
+            return [(time.perf_counter() - start_time, None)]
+        except Exception as e:
+            return [(time.perf_counter() - start_time, e)]
+
+
+def send_group(emails: list, message_ids: list = (), deadline: Deadline = None) -> list:
     """
-    Procesa los correos encolados y los envía.
+    Envía un grupo de correos con contenido idéntico por la API masiva de los proveedores.
+    Devuelve (duración, error) por correo; la duración del grupo se reparte entre sus correos.
     """
-    for record in event['Records']:
-        email_data = json.loads(record['body'])
+    with correlation_scope(",".join(filter(None, message_ids)) or None):
+        start_time = time.perf_counter()
         try:
-            email_service.send_email(email_data)
-            print(f"Correo enviado con éxito: {email_data}")
+            results = get_email_service().send_bulk(emails, deadline)
         except Exception as e:
-            print(f"Error al enviar el correo: {e}")
+            results = [e] * len(emails)
+        elapsed = (time.perf_counter() - start_time) / len(emails)
+        logger.info("Grupo de %d correos idénticos enviado por la API masiva", len(emails))
+    return [(elapsed, result if isinstance(result, Exception) else None) for result in results]
+
+
+def parse_records(records: list) -> tuple:
+    """
+    Valida los registros, resolviendo los cuerpos guardados en el blob store.
+    Devuelve ({índice: EmailRequest}, {índice: error de validación o de lectura}).
+    """
+    emails, invalid = {}, {}
+    for index, record in enumerate(records):
+        try:
+            emails[index] = EmailRequest(**claim_check.load(record['body']))
+        except Exception as e:
+            invalid[index] = e
+    return emails, invalid
+
+
+def claim_records(records: list, emails: dict) -> tuple:
+    """
+    Reserva la clave de idempotencia de cada correo (la del cliente, la heredada por un mensaje
+    reprogramado o el messageId de SQS) y quita de emails los que no hay que enviar. Devuelve (claves reservadas por índice,
+    resultados de los descartados, copias dentro del lote por índice del original).
+    """
+    keys = {
+        index: email_data.idempotency_key or idempotency_key_of(records[index]) or records[index].get('messageId')
+        for index, email_data in emails.items()
+    }
+    keys = {index: key for index, key in keys.items() if key}
+    statuses = idempotency_guard.claim(list(keys.values()))
+
+    claimed, skipped, copies = {}, {}, {}
+    owners = {}
+    for index, key in keys.items():
+        if key in owners:
+            # Misma clave dos veces en el lote: la copia corre la suerte del original
+            copies[index] = owners[key]
+        elif statuses[key] == CLAIMED:
+            owners[key] = index
+            claimed[index] = key
+            continue
+        elif statuses[key] == SENT:
+            skipped[index] = (0.0, None)
+        else:
+            skipped[index] = (0.0, MessageInFlightError(f"El mensaje {key} se está enviando en otra instancia."))
+        del emails[index]
+    return claimed, skipped, copies
+
+
+def group_records(emails: dict) -> list:
+    """
+    Agrupa los correos de contenido idéntico del mismo carril. Devuelve grupos de (índice, EmailRequest).
+    """
+    groups = {}
+    for index, email_data in emails.items():
+        groups.setdefault((email_data.priority, email_data.content_key()), []).append((index, email_data))
+    return list(groups.values())
+
+
+def observe_queue_age(records: list, emails: dict) -> None:
+    """
+    Registra por carril cuánto esperó cada mensaje en la cola (desde SentTimestamp de SQS).
+    """
+    now = time.time()
+    for index, email_data in emails.items():
+        sent_timestamp = records[index].get('attributes', {}).get('SentTimestamp')
+        if sent_timestamp:
+            metrics.observe("worker_queue_age_seconds", max(now - int(sent_timestamp) / 1000, 0.0), lane=lane_of(email_data.priority))
+
+
+@lambda_metrics("process_email_queue")
+def process_email_queue(event, context) -> dict:
+    """
+    Procesa los correos encolados en paralelo y reporta a SQS sólo los mensajes fallidos que
+    no se pudieron reprogramar.
+    """
+    records = event['Records']
+    # Los envíos deben terminar antes de que Lambda corte la invocación y sin pasarse del
+    # presupuesto configurado, aunque la invocación tenga un timeout largo
+    deadline = Deadline.after(SEND_DEADLINE_SECONDS).earliest(Deadline.from_lambda_context(context))
+    failed = process_records(records, deadline)
+
+    # Con ReportBatchItemFailures, SQS sólo vuelve a entregar estos mensajes
+    return {"batchItemFailures": [{"itemIdentifier": records[index].get('messageId')} for index in failed]}
+
+
+def process_records(records: list, deadline: Deadline = None) -> list:
+    """
+    Procesa un lote de registros de SQS (con el formato del evento de Lambda) y devuelve los
+    índices de los mensajes fallidos. La usan el handler de Lambda y el consumidor sqs_consumer.
+    Todos los envíos del lote comparten deadline (SEND_DEADLINE_SECONDS desde ahora si no se indica).
+    Los fallidos se reprograman con retry_scheduler; sólo se devuelven los que no se pudieron
+    reprogramar, para que SQS los vuelva a entregar.
+    """
+    batch_start = time.perf_counter()
+    deadline = deadline or Deadline.after(SEND_DEADLINE_SECONDS)
+
+    to_send, invalid = parse_records(records)
+    parsed = dict(to_send)
+    results = {index: (0.0, error) for index, error in invalid.items()}
+    observe_queue_age(records, to_send)
+
+    # Los duplicados se descartan antes del enrutamiento
+    claimed, skipped, copies = claim_records(records, to_send)
+    results.update(skipped)
+
+    # El pool toma los envíos en orden, así que se encolan por turnos ponderados de carril
+    scheduler = WeightedFairScheduler(PRIORITY_LANES)
+    for group in group_records(to_send):
+        lane = lane_of(group[0][1].priority)
+        if len(group) >= BULK_MIN_GROUP_SIZE:
+            scheduler.put(lane, group)
+        else:
+            for entry in group:
+                scheduler.put(lane, [entry])
+
+    futures = []
+    for _, group in scheduler.drain():
+        indexes = [index for index, _ in group]
+        emails = [email_data for _, email_data in group]
+        message_ids = [records[index].get('messageId') for index in indexes]
+        if len(group) >= BULK_MIN_GROUP_SIZE:
+            futures.append((indexes, executor.submit(send_group, emails, message_ids, deadline)))
+        else:
+            futures.append((indexes, executor.submit(send_single, emails[0], message_ids[0], deadline)))
+
+    for indexes, future in futures:
+        results.update(zip(indexes, future.result()))
+    results.update((index, results[original]) for index, original in copies.items())
+    duplicates = sum(1 for index in (*skipped, *copies) if results[index][1] is None)
+    if duplicates:
+        logger.info("%d mensajes duplicados descartados", duplicates)
+
+    idempotency_guard.complete(
+        sent=[key for index, key in claimed.items() if results[index][1] is None],
+        failed=[key for index, key in claimed.items() if results[index][1] is not None]
+    )
+
+    failures, in_flight = [], []
+    sequential_time = 0.0
+    for index, record in enumerate(records):
+        elapsed, error = results[index]
+        sequential_time += elapsed
+        if isinstance(error, MessageInFlightError):
+            # Otra instancia lo está enviando: reprogramarlo lo enviaría dos veces. SQS lo vuelve
+            # a entregar al vencer su visibilidad y para entonces ya figurará como enviado
+            logger.warning("El correo %s se está enviando en otra instancia; se devuelve a SQS", record.get('messageId'))
+            in_flight.append(index)
+        elif error is not None:
+            logger.error("Error al enviar el correo %s: %s", record.get('messageId'), error)
+            # Un mensaje inválido no se reintenta: va directo a la cola de mensajes muertos
+            queue_url = lane_queue_url(lane_of(parsed[index].priority)) if index in parsed else None
+            failures.append((index, record, error, queue_url))
+
+    outcomes = retry_scheduler.reschedule(failures) if failures else {}
+    outcomes.update((index, FAILED) for index in in_flight)
+    failed = sorted(index for index, outcome in outcomes.items() if outcome == FAILED)
+
+    batch_time = time.perf_counter() - batch_start
+    metrics.observe("worker_batch_seconds", batch_time)
+    metrics.increment("worker_messages_total", len(records) - len(outcomes) - duplicates, outcome="sent")
+    metrics.increment("worker_messages_total", duplicates, outcome="duplicate")
+    for outcome in (RETRIED, DEAD_LETTERED, FAILED):
+        metrics.increment("worker_messages_total", sum(1 for value in outcomes.values() if value == outcome), outcome=outcome)
+    speedup = sequential_time / batch_time if batch_time > 0 else 1.0
+    logger.info(
+        "Lote de %d mensajes procesado en %.3fs (secuencial estimado %.3fs, aceleración x%.1f, fallidos %d, reprogramados %d)",
+        len(records), batch_time, sequential_time, speedup, len(outcomes), len(outcomes) - len(failed)
+    )
+    return failed
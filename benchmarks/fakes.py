@@ -0,0 +1,103 @@
+# benchmarks/fakes.py
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fakeredis
+import redis
+
+
+class CountingRedis(fakeredis.FakeStrictRedis):
+    """
+    Redis en memoria que cuenta los viajes de red que haría el cliente real:
+    cada comando o script es un viaje y cada pipeline ejecutado también.
+    """
+
+    round_trips = 0
+    _count_lock = threading.Lock()
+
+    def execute_command(self, *args, **options):
+        self._count()
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            self._count()
+            return execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    def _count(self) -> None:
+        with CountingRedis._count_lock:
+            CountingRedis.round_trips += 1
+
+
+def install_fake_redis() -> CountingRedis:
+    """
+    Hace que el redis_client de la aplicación sea un CountingRedis. Debe llamarse
+    antes de importar los módulos de app.
+    """
+    client = CountingRedis(decode_responses=True)
+    redis.StrictRedis.from_url = classmethod(lambda cls, *args, **kwargs: client)
+    return client
+
+
+class FakeSendGridServer:
+    """
+    Servidor HTTP local que imita POST /v3/mail/send de SendGrid con latencia y tasa de error configurables.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeSendGridServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_response(self) -> tuple:
+        with self._lock:
+            self.requests += 1
+            delay = max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0.0)
+            failed = self._rng.random() < self.error_rate
+        return delay, (500 if failed else 202)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                delay, status = fake._next_response()
+                time.sleep(delay)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,302 @@
+# benchmarks/run.py
+"""
+Benchmarks del camino de envío, del worker de SQS y de la API de ingesta, sin servicios externos:
+Redis en memoria (fakeredis), un servidor local que imita a SendGrid y moto para SES y SQS.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.run --messages 500 --output resultados.json
+    python -m benchmarks.run --compare base.json resultados.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import boto3
+import httpx
+from moto import mock_aws
+
+from .fakes import CountingRedis, FakeSendGridServer, install_fake_redis
+
+AWS_REGION = "us-east-2"
+FROM_EMAIL = "benchmark@example.com"
+
+# Métricas que compara --compare y si un valor mayor es mejor
+COMPARED_METRICS = {
+    "send_email.latency_ms.p50": False,
+    "send_email.latency_ms.p95": False,
+    "send_email.latency_ms.p99": False,
+    "send_email.redis_round_trips_per_message": False,
+    "worker.messages_per_second": True,
+    "worker.batch_ms.p95": False,
+    "worker.redis_round_trips_per_message": False,
+    "api.requests_per_second": True,
+    "api.latency_ms.p95": False,
+}
+
+
+def percentiles(samples: list) -> dict:
+    """
+    Resumen en milisegundos (mean, p50, p95, p99, max) de una lista de duraciones en segundos.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1] * 1000,
+    }
+
+
+def email_payload(index: int, duplicate_ratio: float = 0.0) -> dict:
+    """
+    Correo de prueba; con duplicate_ratio esa fracción de correos comparte el contenido.
+    """
+    shared = (index % 100) < duplicate_ratio * 100
+    return {
+        "to": f"user{index}@example.com",
+        "subject": "Benchmark" if shared else f"Benchmark {index}",
+        "body": "<p>Contenido del benchmark.</p>",
+        "from_email": FROM_EMAIL,
+    }
+
+
+def configure_environment(sendgrid_url: str) -> None:
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": AWS_REGION,
+        "AWS_REGION": AWS_REGION,
+        "SENDGRID_API_KEY": "SG.benchmark",
+        "SENDGRID_API_HOST": sendgrid_url,
+        "SES_EMAIL_FROM": FROM_EMAIL,
+    })
+
+
+def create_aws_resources(queue_url: str) -> None:
+    boto3.client("ses", region_name=AWS_REGION).verify_email_identity(EmailAddress=FROM_EMAIL)
+    boto3.client("sqs", region_name=AWS_REGION).create_queue(QueueName=queue_url.split("/")[-1])
+
+
+def unthrottled(provider_configs: list) -> list:
+    """
+    Misma configuración de proveedores con cuotas que no limitan el benchmark; el token
+    bucket se sigue consultando para que su costo quede medido.
+    """
+    return [
+        {**config, "rate": 1e9, "burst": 1e9} if "rate" in config else dict(config)
+        for config in provider_configs
+    ]
+
+
+def bench_send_email(email_service, messages: int) -> dict:
+    """
+    Latencia por mensaje de EmailService.send_email y viajes a Redis por mensaje.
+    """
+    from app.models import EmailRequest
+
+    latencies, providers, errors = [], {}, 0
+    round_trips = CountingRedis.round_trips
+    for index in range(messages):
+        email_data = EmailRequest(**email_payload(index))
+        start = time.perf_counter()
+        try:
+            provider_name = email_service.send_email(email_data)
+            providers[provider_name] = providers.get(provider_name, 0) + 1
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "messages": messages,
+        "errors": errors,
+        "providers": providers,
+        "latency_ms": percentiles(latencies),
+        "redis_round_trips_per_message": (CountingRedis.round_trips - round_trips) / messages,
+    }
+
+
+def bench_worker(sqs_worker, batches: int, batch_size: int, duplicate_ratio: float) -> dict:
+    """
+    Rendimiento de process_email_queue con lotes de SQS simulados.
+    """
+    batch_times, failures = [], 0
+    round_trips = CountingRedis.round_trips
+    for batch in range(batches):
+        records = [
+            {"messageId": f"{batch}-{index}", "body": json.dumps(email_payload(batch * batch_size + index, duplicate_ratio))}
+            for index in range(batch_size)
+        ]
+        start = time.perf_counter()
+        response = sqs_worker.process_email_queue({"Records": records}, None)
+        batch_times.append(time.perf_counter() - start)
+        failures += len(response["batchItemFailures"])
+
+    messages = batches * batch_size
+    return {
+        "messages": messages,
+        "batch_size": batch_size,
+        "duplicate_ratio": duplicate_ratio,
+        "failures": failures,
+        "messages_per_second": messages / sum(batch_times),
+        "batch_ms": percentiles(batch_times),
+        "redis_round_trips_per_message": (CountingRedis.round_trips - round_trips) / messages,
+    }
+
+
+async def run_api_requests(app, requests: int, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        async def post(index):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/send-email/", json=email_payload(index))
+                return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(post(index) for index in range(requests)))
+        return time.perf_counter() - start, results
+
+
+def bench_api(app, requests: int, concurrency: int) -> dict:
+    """
+    Tasa de solicitudes de POST /send-email/ con encolado en SQS (moto).
+    """
+    elapsed, results = asyncio.run(run_api_requests(app, requests, concurrency))
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, status in results if status != 200),
+        "requests_per_second": requests / elapsed,
+        "latency_ms": percentiles([latency for latency, _ in results]),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(args) -> dict:
+    fake_redis = install_fake_redis()
+    results = {}
+
+    # La aplicación escribe logs y prints en stdout; el reporte JSON sale limpio al final
+    with mock_aws(), FakeSendGridServer(args.sendgrid_latency, args.sendgrid_jitter, args.sendgrid_error_rate) as sendgrid, \
+            contextlib.redirect_stdout(sys.stderr):
+        configure_environment(sendgrid.url)
+
+        from app.core.config import EMAIL_PROVIDERS, SQS_QUEUE_URL
+        from app.services.email_service import EmailService
+        from app.workers import sqs_worker
+        from app.main import app
+
+        logging.getLogger().setLevel(args.log_level)
+        create_aws_resources(SQS_QUEUE_URL)
+        provider_configs = unthrottled(EMAIL_PROVIDERS)
+
+        if "send_email" in args.only:
+            fake_redis.flushall()
+            results["send_email"] = bench_send_email(EmailService(provider_configs), args.messages)
+        if "worker" in args.only:
+            fake_redis.flushall()
+            sqs_worker.email_service = EmailService(provider_configs)
+            results["worker"] = bench_worker(sqs_worker, args.batches, args.batch_size, args.duplicate_ratio)
+        if "api" in args.only:
+            results["api"] = bench_api(app, args.requests, args.concurrency)
+
+        results["sendgrid_requests"] = sendgrid.requests
+
+    return results
+
+
+def metric(report: dict, path: str):
+    value = report["results"]
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """
+    Compara dos reportes y devuelve 1 si alguna métrica empeoró más que threshold (fracción).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    regressions = 0
+    print(f"{'métrica':45} {'base':>12} {'actual':>12} {'cambio':>8}")
+    for path, higher_is_better in COMPARED_METRICS.items():
+        before, after = metric(baseline, path), metric(current, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        regressed = (-change if higher_is_better else change) > threshold
+        regressions += regressed
+        print(f"{path:45} {before:12.3f} {after:12.3f} {change:+8.1%}{'  REGRESIÓN' if regressed else ''}")
+    return 1 if regressions else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks offline del servicio de correo.")
+    parser.add_argument("--only", nargs="+", choices=["send_email", "worker", "api"], default=["send_email", "worker", "api"])
+    parser.add_argument("--messages", type=int, default=500, help="Correos para send_email")
+    parser.add_argument("--batches", type=int, default=20, help="Lotes para el worker")
+    parser.add_argument("--batch-size", type=int, default=10, help="Mensajes por lote de SQS")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="Fracción de correos con contenido idéntico")
+    parser.add_argument("--requests", type=int, default=500, help="Solicitudes a /send-email/")
+    parser.add_argument("--concurrency", type=int, default=50, help="Solicitudes simultáneas a la API")
+    parser.add_argument("--sendgrid-latency", type=float, default=0.0, help="Latencia del SendGrid falso en segundos")
+    parser.add_argument("--sendgrid-jitter", type=float, default=0.0, help="Variación de la latencia en segundos")
+    parser.add_argument("--sendgrid-error-rate", type=float, default=0.0, help="Fracción de respuestas 500")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "ACTUAL"), help="Compara dos reportes")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Empeoramiento tolerado al comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "threshold")},
+        "results": run_benchmarks(args),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
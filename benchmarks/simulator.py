@@ -0,0 +1,468 @@
+# benchmarks/simulator.py
+"""
+Simulador determinista de la política de enrutamiento: corre el EmailService real (estrategia,
+salud, latencias, cuotas y circuit breakers) contra proveedores simulados, Redis en memoria
+(fakeredis) y un reloj virtual, para comparar parámetros sin esperar a producción.
+
+Cada proveedor sigue una traza de latencias y errores, sintética o grabada (CSV con las
+columnas time, latency y error). Los correos llegan como un proceso de Poisson y los atienden
+concurrency workers; el reloj sólo avanza lo que tardan los proveedores simulados, no el
+tiempo real. El costo lo pone el código real: los scripts de Lua corren en fakeredis y un
+proceso simula unos 700 mensajes por segundo real (20 000 mensajes tardan unos 25 s), así
+que para grillas grandes conviene repartir los parámetros entre procesos.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.simulator --messages 100000 --rate 50 \\
+        --provider "SendGrid:latency=0.15,jitter=0.3" --provider "Amazon SES:latency=0.25" \\
+        --incident "SendGrid:600:900:error_rate=0.5" \\
+        --latency-threshold 1 2 --fail-max 3 5 --output simulacion.json
+"""
+import argparse
+import bisect
+import csv
+import heapq
+import itertools
+import json
+import logging
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+from unittest import mock
+
+import pybreaker
+
+from .fakes import install_fake_redis
+from .run import percentiles
+
+# Parámetros que se pueden barrer y la constante de la aplicación que reemplazan
+PARAMETERS = {
+    "latency_threshold": "LATENCY_THRESHOLD",
+    "latency_history_size": "LATENCY_HISTORY_SIZE",
+    "max_consecutive_use": "MAX_CONSECUTIVE_USE",
+    "fail_max": "CIRCUIT_BREAKER_FAIL_MAX",
+    "reset_timeout": "CIRCUIT_BREAKER_RESET_TIMEOUT",
+    "routing_strategy": "ROUTING_STRATEGY",
+}
+
+# Reloj real para medir cuánto tarda la simulación, que no se reemplaza al instalar el virtual
+wall_clock = time.perf_counter
+
+# Inicio del reloj virtual (epoch), para que las horas de Redis y de los breakers sean plausibles
+CLOCK_START = 1_700_000_000.0
+
+
+class VirtualClock:
+    """
+    Reloj compartido por time.time, time.monotonic, time.perf_counter y datetime.utcnow
+    mientras está instalado. Sólo avanza con advance() o set().
+    """
+
+    def __init__(self, start: float = CLOCK_START) -> None:
+        self.start = start
+        self.now = start
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+    def set(self, now: float) -> None:
+        self.now = now
+
+    def elapsed(self) -> float:
+        return self.now - self.start
+
+    def datetime_class(self):
+        clock = self
+
+        class VirtualDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcfromtimestamp(clock.now)
+
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.fromtimestamp(clock.now, tz)
+
+        return VirtualDatetime
+
+    @contextmanager
+    def install(self):
+        """
+        Reemplaza las fuentes de tiempo que usan la aplicación, pybreaker y fakeredis.
+        """
+        import app.core.circuit_breaker
+
+        virtual_datetime = self.datetime_class()
+        with ExitStack() as stack:
+            for name in ("time", "monotonic", "perf_counter"):
+                stack.enter_context(mock.patch.object(time, name, lambda: self.now))
+            stack.enter_context(mock.patch.object(pybreaker, "datetime", virtual_datetime))
+            stack.enter_context(mock.patch.object(app.core.circuit_breaker, "datetime", virtual_datetime))
+            yield self
+
+
+@dataclass
+class Incident:
+    """
+    Ventana [start, end) en segundos virtuales en la que el proveedor cambia de latencia o de
+    tasa de error.
+    """
+    start: float
+    end: float
+    latency: Optional[float] = None
+    error_rate: Optional[float] = None
+
+
+@dataclass
+class SyntheticTrace:
+    """
+    Latencia log-normal con mediana latency y dispersión jitter (sigma del logaritmo), errores
+    con probabilidad error_rate e incidentes que los reemplazan durante su ventana.
+    """
+    latency: float = 0.1
+    jitter: float = 0.3
+    error_rate: float = 0.0
+    incidents: list = field(default_factory=list)
+
+    def sample(self, now: float, rng: random.Random) -> tuple:
+        latency, error_rate = self.latency, self.error_rate
+        for incident in self.incidents:
+            if incident.start <= now < incident.end:
+                latency = incident.latency if incident.latency is not None else latency
+                error_rate = incident.error_rate if incident.error_rate is not None else error_rate
+        if self.jitter > 0:
+            latency *= rng.lognormvariate(0.0, self.jitter)
+        return latency, rng.random() < error_rate
+
+
+class RecordedTrace:
+    """
+    Traza grabada: a cada instante le corresponde la última muestra (time, latency, error)
+    anterior. Se repite desde el principio si la simulación dura más que la traza.
+    """
+
+    def __init__(self, samples: list) -> None:
+        if not samples:
+            raise ValueError("La traza no tiene muestras.")
+        self.samples = sorted(samples)
+        self.times = [sample[0] for sample in self.samples]
+        self.duration = self.times[-1] - self.times[0]
+
+    @classmethod
+    def load(cls, path: str) -> "RecordedTrace":
+        with open(path, newline="") as f:
+            return cls([
+                (float(row["time"]), float(row["latency"]), row.get("error", "").strip().lower() in ("1", "true", "yes"))
+                for row in csv.DictReader(f)
+            ])
+
+    def sample(self, now: float, rng: random.Random) -> tuple:
+        offset = now % self.duration if self.duration > 0 else 0.0
+        index = max(bisect.bisect_right(self.times, self.times[0] + offset) - 1, 0)
+        _, latency, failed = self.samples[index]
+        return latency, failed
+
+
+class SimulatedProviderError(Exception):
+    pass
+
+
+class SimulatedProvider:
+    """
+    Proveedor de correo que responde según su traza avanzando el reloj virtual. Si la latencia
+    supera el timeout del intento, espera el timeout y lanza ProviderTimeoutError como los reales.
+    """
+
+    def __init__(self, name: str, trace, clock: VirtualClock, rng: random.Random) -> None:
+        self.name = name
+        self.trace = trace
+        self.clock = clock
+        self.rng = rng
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def send_email(self, to: str, subject: str, body: str, from_email: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        from app.core.exceptions import ProviderTimeoutError
+
+        self.requests += 1
+        latency, failed = self.trace.sample(self.clock.elapsed(), self.rng)
+        if timeout is not None and latency > timeout:
+            self.timeouts += 1
+            self.clock.advance(timeout)
+            raise ProviderTimeoutError(f"{self.name} no respondió en {timeout:.3f} s")
+        self.clock.advance(latency)
+        if failed:
+            self.errors += 1
+            raise SimulatedProviderError(f"{self.name} respondió con un error")
+        return {"provider": self.name}
+
+    def send_template_email(self, to: str, template_id: str, template_vars: dict, from_email: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        return self.send_email(to, template_id, "", from_email, timeout)
+
+
+class BreakerOpenings(pybreaker.CircuitBreakerListener):
+    def __init__(self) -> None:
+        self.count = 0
+
+    def state_change(self, cb, old_state, new_state) -> None:
+        if new_state.name == pybreaker.STATE_OPEN:
+            self.count += 1
+
+
+def default_parameters() -> dict:
+    from app.core import config
+
+    return {name: getattr(config, constant) for name, constant in PARAMETERS.items()}
+
+
+def build_service(parameters: dict, providers: dict, rng: random.Random):
+    """
+    EmailService real con los proveedores simulados, la estrategia y los breakers del juego
+    de parámetros. Los breakers guardan su estado en memoria: el simulador es una sola instancia.
+    """
+    import app.services.email_service as email_service_module
+    from app.core.circuit_breaker import ConcurrentCircuitBreaker
+    from app.core.exceptions import ProviderThrottledError
+    from app.services.routing_strategies import ConsecutiveUseStrategy, PowerOfTwoChoicesStrategy, get_routing_strategy
+
+    # Los proveedores reales no se crean: sus clientes necesitarían credenciales
+    factories = {provider_type: lambda **options: None for provider_type in email_service_module.PROVIDER_FACTORIES}
+    with mock.patch.dict(email_service_module.PROVIDER_FACTORIES, factories):
+        service = email_service_module.EmailService()
+    service.providers = [(provider_name, providers[provider_name]) for provider_name, _ in service.providers]
+
+    strategy = parameters["routing_strategy"]
+    if strategy == "consecutive_use":
+        service.routing_strategy = ConsecutiveUseStrategy(parameters["max_consecutive_use"])
+    elif strategy == "power_of_two_choices":
+        service.routing_strategy = PowerOfTwoChoicesStrategy(rng)
+    else:
+        service.routing_strategy = get_routing_strategy(strategy)
+
+    openings = {provider_name: BreakerOpenings() for provider_name in providers}
+    service.circuit_breakers = {
+        provider_name: ConcurrentCircuitBreaker(
+            fail_max=parameters["fail_max"],
+            reset_timeout=parameters["reset_timeout"],
+            exclude=[ProviderThrottledError],
+            listeners=[openings[provider_name]],
+            name=provider_name
+        )
+        for provider_name in providers
+    }
+    return service, openings
+
+
+def simulate(parameters: dict, traces: dict, messages: int, rate: Optional[float], concurrency: int, seed: int = 0) -> dict:
+    """
+    Simula messages envíos con un juego de parámetros y devuelve el reporte.
+
+    Los correos se atienden en orden de llegada con el primer worker libre; el reloj se pone
+    en el inicio de cada envío y avanza con las llamadas a los proveedores. Los envíos se
+    simulan de a uno, así que lo que registra un envío (latencias, salud, breakers) ya lo ve
+    el siguiente en empezar aunque en tiempo virtual termine después. Sin rate todos llegan
+    al principio, lo que mide el throughput máximo con concurrency workers.
+    """
+    import app.services.email_service as email_service_module
+    from app.core.redis_handler import get_redis_client
+    from app.models import EmailRequest
+
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    providers = {
+        provider_name: SimulatedProvider(provider_name, trace, clock, random.Random(f"{seed}:{provider_name}"))
+        for provider_name, trace in traces.items()
+    }
+
+    with ExitStack() as stack:
+        stack.enter_context(clock.install())
+        for name in ("LATENCY_THRESHOLD", "LATENCY_HISTORY_SIZE"):
+            stack.enter_context(mock.patch.object(email_service_module, name, parameters[name.lower()]))
+        get_redis_client().flushall()
+        service, openings = build_service(parameters, providers, rng)
+
+        workers = [clock.start] * concurrency
+        in_flight = []
+        delivered, failed = [], 0
+        shares = {provider_name: 0 for provider_name in providers}
+        flaps = {provider_name: 0 for provider_name in providers}
+        healthy = {provider_name: True for provider_name in providers}
+        arrival = clock.start
+        last_end = clock.start
+        wall_start = wall_clock()
+        # El enrutamiento no depende del destinatario; validar un EmailRequest por correo sólo sumaría tiempo
+        email_data = EmailRequest(to="user@example.com", subject="Simulación", body="<p>Simulación</p>")
+
+        for _ in range(messages):
+            if rate:
+                arrival += rng.expovariate(rate)
+            start = max(arrival, heapq.heappop(workers))
+            clock.set(start)
+
+            # Envíos de otros workers que siguen en curso en este instante
+            while in_flight and in_flight[0][0] <= start:
+                heapq.heappop(in_flight)
+            service.outstanding = {provider_name: 0 for provider_name in providers}
+            for _, provider_name in in_flight:
+                service.outstanding[provider_name] += 1
+
+            routing_state = service.routing_state.get()
+            for provider_name in providers:
+                if healthy[provider_name] and not routing_state[provider_name]["healthy"]:
+                    flaps[provider_name] += 1
+                healthy[provider_name] = routing_state[provider_name]["healthy"]
+
+            try:
+                provider_name = service.send_email(email_data)
+            except Exception:
+                failed += 1
+            else:
+                shares[provider_name] += 1
+                delivered.append(clock.now - arrival)
+                heapq.heappush(in_flight, (clock.now, provider_name))
+
+            heapq.heappush(workers, clock.now)
+            last_end = max(last_end, clock.now)
+
+        wall_seconds = wall_clock() - wall_start
+
+    duration = last_end - clock.start
+    return {
+        "parameters": parameters,
+        "messages": messages,
+        "delivered": len(delivered),
+        "failed": failed,
+        "virtual_seconds": duration,
+        "throughput": len(delivered) / duration if duration else 0.0,
+        "delivery_latency_ms": percentiles(delivered),
+        "provider_share": {provider_name: count / messages for provider_name, count in shares.items()},
+        "flaps": flaps,
+        "breaker_openings": {provider_name: listener.count for provider_name, listener in openings.items()},
+        "provider_requests": {provider_name: provider.requests for provider_name, provider in providers.items()},
+        "provider_errors": {provider_name: provider.errors for provider_name, provider in providers.items()},
+        "provider_timeouts": {provider_name: provider.timeouts for provider_name, provider in providers.items()},
+        "wall_seconds": wall_seconds,
+    }
+
+
+def parse_options(text: str) -> dict:
+    """
+    "latency=0.2,error_rate=0.01" -> {"latency": 0.2, "error_rate": 0.01}
+    """
+    options = {}
+    for item in filter(None, text.split(",")):
+        key, _, value = item.partition("=")
+        options[key.strip()] = float(value)
+    return options
+
+
+def build_traces(args) -> dict:
+    """
+    Traza por proveedor: grabada (--trace), sintética (--provider) o la sintética por defecto,
+    con los incidentes de --incident.
+    """
+    traces = {provider_name: SyntheticTrace() for provider_name in args.provider_names}
+    for spec in args.provider:
+        provider_name, _, options = spec.partition(":")
+        traces[provider_name] = SyntheticTrace(**parse_options(options))
+    for spec in args.incident:
+        provider_name, start, end, options = (spec.split(":", 3) + [""])[:4]
+        if not isinstance(traces.get(provider_name), SyntheticTrace):
+            raise ValueError(f"Los incidentes sólo se aplican a trazas sintéticas: {provider_name}")
+        traces[provider_name].incidents.append(Incident(float(start), float(end), **parse_options(options)))
+    for spec in args.trace:
+        provider_name, _, path = spec.partition("=")
+        traces[provider_name] = RecordedTrace.load(path)
+
+    unknown = set(traces) - set(args.provider_names)
+    if unknown:
+        raise ValueError(f"Proveedores desconocidos: {', '.join(sorted(unknown))}")
+    return traces
+
+
+def parameter_grid(args) -> list:
+    """
+    Producto cartesiano de los valores de cada parámetro (los de config.py si no se indican).
+    """
+    defaults = default_parameters()
+    values = [getattr(args, name) or [defaults[name]] for name in PARAMETERS]
+    return [dict(zip(PARAMETERS, combination)) for combination in itertools.product(*values)]
+
+
+def run_parameter_set(args, parameters: dict) -> dict:
+    install_fake_redis()
+    logging.getLogger().setLevel(args.log_level)
+    return simulate(parameters, build_traces(args), args.messages, args.rate, args.concurrency, args.seed)
+
+
+def print_table(reports: list, stream=sys.stderr) -> None:
+    columns = [name for name in PARAMETERS if len({json.dumps(report["parameters"][name]) for report in reports}) > 1]
+    header = "".join(f"{name:>22}" for name in columns)
+    print(f"{header}{'envíos/s':>12}{'p99 ms':>12}{'fallidos':>10}{'flaps':>8}{'aperturas':>11}  reparto", file=stream)
+    for report in reports:
+        values = "".join(f"{str(report['parameters'][name]):>22}" for name in columns)
+        share = " ".join(f"{name}={value:.0%}" for name, value in report["provider_share"].items())
+        print(
+            f"{values}{report['throughput']:12.1f}{report['delivery_latency_ms'].get('p99', math.nan):12.1f}"
+            f"{report['failed']:10d}{sum(report['flaps'].values()):8d}{sum(report['breaker_openings'].values()):11d}  {share}",
+            file=stream
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador determinista de la política de enrutamiento.")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=20.0, help="Correos por segundo virtual (0: todos al inicio)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Envíos simultáneos (workers)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--provider", action="append", default=[], metavar="NOMBRE:latency=..,jitter=..,error_rate=..",
+                        help="Traza sintética de un proveedor")
+    parser.add_argument("--incident", action="append", default=[], metavar="NOMBRE:INICIO:FIN:latency=..,error_rate=..",
+                        help="Incidente en la traza sintética de un proveedor (segundos virtuales)")
+    parser.add_argument("--trace", action="append", default=[], metavar="NOMBRE=ARCHIVO.csv",
+                        help="Traza grabada con columnas time, latency y error")
+    parser.add_argument("--latency-threshold", type=float, nargs="+")
+    parser.add_argument("--latency-history-size", type=int, nargs="+")
+    parser.add_argument("--max-consecutive-use", type=int, nargs="+")
+    parser.add_argument("--fail-max", type=int, nargs="+")
+    parser.add_argument("--reset-timeout", type=float, nargs="+")
+    parser.add_argument("--routing-strategy", nargs="+")
+    parser.add_argument("--processes", type=int, default=1, help="Juegos de parámetros simulados en paralelo")
+    parser.add_argument("--log-level", default="CRITICAL", help="Los envíos fallidos ya se cuentan en el reporte")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    install_fake_redis()
+    from app.core.config import EMAIL_PROVIDERS
+
+    args.provider_names = [provider_config["name"] for provider_config in EMAIL_PROVIDERS]
+    build_traces(args)
+    grid = parameter_grid(args)
+
+    if args.processes > 1:
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            reports = list(pool.map(run_parameter_set, [args] * len(grid), grid))
+    else:
+        reports = [run_parameter_set(args, parameters) for parameters in grid]
+
+    print_table(reports)
+    output = json.dumps({"seed": args.seed, "messages": args.messages, "rate": args.rate, "reports": reports}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())